@@ -0,0 +1,203 @@
+"""
+Benchmarks of `LoremGenerator` and `ChineseGenerator`.
+Runs offline on `text_data_example/` and on synthetic corpora of the
+given sizes, saves the results as JSON and can compare them with a
+previous run.
+
+Usage (from the project root):
+python -m benchmarks.bench_lorem --output bench.json
+python -m benchmarks.bench_lorem --sizes 1 4 --words 5 64 1024 --output new.json --compare bench.json
+"""
+
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .corpora import EXAMPLE_DIRECTORY, make_synthetic_corpus, import_generator_module
+
+
+def measure(func: Callable[[], object], min_runs: int, min_time: float) -> Dict[str, float]:
+    """
+    Runs the function at least `min_runs` times and at least `min_time`
+    seconds, returns the statistics of one run in seconds.
+    """
+
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < min_runs or time.perf_counter() - started < min_time:
+        run_started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - run_started)
+        if len(timings) >= 10 * min_runs and time.perf_counter() - started > min_time:
+            break
+    return {
+        "runs": len(timings),
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+    }
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.results: List[dict] = []
+
+    def run(self, name: str, params: dict, func: Callable[[], object], min_runs: Optional[int] = None):
+        stats = measure(func, min_runs or self.args.min_runs, self.args.min_time)
+        self.results.append({"name": name, "params": params, **stats})
+        params_str = " ".join(f"{key}={value}" for key, value in params.items())
+        print(
+            f"{name:<18} {params_str:<44} median {stats['median'] * 1000:>10.3f} ms"
+            f"  min {stats['min'] * 1000:>10.3f} ms  ({stats['runs']} runs)"
+        )
+
+    def run_corpus(self, corpus_name: str, corpus_dir: Path, module, workdir: Path):
+        args = self.args
+        index_dir = str(workdir / f"index_{corpus_name}")
+
+        # the first load builds the suffix arrays, the next ones read them
+        self.run(
+            "corpus_index_build",
+            {"corpus": corpus_name},
+            lambda: module.LoremGenerator(str(corpus_dir), index_dir).load(),
+            min_runs=1,
+        )
+        self.run(
+            "corpus_load",
+            {"corpus": corpus_name},
+            lambda: module.LoremGenerator(str(corpus_dir), index_dir).load(),
+            min_runs=3,
+        )
+        generator = module.LoremGenerator(str(corpus_dir), index_dir)
+        generator.load()
+        chinese = module.ChineseGenerator(str(corpus_dir / "chinese.txt"))
+
+        languages = args.languages or generator.languages
+        for language in languages:
+            for chars_len in args.chars:
+                for words in args.words:
+                    params = {"corpus": corpus_name, "lang": language, "words": words, "chars_len": chars_len}
+                    self.run(
+                        "generate_lorem",
+                        params,
+                        lambda: generator.generate_lorem(language, words, chars_len),
+                    )
+
+                for sentences in args.sentences:
+                    params = {"corpus": corpus_name, "lang": language, "sentences": sentences, "chars_len": chars_len}
+                    self.run(
+                        "generate_sentences",
+                        params,
+                        lambda: generator.generate_sentences(language, sentences, chars_len),
+                    )
+
+            # the processing steps on a fixed raw text
+            random.seed(args.seed)
+            words = max(args.words)
+            raw_text = generator.generate_raw_lorem(
+                language,
+                generator.default_chars_len,
+                lambda text: text.count(" ") >= words,
+            )
+            text = generator.postprocess_lorem(raw_text)
+            params = {"corpus": corpus_name, "lang": language, "words": words}
+            self.run("postprocess_lorem", params, lambda: generator.postprocess_lorem(raw_text))
+            self.run("clear_text", params, lambda: generator.clear_text(text))
+
+        for count in args.chinese:
+            self.run("get_chinese", {"corpus": corpus_name, "count": count}, lambda: chinese.get_chinese(count))
+
+
+def get_meta(args: argparse.Namespace) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ""
+    return {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "args": vars(args),
+    }
+
+
+def compare(results: List[dict], baseline_path: Path, threshold: float) -> bool:
+    """
+    Prints the ratio of the medians to the baseline. Returns False if
+    something has become slower than `threshold` times.
+    """
+
+    with open(baseline_path, "r", encoding="utf8") as file:
+        baseline = json.load(file)
+    key = lambda result: (result["name"], json.dumps(result["params"], sort_keys=True))
+    old = {key(result): result for result in baseline["results"]}
+
+    is_ok = True
+    print(f"\nComparison with {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for result in results:
+        old_result = old.get(key(result))
+        if old_result is None:
+            continue
+        ratio = result["median"] / old_result["median"]
+        mark = ""
+        if ratio > threshold:
+            mark = "  <-- REGRESSION"
+            is_ok = False
+        params_str = " ".join(f"{k}={v}" for k, v in result["params"].items())
+        print(f"{result['name']:<18} {params_str:<44} x{ratio:.2f}{mark}")
+    return is_ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=float, nargs="*", default=[], help="synthetic corpora sizes, MB")
+    parser.add_argument("--no-example", action="store_true", help="skip `text_data_example/`")
+    parser.add_argument("--languages", nargs="*", default=[])
+    parser.add_argument("--words", type=int, nargs="+", default=[5, 64, 256, 1024, 10000])
+    parser.add_argument("--chars", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--sentences", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--chinese", type=int, nargs="+", default=[8, 24, 1024])
+    parser.add_argument("--min-runs", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per case")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="JSON file for the results")
+    parser.add_argument("--compare", type=Path, help="JSON file of a previous run")
+    parser.add_argument("--threshold", type=float, default=1.2, help="allowed slowdown ratio")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    module, workdir = import_generator_module(EXAMPLE_DIRECTORY)
+    benchmark = Benchmark(args)
+    try:
+        if not args.no_example:
+            benchmark.run_corpus("example", EXAMPLE_DIRECTORY, module, workdir)
+        for size in args.sizes:
+            corpus_dir = make_synthetic_corpus(workdir / f"synthetic_{size:g}", size, args.seed)
+            benchmark.run_corpus(f"synthetic_{size:g}mb", corpus_dir, module, workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as file:
+            json.dump({"meta": get_meta(args), "results": benchmark.results}, file, indent=2, default=str)
+        print(f"\nResults are saved to {args.output}")
+
+    if args.compare and not compare(benchmark.results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark of the dispatch cost per update: the `CommandRouter` against
+the linear walk over `CommandHandler`/`MessageHandler` objects that PTB
+does for the same handlers. Only the choice of the handler (with the
+argument parsing) is measured, the callbacks are not called.
+
+Usage (from the project root, `.envs` and `text_data/` are required,
+because the handlers are imported):
+python -m benchmarks.bench_router --bot test
+"""
+
+import argparse
+from typing import List, Optional
+
+from telegram import Bot, Update, User
+from telegram.ext import BaseHandler, CommandHandler, MessageHandler
+
+from .bench_lorem import measure
+
+
+TEXTS = [
+    "/lorem en 128 3",
+    "/generate",
+    "/help /lorem",
+    "/translate lin de fi",
+    "/start",
+    "/unknown_command",
+    "/lorem@loremtest_bot ru",
+    "+",
+    "just a message",
+]
+
+
+def make_updates(bot: Bot) -> List[Update]:
+    updates = []
+    for update_id, text in enumerate(TEXTS, 1):
+        message = {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "user"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            length = len(text.split(maxsplit=1)[0])
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": length}]
+        updates.append(Update.de_json({"update_id": update_id, "message": message}, bot))
+    return updates
+
+
+def dispatch_linear(handlers: List[BaseHandler], update: Update) -> Optional[BaseHandler]:
+    # as `Application.process_update` does for one group
+    for handler in handlers:
+        check = handler.check_update(update)
+        if not (check is None or check is False):
+            return handler
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--bot", choices=["user", "admin", "test"], default="test")
+    parser.add_argument("--repeat", type=int, default=1000, help="updates per measured run")
+    parser.add_argument("--min-runs", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=1.0)
+    args = parser.parse_args()
+
+    import bot as bot_module
+    from router import CommandRouter
+
+    handlers = getattr(bot_module, f"get_{args.bot}_handlers")()
+    bot = Bot("123:token")
+    bot._bot_user = User(123, "loremtest", True, username="loremtest_bot")
+    updates = make_updates(bot) * (args.repeat // len(TEXTS))
+
+    async def callback(update, context):
+        pass
+
+    ptb_handlers: List[BaseHandler] = []
+    router = CommandRouter()
+    for handler in handlers:
+        if isinstance(handler, bot_module.Command):
+            ptb_handlers.append(CommandHandler(handler.name, callback, handler.filters, False))
+            router.add_command(handler.name, callback, handler.filters)
+        else:
+            ptb_handlers.append(MessageHandler(handler.filters, callback, False))
+            router.add_message(callback, handler.filters)
+
+    cases = {
+        "linear": lambda: [dispatch_linear(ptb_handlers, update) for update in updates],
+        "router": lambda: [router.check_update(update) for update in updates],
+    }
+    print(f"{len(handlers)} handlers of the <{args.bot}> bot, {len(updates)} updates per run")
+    for name, func in cases.items():
+        stats = measure(func, args.min_runs, args.min_time)
+        per_update = stats["median"] / len(updates) * 10 ** 6
+        print(f"{name:<8} {per_update:>8.2f} us per update  ({stats['runs']} runs)")
+
+
+if __name__ == "__main__":
+    main()
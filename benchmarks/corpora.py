@@ -0,0 +1,76 @@
+"""
+Corpora for the benchmarks: the example texts from `text_data_example/`
+and synthetic corpora of a given size built from their words.
+"""
+
+import random
+import tempfile
+import importlib
+from pathlib import Path
+from types import ModuleType
+from typing import Tuple
+
+
+__all__ = [
+    "EXAMPLE_DIRECTORY",
+    "make_synthetic_corpus",
+    "import_generator_module",
+]
+
+
+EXAMPLE_DIRECTORY = Path(__file__).absolute().parent.parent / "text_data_example"
+
+
+def make_synthetic_corpus(
+        target_dir: Path,
+        size_mb: float,
+        seed: int = 0,
+        source_dir: Path = EXAMPLE_DIRECTORY,
+) -> Path:
+    """
+    Builds a corpus of `size_mb` megabytes per language: random words of
+    the example texts with random punctuation. The result for the same
+    seed is always the same.
+    """
+
+    rng = random.Random(seed)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    size = int(size_mb * 1024 * 1024)
+
+    for lang_dir in sorted(source_dir.iterdir()):
+        # `.index` keeps the cached indexes
+        if not lang_dir.is_dir() or lang_dir.name.startswith("."):
+            continue
+        words = []
+        for file_path in sorted(lang_dir.glob("*.txt")):
+            words.extend(file_path.read_text(encoding="utf8").split())
+
+        target_lang_dir = target_dir / lang_dir.name
+        target_lang_dir.mkdir(exist_ok=True)
+        with open(target_lang_dir / "synthetic.txt", "w", encoding="utf8") as file:
+            written = 0
+            while written < size:
+                line = " ".join(rng.choices(words, k=12)) + rng.choice(".,!? ") + "\n"
+                file.write(line)
+                written += len(line.encode("utf8"))
+
+    chinese = (source_dir / "chinese.txt").read_text(encoding="utf8")
+    chinese_size = max(len(chinese), size // 3)  # 3 bytes per character
+    (target_dir / "chinese.txt").write_text(
+        "".join(rng.choices(chinese, k=chinese_size)),
+        encoding="utf8",
+    )
+    return target_dir
+
+
+def import_generator_module(corpus_dir: Path) -> Tuple[ModuleType, Path]:
+    """
+    Imports `lorem_generator` (its global generators read nothing until
+    used) and creates a temporary working directory for the synthetic
+    corpora and the suffix arrays.
+    Returns the module and the working directory.
+    """
+
+    workdir = Path(tempfile.mkdtemp(prefix="lorem_bench_"))
+    module = importlib.import_module("lorem_generator")
+    return module, workdir
@@ -1,6 +1,7 @@
+import asyncio
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import List, Optional, Type
+from typing import List, Optional
 
 from telegram import (
     Update,
@@ -9,15 +10,16 @@ from telegram import (
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
 )
-from telegram.ext import (
-    Application,
-    BaseHandler,
-    CommandHandler,
-    MessageHandler,
-)
+from telegram.ext import Application, Updater
 from telegram.ext.filters import BaseFilter, ChatType, Text, TEXT
 
+from envs import envs
 from logger import logger
+from webhook import WebhookServer
+from metrics import start_metrics_server, start_loop_lag_monitor
+from dispatcher import UpdateDispatcher
+from router import CommandRouter
+from profiler import profiler
 from handlers import (
     HandlersType,
     HandlerDecorator,
@@ -39,10 +41,18 @@ from handlers import (
     command_lorem_tt,
     command_translate,
     repeat_command,
+    command_profile,
+    command_memory,
 )
 
 
 __all__ = [
+    "Handler",
+    "Command",
+    "Message",
+    "get_user_handlers",
+    "get_admin_handlers",
+    "get_test_handlers",
     "user_bot_init",
     "admin_bot_init",
     "test_bot_init",
@@ -58,53 +68,65 @@ class Handler(ABC):
     func: HandlersType
     name: str = ""
     filters: BaseFilter = BaseFilter()
-    command_type: Type[BaseHandler] = BaseHandler
     description: Optional[str] = ""
     to_button: Optional[bool] = False
     _with_decorator: bool = True
 
     @abstractmethod
-    def get_args(self, decorator: HandlerDecorator) -> tuple:
+    def add_to_router(self, router: CommandRouter, decorator: HandlerDecorator):
         """
-        Returns the parameters required for initializing `self.command_type`.
+        Adds the handler to the dispatch table of the bot.
         """
         pass
 
 
 @dataclass
 class Command(Handler):
-    command_type: Type[BaseHandler] = CommandHandler
-
-    def get_args(self, decorator: HandlerDecorator) -> tuple:
-        return (self.name, decorator(self.func), self.filters, False)
+    def add_to_router(self, router: CommandRouter, decorator: HandlerDecorator):
+        router.add_command(self.name, decorator(self.func), self.filters)
 
 
 @dataclass
 class Message(Handler):
-    command_type: Type[BaseHandler] = MessageHandler
-
-    def get_args(self, decorator: HandlerDecorator) -> tuple:
+    def add_to_router(self, router: CommandRouter, decorator: HandlerDecorator):
         func = decorator(self.func) if self._with_decorator else self.func
-        return (self.filters, func, False)
+        router.add_message(func, self.filters)
 
 
 # =============================================================================
 
 
-async def bot_init(token: str, log_name: str, handlers: List[Handler]):
+async def bot_init(
+        token: str,
+        log_name: str,
+        handlers: List[Handler],
+        webhook_server: Optional[WebhookServer] = None,
+):
     """
     The function that starts the bot. Adds all commands, buttons, menu
     and puts the bot in run mode.
+    If the webhook server is passed, the bot receives updates through
+    it, otherwise long polling is used. In both cases the updates are
+    processed by `UpdateDispatcher` with `envs["WORKERS"][log_name]`
+    workers.
     """
 
-    # bot creation
-    app = Application.builder().token(token).build()
-
-    # add all commands
+    # bot creation; the updates are fetched by the dispatcher, not by the
+    # application itself
+    builder = Application.builder().token(token).updater(None)
+    if "TELEGRAM_API_URL" in envs:
+        # for example, a local fake Telegram for testing
+        builder = builder.base_url(envs["TELEGRAM_API_URL"])
+    app = builder.build()
+    workers = envs.get("WORKERS", {}).get(log_name, 1)
+    dispatcher = UpdateDispatcher(app, workers)
+
+    # add all commands to one dispatch table
     handler_decorator = HandlerDecorator.get_decorator(log_name, app)
+    router = CommandRouter()
     for handler in handlers:
-        handler_obj = handler.command_type(*handler.get_args(handler_decorator))
-        app.add_handler(handler_obj)
+        handler.add_to_router(router, handler_decorator)
+    app.add_handler(router)
 
     # creating a menu of available commands
     bot_commands = [
@@ -133,20 +155,36 @@ async def bot_init(token: str, log_name: str, handlers: List[Handler]):
     # bot startup
     allowed_updates = [Update.MESSAGE, Update.CHANNEL_POST, Update.POLL_ANSWER]
     await app.initialize()
-    await app.updater.start_polling(allowed_updates=allowed_updates)
+    if webhook_server is not None:
+        path = webhook_server.add_bot(log_name, token, dispatcher)
+        url = envs["WEBHOOK"]["url"].rstrip("/") + path
+        await app.bot.set_webhook(url, allowed_updates=allowed_updates)
+    else:
+        updater = Updater(app.bot, asyncio.Queue())
+        await updater.initialize()
+        await updater.start_polling(allowed_updates=allowed_updates)
+        dispatcher.listen(updater.update_queue)
     await app.start()
     logger(f"Bot <{log_name}> has started")
-    print(f"Bot <{log_name}> has started")
+
+    # all are started once per process
+    start_loop_lag_monitor()
+    profiler.start_from_envs(envs.get("PROFILE", {}))
+    if "METRICS" in envs:
+        start_metrics_server(
+            envs["METRICS"].get("host", "127.0.0.1"),
+            envs["METRICS"].get("port", 9100),
+        )
 
 
 # =============================================================================
 
 
-async def user_bot_init(token):
+def get_user_handlers() -> List[Handler]:
     """
-    Function to start a bot for users.
+    Handlers of the bot for users.
     """
-    commands = [
+    return [
         Command(command_start_user, "start", TEXT & ChatType.PRIVATE),
         Command(command_generate, "generate", TEXT, description="сгенерировать фразу 🅰️", to_button=True),
         Command(command_chinese, "chinese", TEXT, description="перевод китайских символов 🈲", to_button=True),
@@ -155,14 +193,20 @@ async def user_bot_init(token):
         Message(received_message, filters=TEXT & ChatType.PRIVATE),
         Message(new_channel_post, filters=TEXT & ChatType.CHANNEL, _with_decorator=False),
     ]
-    await bot_init(token, "user", commands)
 
 
-async def admin_bot_init(token):
+async def user_bot_init(token, webhook_server: Optional[WebhookServer] = None):
     """
-    Function to start a bot for admins.
+    Function to start a bot for users.
+    """
+    await bot_init(token, "user", get_user_handlers(), webhook_server)
+
+
+def get_admin_handlers() -> List[Handler]:
+    """
+    Handlers of the bot for admins.
     """
-    commands = [
+    return [
         Command(command_start_admin, "start", TEXT & ChatType.PRIVATE),
         Command(command_generate_wat, "gen", TEXT, description="сгенерировать фразу Watson 🇼️️", to_button=True),
         Command(command_lorem_tt, "lorem_tt", TEXT, description="сгенерировать псевдотатарское 📃", to_button=True),
@@ -172,17 +216,25 @@ async def admin_bot_init(token):
         Command(command_generate_absurd, "generate_absurd", TEXT, description="сгенерировать абсурдоткекст 🔤"),
         Command(command_translate, "translate", TEXT, description="перевод по сообщения 🔄"),
         Command(command_help_admin, "help", TEXT, description="справка 🧐"),
+        Command(command_profile, "profile", TEXT),
+        Command(command_memory, "memory", TEXT),
         Message(repeat_command, filters=Text(["+"])),
         Message(received_message, filters=TEXT & ChatType.PRIVATE),
     ]
-    await bot_init(token, "admin", commands)
 
 
-async def test_bot_init(token):
+async def admin_bot_init(token, webhook_server: Optional[WebhookServer] = None):
     """
-    Function to start a test bot.
+    Function to start a bot for admins.
+    """
+    await bot_init(token, "admin", get_admin_handlers(), webhook_server)
+
+
+def get_test_handlers() -> List[Handler]:
+    """
+    Handlers of the test bot.
     """
-    commands = [
+    return [
         Command(command_start_admin, "start", TEXT & ChatType.PRIVATE),
         Command(command_generate_wat, "gen", TEXT, description="сгенерировать фразу Watson 🇼️️", to_button=True),
         Command(command_lorem_tt, "lorem_tt", TEXT, description="сгенерировать псевдотатарское 📃", to_button=True),
@@ -194,8 +246,16 @@ async def test_bot_init(token):
         Command(command_lorem_full, "lorem_full", TEXT, description="сгенерировать псевдотекст со знаками 📋"),
         Command(command_translate, "translate", TEXT, description="перевод по сообщения 🔄"),
         Command(command_help_admin, "help", TEXT, description="справка 🧐"),
+        Command(command_profile, "profile", TEXT),
+        Command(command_memory, "memory", TEXT),
         Message(repeat_command, filters=Text(["+"])),
         Message(received_message, filters=TEXT & ChatType.PRIVATE),
         Message(new_channel_post, filters=TEXT & ChatType.CHANNEL, _with_decorator=False),
     ]
-    await bot_init(token, "test", commands)
+
+
+async def test_bot_init(token, webhook_server: Optional[WebhookServer] = None):
+    """
+    Function to start a test bot.
+    """
+    await bot_init(token, "test", get_test_handlers(), webhook_server)
@@ -0,0 +1,104 @@
+"""
+Caches of the replies and the translations.
+Every reply made with a random generator gets a descriptor (command,
+arguments, seed): the same descriptor gives the same reply (see
+`lorem_generator.new_seed`). The descriptors are remembered by the
+command messages, so "+" on a command message returns the saved reply,
+or, if it is already evicted, repeats the command with the same seed.
+The successful translations are cached by the text and the parameters,
+so the repeated translation of the same text is not requested again.
+"""
+
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
+
+from telegram import Message
+
+from envs import envs
+
+
+__all__ = [
+    "LRUCache",
+    "ReplyDescriptor",
+    "ReplyCache",
+    "message_key",
+    "replay_seed",
+    "reply_cache",
+    "translation_cache",
+]
+
+
+Key = TypeVar("Key", bound=Hashable)
+Value = TypeVar("Value")
+
+# (command, arguments, seed)
+ReplyDescriptor = Tuple[str, Tuple[str, ...], int]
+# (bot id, chat id, message id)
+MessageKey = Tuple[int, int, int]
+
+
+class LRUCache(Generic[Key, Value]):
+    """
+    A dictionary of at most `maxsize` recently used items.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.items: OrderedDict = OrderedDict()
+
+    def get(self, key: Key) -> Optional[Value]:
+        value = self.items.get(key)
+        if value is not None:
+            self.items.move_to_end(key)
+        return value
+
+    def put(self, key: Key, value: Value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class ReplyCache:
+    """
+    The descriptors of the replies by their command messages and the
+    replies by their descriptors. There are many more descriptors than
+    replies, because they are small.
+    """
+
+    def __init__(self, messages: int = 10000, replies: int = 1000):
+        self.descriptors: LRUCache[MessageKey, ReplyDescriptor] = LRUCache(messages)
+        self.replies: LRUCache[ReplyDescriptor, str] = LRUCache(replies)
+
+    def remember(self, message: MessageKey, descriptor: ReplyDescriptor, reply: str):
+        self.descriptors.put(message, descriptor)
+        self.replies.put(descriptor, reply)
+
+    def lookup(self, message: MessageKey) -> Tuple[Optional[ReplyDescriptor], Optional[str]]:
+        """
+        Returns the descriptor of the reply to the message and the reply
+        itself (None if they are not known).
+        """
+
+        descriptor = self.descriptors.get(message)
+        if descriptor is None:
+            return None, None
+        return descriptor, self.replies.get(descriptor)
+
+
+def message_key(message: Message) -> MessageKey:
+    # the ids of the messages are unique only in a chat of one bot
+    return message.get_bot().id, message.chat_id, message.message_id
+
+
+# the seed for the repeated command, used instead of a new one
+replay_seed: ContextVar[Optional[int]] = ContextVar("replay_seed", default=None)
+
+cache_sizes = envs.get("CACHE", {})
+reply_cache = ReplyCache(cache_sizes.get("messages", 10000), cache_sizes.get("replies", 1000))
+# (text, translator, from, to) -> translated text
+translation_cache: LRUCache[Tuple[str, str, str, str], str] = LRUCache(cache_sizes.get("translations", 1000))
@@ -0,0 +1,229 @@
+"""
+A suffix array of a corpus for the lorem generation.
+The generator needs a random occurrence of the buffer (the last
+`chars_len` characters) in the corpus. `str.find` from a random place
+scans the text until the first occurrence, which is long for rare
+buffers and grows with the corpus. In the suffix array all the
+occurrences of a string form one range, which is found by two binary
+searches (O(m log n)), and a random occurrence is a random element of
+the range (O(1)).
+
+The suffixes are sorted only by their first `max_chars` characters (the
+longest buffer), which is enough for the search and is much cheaper to
+build. The text is looped: the suffixes near the end continue from the
+beginning, as in the generator (the index keeps the text itself, the
+same string as the generator, and only a short looped copy of its end).
+The array is built once (seconds per megabyte) and cached on disk next
+to the corpus; the cache is checked by the hash of the text.
+
+The array takes 4 bytes per character (`array("I")`), about as much as
+the text itself (1, 2 or 4 bytes per character). The build needs 12
+more bytes per character for the prefix keys and the buckets, and the
+Python integers of only one bucket at a time (see `sort_suffixes`).
+"""
+
+import os
+import hashlib
+from array import array
+from pathlib import Path
+from random import Random
+from typing import Dict, Iterator, List, Tuple, Union
+
+
+Keys = Union[array, List[int]]
+
+
+__all__ = [
+    "CorpusIndex",
+]
+
+
+class CorpusIndex:
+    max_chars = 8
+    cache_magic = b"LOREMSA1"
+    # the found ranges are remembered, the short buffers repeat all
+    # the time
+    max_cached_ranges = 200_000
+
+    def __init__(self, text: str, suffix_array: array):
+        self.length = len(text)
+        self.text = text
+        # the characters from `tail_start` looped twice as long as the
+        # longest buffer, so the buffer after any occurrence is taken
+        # without wrapping (and without a looped copy of the whole text)
+        self.tail_start = max(self.length - self.max_chars, 0)
+        looped = text * (3 * self.max_chars // max(self.length, 1) + 1)
+        self.tail = (text[self.tail_start:] + looped)[:3 * self.max_chars]
+        self.suffix_array = suffix_array
+        self.ranges: Dict[str, Tuple[int, int]] = {}
+
+    @staticmethod
+    def key_bits(text: str) -> int:
+        """
+        The number of bits of one character in the prefix keys.
+        """
+        return max(1, (len(set(text)) - 1).bit_length())
+
+    @classmethod
+    def prefix_keys(cls, text: str) -> Keys:
+        """
+        Returns the next `max_chars` characters (looped) of every position
+        of the text as one integer: the characters are replaced by their
+        ranks, so the integers have the same order as the strings.
+        The keys are in `array("Q")` if they fit in 64 bits (up to 256
+        different characters), otherwise in a list.
+        """
+
+        length = len(text)
+        alphabet = sorted(set(text))
+        codes = {char: code for code, char in enumerate(alphabet)}
+        bits = cls.key_bits(text)
+        mask = (1 << (bits * cls.max_chars)) - 1
+
+        looped = text + (text * (cls.max_chars // max(length, 1) + 1))[:cls.max_chars]
+        key = 0
+        for char in looped[:cls.max_chars]:
+            key = (key << bits) | codes[char]
+        keys: Keys = array("Q", bytes(8 * length)) if bits * cls.max_chars <= 64 else [0] * length
+        for position in range(length):
+            keys[position] = key
+            key = ((key << bits) & mask) | codes[looped[position + cls.max_chars]]
+        return keys
+
+    @classmethod
+    def sort_suffixes(cls, text: str) -> array:
+        """
+        Sorts the positions of the text by the next `max_chars` characters
+        (looped).
+        The positions are split into buckets by their first two characters
+        and the buckets are sorted one by one, so the sort holds the keys
+        as Python integers only for one bucket, not for the whole text.
+        The order is the same as of one stable sort by the keys.
+        """
+
+        keys = cls.prefix_keys(text)
+        shift = cls.key_bits(text) * (cls.max_chars - 2)
+        buckets: Dict[int, array] = {}
+        for position, key in enumerate(keys):
+            bucket = buckets.get(key >> shift)
+            if bucket is None:
+                bucket = buckets[key >> shift] = array("I")
+            bucket.append(position)
+
+        suffix_array = array("I")
+        for prefix in sorted(buckets):
+            suffix_array.extend(sorted(buckets.pop(prefix), key=keys.__getitem__))
+        return suffix_array
+
+    @classmethod
+    def build(cls, text: str) -> "CorpusIndex":
+        return cls(text, cls.sort_suffixes(text))
+
+    @staticmethod
+    def text_digest(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf8"), digest_size=16).digest()
+
+    @classmethod
+    def load_or_build(cls, text: str, cache_path: Union[str, Path]) -> "CorpusIndex":
+        """
+        Loads the suffix array from the cache file if it was built for the
+        same text, otherwise builds it and saves to the file.
+        """
+
+        digest = cls.text_digest(text)
+        header = cls.cache_magic + digest
+        try:
+            with open(cache_path, "rb") as file:
+                if file.read(len(header)) == header:
+                    suffix_array = array("I")
+                    suffix_array.frombytes(file.read())
+                    if len(suffix_array) == len(text):
+                        return cls(text, suffix_array)
+        except FileNotFoundError:
+            pass
+
+        index = cls.build(text)
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        # several processes may build the same index at once
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(header)
+            index.suffix_array.tofile(file)
+        os.replace(temp_path, cache_path)
+        return index
+
+    def find_range(self, buffer: str) -> Tuple[int, int]:
+        """
+        Returns the range of the suffix array with all the occurrences of
+        the buffer (no longer than `max_chars`).
+        """
+
+        chars = self.chars
+        suffix_array = self.suffix_array
+        size = len(buffer)
+
+        low, high = 0, len(suffix_array)
+        while low < high:
+            middle = (low + high) // 2
+            if chars(suffix_array[middle], size) < buffer:
+                low = middle + 1
+            else:
+                high = middle
+        start = low
+
+        high = len(suffix_array)
+        while low < high:
+            middle = (low + high) // 2
+            if chars(suffix_array[middle], size) <= buffer:
+                low = middle + 1
+            else:
+                high = middle
+        return start, low
+
+    def chars(self, position: int, size: int) -> str:
+        """
+        The `size` characters of the looped text from the position (less
+        than `length + max_chars`).
+        """
+
+        if position < self.tail_start:
+            return self.text[position:position + size]
+        position -= self.tail_start
+        return self.tail[position:position + size]
+
+    def walk(self, chars_len: int, rng: Random, chunk_size: int = 16) -> Iterator[str]:
+        """
+        Yields the text of the generation endlessly, by chunks of
+        `chunk_size` buffers: `chars_len` characters from a random place,
+        then the characters after a random occurrence of the previous
+        buffer, and so on.
+        The loop is written out (no calls per buffer except the random
+        number), because it is the hot path of the generation.
+        """
+
+        text = self.text
+        tail = self.tail
+        tail_start = self.tail_start
+        suffix_array = self.suffix_array
+        ranges = self.ranges
+        random = rng.random
+
+        cursor = int(random() * self.length)
+        while True:
+            buffers = []
+            for _ in range(chunk_size):
+                if cursor < tail_start:
+                    buffer = text[cursor:cursor + chars_len]
+                else:
+                    buffer = tail[cursor - tail_start:cursor - tail_start + chars_len]
+                buffers.append(buffer)
+                found = ranges.get(buffer)
+                if found is None:
+                    found = self.find_range(buffer)
+                    if len(ranges) < self.max_cached_ranges:
+                        ranges[buffer] = found
+                start, end = found
+                # the buffer is taken from the text, so it is always found;
+                # cheaper than `rng.randrange`, the ranges are far below 2 ** 53
+                cursor = suffix_array[start + int(random() * (end - start))] + chars_len
+            yield "".join(buffers)
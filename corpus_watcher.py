@@ -0,0 +1,125 @@
+"""
+Hot reload of the corpora: a thread checks the files of the languages
+(`text_data/<lang>/*.txt` and the FM-indexes) every few seconds by
+`stat`, so it works on any file system, and when the files of a language
+are changed, added or removed, it reads this language again and replaces
+the corpora of the generator (see `LoremGenerator.reload_language`).
+The other languages are not read again, and the requests are answered
+by the old corpora until the new ones are ready. The language is read
+(and its index is built) in a separate process, so the event loop of
+the bot is not stopped by it.
+"""
+
+import time
+import threading
+import traceback
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from metrics import Histogram
+from lorem_generator import LoremGenerator, Signature
+
+
+__all__ = [
+    "CorpusWatcher",
+]
+
+
+reload_duration = Histogram(
+    "lorem_corpus_reload_duration_seconds",
+    "Duration of the reloading of a changed language",
+    ["language"],
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+
+
+def print_exception(exc: Exception):
+    # the single argument form is only since python 3.10
+    traceback.print_exception(type(exc), exc, exc.__traceback__)
+
+
+class CorpusWatcher(threading.Thread):
+    """
+    A language is reloaded when its files have not changed for one more
+    interval after the change, so a file being copied is not read
+    halfway. If the language cannot be loaded, the old corpus is kept,
+    and it is tried again after the next change.
+    `on_reload` is called with the language after it is reloaded (for
+    example, by the supervisor to fork the workers again).
+    """
+
+    def __init__(
+            self,
+            generator: LoremGenerator,
+            interval: float = 5.0,
+            log: Callable[[str], None] = print,
+            log_error: Callable[[Exception], None] = print_exception,
+            on_reload: Optional[Callable[[str], None]] = None,
+    ):
+        super().__init__(name="corpus-watcher", daemon=True)
+        self.generator = generator
+        self.interval = interval
+        self.log = log
+        self.log_error = log_error
+        self.on_reload = on_reload
+        self.stop_event = threading.Event()
+        # the changed languages and their signatures at the last check
+        self.changed: Dict[str, Signature] = {}
+        # the signatures that failed to load, not retried until changed
+        self.failed: Dict[str, Signature] = {}
+
+    def watched_languages(self) -> List[str]:
+        languages = dict.fromkeys(self.generator.languages)
+        data_path = Path(self.generator.data_directory)
+        if data_path.is_dir():
+            for folder in data_path.iterdir():
+                if folder.is_dir() and not folder.name.startswith("."):
+                    languages[folder.name] = None
+        return list(languages)
+
+    def check(self):
+        """
+        Reloads the languages that have changed since the previous check
+        and have not changed since.
+        """
+
+        loaded = self.generator.corpora.signatures
+        for language in self.watched_languages():
+            signature = self.generator.language_signature(language)
+            if signature == loaded.get(language, ()) or signature == self.failed.get(language):
+                self.changed.pop(language, None)
+                continue
+            if self.changed.get(language) != signature:
+                self.changed[language] = signature
+                continue
+
+            del self.changed[language]
+            self.reload(language, signature)
+
+    def reload(self, language: str, signature: Signature):
+        is_new = language not in self.generator.languages
+        started = time.perf_counter()
+        try:
+            is_loaded = self.generator.reload_language(language)
+        except Exception as exc:
+            self.failed[language] = signature
+            self.log_error(exc)
+            return
+        self.failed.pop(language, None)
+
+        duration = time.perf_counter() - started
+        reload_duration.labels(language).observe(duration)
+        state = ("loaded" if is_new else "reloaded") if is_loaded else "removed"
+        self.log(f"The corpus `{language}` is {state} in {duration:.2f} s")
+        if self.on_reload is not None:
+            self.on_reload(language)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as exc:
+                self.log_error(exc)
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,156 @@
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional, Set
+
+from telegram import Update
+from telegram.ext import Application
+
+from logger import log_exception
+
+
+__all__ = [
+    "UpdateDispatcher",
+]
+
+
+class UpdateDispatcher:
+    """
+    Processes the updates of the bot application concurrently by a
+    bounded pool of workers, so that a slow request does not delay the
+    requests of other users.
+    Updates from the same chat are processed strictly one after another
+    in the order they arrived, updates without a chat are processed
+    independently.
+    The handlers of the application must be blocking (`block=True`),
+    otherwise `Application.process_update` only schedules them and
+    neither the workers nor the order of the chats limit anything, so
+    they are checked on the first update.
+    """
+
+    app: Application
+    workers: int
+    chat_queues: Dict[int, Deque[Update]]
+    tasks: Set[asyncio.Task]
+    consumer: Optional[asyncio.Task]
+
+    def __init__(self, app: Application, workers: int = 1):
+        if workers < 1:
+            raise ValueError(f"The number of workers must be positive ({workers})")
+
+        self.app = app
+        self.workers = workers
+        self.chat_queues = {}
+        self.tasks = set()
+        self.consumer = None
+        self.is_checked = False
+        self._semaphore = asyncio.BoundedSemaphore(workers)
+
+    @staticmethod
+    def get_chat_id(update: Update) -> Optional[int]:
+        """
+        Returns the key by which the order of the updates is kept.
+        """
+
+        chat = update.effective_chat
+        return chat.id if chat is not None else None
+
+    def check_handlers(self):
+        """
+        Raises `ValueError` if a handler of the application is not
+        blocking.
+        """
+
+        for group, handlers in self.app.handlers.items():
+            for handler in handlers:
+                if not handler.block:
+                    raise ValueError(
+                        f"The handler {type(handler).__name__} of the group {group} is not blocking,"
+                        f" the dispatcher cannot limit it"
+                    )
+        self.is_checked = True
+
+    def create_task(self, coro) -> asyncio.Task:
+        """
+        Runs the coroutine in the background and keeps a reference to the
+        task until it is done.
+        """
+
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def submit(self, update: Update):
+        """
+        Puts the update in the queue of its chat. If the chat has no
+        running worker, starts it.
+        """
+
+        if not self.is_checked:
+            self.check_handlers()
+        chat_id = self.get_chat_id(update)
+        if chat_id is None:
+            self.create_task(self.process_update(update))
+            return
+
+        queue = self.chat_queues.get(chat_id)
+        if queue is not None:
+            # the worker of this chat will take the update itself
+            queue.append(update)
+            return
+
+        self.chat_queues[chat_id] = deque([update])
+        self.create_task(self.process_chat(chat_id))
+
+    async def process_chat(self, chat_id: int):
+        """
+        Processes the chat updates one by one until the queue is empty.
+        """
+
+        queue = self.chat_queues[chat_id]
+        try:
+            while queue:
+                await self.process_update(queue.popleft())
+        finally:
+            del self.chat_queues[chat_id]
+
+    async def process_update(self, update: Update):
+        """
+        Waits for a free worker and processes the update.
+        """
+
+        async with self._semaphore:
+            try:
+                await self.app.process_update(update)
+            except Exception as exc:
+                log_exception(exc)
+
+    async def consume(self, update_queue: asyncio.Queue):
+        """
+        Takes the updates from the queue and dispatches them.
+        """
+
+        while True:
+            update = await update_queue.get()
+            if isinstance(update, Update):
+                self.submit(update)
+            update_queue.task_done()
+
+    def listen(self, update_queue: asyncio.Queue):
+        """
+        Starts consuming the queue (for example, the one that the
+        `Updater` fills during long polling) in the background.
+        """
+        self.consumer = asyncio.create_task(self.consume(update_queue))
+
+    async def stop(self):
+        """
+        Stops consuming the queue and waits for all the updates being
+        processed.
+        """
+
+        if self.consumer is not None:
+            self.consumer.cancel()
+            self.consumer = None
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -0,0 +1,328 @@
+"""
+A compressed FM-index of a corpus, an alternative to `CorpusIndex` for
+very large corpora: the text itself is not kept in memory.
+
+The index is built on the reversed text. Its Burrows-Wheeler transform
+(the characters before the sorted rotations) is stored in blocks
+compressed by zlib, with the count of every character before each block
+(checkpoints). This is enough for the two operations of the generator:
+  - the rows of all the occurrences of the buffer are one range, found by
+    the backward search (two rank queries per character);
+  - from the row of an occurrence, the LF mapping steps backwards in the
+    reversed text, that is forwards in the text, and gives the characters
+    after the occurrence one by one.
+The rotations are looped, as the text in the generator, so no sentinel
+is needed.
+
+The index is built by a preprocessing step (minutes for a hundred
+megabytes), the generator only loads it:
+python -m fm_index [text_data] [--output text_data/.index]
+"""
+
+import os
+import json
+import zlib
+import struct
+from array import array
+from pathlib import Path
+from random import Random
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from corpus_index import CorpusIndex
+
+
+__all__ = [
+    "FMIndex",
+]
+
+
+class FMIndex:
+    file_magic = b"LOREMFM1"
+    block_size = 1024
+    # the decompressed blocks and the found ranges are remembered
+    max_cached_blocks = 1024
+    max_cached_ranges = 200_000
+
+    def __init__(
+            self,
+            alphabet: str,
+            length: int,
+            blocks: List[bytes],
+            checkpoints: array,
+            block_size: int = block_size,
+            sources: Optional[list] = None,
+    ):
+        self.alphabet = alphabet
+        self.codes = {char: code for code, char in enumerate(alphabet)}
+        self.length = length
+        self.blocks = blocks
+        self.checkpoints = checkpoints
+        self.block_size = block_size
+        # the signature of the files the index is built from
+        self.sources = sources or []
+
+        # the first row of the rotations starting with each character
+        sigma = len(alphabet)
+        totals = checkpoints[len(blocks) * sigma:]
+        self.first_rows = [sum(totals[:code]) for code in range(sigma)]
+
+        self.cache: Dict[int, bytes] = {}
+        self.ranges: Dict[str, Tuple[int, int]] = {}
+
+    @staticmethod
+    def sort_rotations(text: str) -> List[int]:
+        """
+        Sorts the rotations of the text. They are sorted by the first
+        characters (as in `CorpusIndex`), then the groups of equal
+        prefixes are refined by prefix doubling: the rotations with equal
+        first `h` characters are ordered by the rank of the rotation `h`
+        characters later.
+        """
+
+        length = len(text)
+        keys = CorpusIndex.prefix_keys(text)
+        order = sorted(range(length), key=keys.__getitem__)
+
+        # the rank of a rotation is the first row of its group
+        ranks = [0] * length
+        groups = []
+        start = 0
+        for row in range(1, length + 1):
+            if row == length or keys[order[row]] != keys[order[start]]:
+                for position in order[start:row]:
+                    ranks[position] = start
+                if row - start > 1:
+                    groups.append((start, row))
+                start = row
+        del keys
+
+        shift = CorpusIndex.max_chars
+        while groups and shift < length:
+            next_groups = []
+            new_ranks = []
+            for start, end in groups:
+                members = order[start:end]
+                members.sort(key=lambda position: ranks[(position + shift) % length])
+                order[start:end] = members
+
+                group_start = start
+                previous = ranks[(members[0] + shift) % length]
+                for row, position in enumerate(members, start):
+                    key = ranks[(position + shift) % length]
+                    if key != previous:
+                        if row - group_start > 1:
+                            next_groups.append((group_start, row))
+                        group_start = row
+                        previous = key
+                    new_ranks.append((position, group_start))
+                if end - group_start > 1:
+                    next_groups.append((group_start, end))
+
+            # the ranks change only after the round, all the comparisons
+            # of the round are by the same ranks
+            for position, rank in new_ranks:
+                ranks[position] = rank
+            groups = next_groups
+            shift *= 2
+
+        return order
+
+    @classmethod
+    def build(cls, text: str, block_size: int = block_size, sources: Optional[list] = None) -> "FMIndex":
+        if not text:
+            raise ValueError("Cannot build an index of an empty text")
+        alphabet = "".join(sorted(set(text)))
+        if len(alphabet) > 256:
+            raise ValueError(f"Too many different characters ({len(alphabet)}), at most 256 are supported")
+
+        reversed_text = text[::-1]
+        coded = reversed_text.translate({ord(char): code for code, char in enumerate(alphabet)}).encode("latin-1")
+        order = cls.sort_rotations(reversed_text)
+        # the character before each rotation, -1 is the last one
+        bwt = bytes(coded[position - 1] for position in order)
+        del order
+
+        sigma = len(alphabet)
+        blocks = []
+        checkpoints = array("I")
+        counts = [0] * sigma
+        for start in range(0, len(bwt), block_size):
+            block = bwt[start:start + block_size]
+            checkpoints.extend(counts)
+            for code in set(block):
+                counts[code] += block.count(code)
+            blocks.append(zlib.compress(block, 9))
+        checkpoints.extend(counts)
+
+        return cls(alphabet, len(text), blocks, checkpoints, block_size, sources)
+
+    @staticmethod
+    def source_signature(paths: Iterable[Path]) -> list:
+        """
+        The names, sizes and modification times of the files, to know
+        that the index is outdated.
+        """
+
+        signature = []
+        for path in sorted(paths):
+            stat = path.stat()
+            signature.append([path.name, stat.st_size, stat.st_mtime_ns])
+        return signature
+
+    def save(self, path: Union[str, Path]):
+        meta = json.dumps({
+            "alphabet": self.alphabet,
+            "length": self.length,
+            "block_size": self.block_size,
+            "blocks": [len(block) for block in self.blocks],
+            "sources": self.sources,
+        }).encode("utf8")
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(self.file_magic)
+            file.write(struct.pack("<I", len(meta)))
+            file.write(meta)
+            self.checkpoints.tofile(file)
+            for block in self.blocks:
+                file.write(block)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "FMIndex":
+        with open(path, "rb") as file:
+            if file.read(len(cls.file_magic)) != cls.file_magic:
+                raise ValueError(f"{path} is not an FM-index file")
+            meta_size, = struct.unpack("<I", file.read(4))
+            meta = json.loads(file.read(meta_size).decode("utf8"))
+
+            checkpoints = array("I")
+            checkpoints.fromfile(file, (len(meta["blocks"]) + 1) * len(meta["alphabet"]))
+            blocks = [file.read(size) for size in meta["blocks"]]
+
+        return cls(meta["alphabet"], meta["length"], blocks, checkpoints, meta["block_size"], meta["sources"])
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The size of the compressed transform and the checkpoints.
+        """
+
+        return sum(map(len, self.blocks)) + self.checkpoints.itemsize * len(self.checkpoints)
+
+    def block(self, number: int) -> bytes:
+        block = self.cache.get(number)
+        if block is None:
+            if len(self.cache) >= self.max_cached_blocks:
+                del self.cache[next(iter(self.cache))]
+            block = self.cache[number] = zlib.decompress(self.blocks[number])
+        return block
+
+    def rank(self, code: int, row: int) -> int:
+        """
+        The number of the character among the first `row` characters of
+        the transform.
+        """
+
+        number, offset = divmod(row, self.block_size)
+        count = self.checkpoints[number * len(self.alphabet) + code]
+        if offset:
+            count += self.block(number).count(code, 0, offset)
+        return count
+
+    def find_range(self, buffer: str) -> Tuple[int, int]:
+        """
+        Returns the range of the rows of all the occurrences of the buffer
+        (by the backward search of the reversed buffer in the reversed
+        text).
+        """
+
+        start, end = 0, self.length
+        for char in buffer:
+            code = self.codes.get(char)
+            if code is None:
+                return 0, 0
+            first_row = self.first_rows[code]
+            start = first_row + self.rank(code, start)
+            end = first_row + self.rank(code, end)
+            if start >= end:
+                return 0, 0
+        return start, end
+
+    def count(self, buffer: str) -> int:
+        start, end = self.find_range(buffer)
+        return end - start
+
+    def walk(self, chars_len: int, rng: Random, chunk_size: int = 16) -> Iterator[str]:
+        """
+        Yields the text of the generation endlessly, by chunks of
+        `chunk_size` buffers, as `CorpusIndex.walk`. The characters after
+        a row are read by `chars_len` LF steps, the row after them is the
+        row of the next buffer.
+        """
+
+        alphabet = self.alphabet
+        sigma = len(alphabet)
+        block_size = self.block_size
+        first_rows = self.first_rows
+        checkpoints = self.checkpoints
+        ranges = self.ranges
+        random = rng.random
+
+        row = int(random() * self.length)
+        while True:
+            chars = []
+            for _ in range(chunk_size):
+                buffer_start = len(chars)
+                for _ in range(chars_len):
+                    number, offset = divmod(row, block_size)
+                    block = self.block(number)
+                    code = block[offset]
+                    chars.append(alphabet[code])
+                    row = first_rows[code] + checkpoints[number * sigma + code] + block.count(code, 0, offset)
+                buffer = "".join(chars[buffer_start:])
+
+                found = ranges.get(buffer)
+                if found is None:
+                    found = self.find_range(buffer)
+                    if len(ranges) < self.max_cached_ranges:
+                        ranges[buffer] = found
+                start, end = found
+                row = start + int(random() * (end - start))
+            yield "".join(chars)
+
+
+def main():
+    import time
+    import argparse
+    from lorem_generator import LoremGenerator
+
+    parser = argparse.ArgumentParser(description="Builds the FM-indexes of the corpora of `LoremGenerator`.")
+    parser.add_argument("data_directory", nargs="?", default=LoremGenerator.data_directory)
+    parser.add_argument("--output", help="the index directory, `<data_directory>/.index` by default")
+    parser.add_argument("--languages", nargs="*", help="all the languages by default")
+    parser.add_argument("--block-size", type=int, default=FMIndex.block_size)
+    args = parser.parse_args()
+
+    generator = LoremGenerator(args.data_directory, args.output)
+    for lang_dir in sorted(Path(args.data_directory).iterdir()):
+        if not lang_dir.is_dir() or args.languages and lang_dir.name not in args.languages:
+            continue
+        files = generator.language_files(lang_dir)
+        text = generator.read_language_data(lang_dir)
+        if text is None:
+            continue
+
+        started = time.perf_counter()
+        index = FMIndex.build(text, args.block_size, FMIndex.source_signature(files))
+        path = generator.fm_index_path(lang_dir.name)
+        index.save(path)
+        print(
+            f"{lang_dir.name}: {len(text)} characters, {len(text.encode('utf8')) / 2 ** 20:.1f} MB of text"
+            f" -> {index.nbytes / 2 ** 20:.1f} MB index in {time.perf_counter() - started:.1f} s ({path})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,14 @@ from telegram import Update, Chat, ReplyKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.ext import Application, CallbackContext
 
-from logger import logger, error_logger
+from logger import logger, log_exception
 from messages import messages
+from tracing import RequestTrace, start_trace, finish_trace, timed
+from caches import reply_cache, replay_seed, message_key
+from metrics import Gauge
+from profiler import profiler
+from sender import Sender
+from envs import envs
 
 __all__ = [
     "FuncType",
@@ -19,6 +25,12 @@ ReturnType = Union[str, None, Update]
 FuncType = Coroutine[Any, Any, ReturnType]
 HandlersType = Callable[[Update, CallbackContext], FuncType]
 
+running_tasks_gauge = Gauge(
+    "bot_running_tasks",
+    "Users whose requests are being executed",
+    ["bot"],
+)
+
 
 class HandlerDecorator:
     """
@@ -31,6 +43,7 @@ class HandlerDecorator:
     app: Application
     running_tasks: Set[int]
     buttons: ReplyKeyboardMarkup
+    sender: Sender
 
     _instances: Dict[str, HandlerDecorator] = {}
 
@@ -39,6 +52,8 @@ class HandlerDecorator:
         self.app = app
         self.running_tasks = set()
         self.buttons = ReplyKeyboardMarkup([])
+        self.sender = Sender(name.strip(), **envs.get("SENDER", {}))
+        running_tasks_gauge.labels(name.strip()).set_function(lambda: len(self.running_tasks))
 
     @classmethod
     def get_decorator(cls, name: str, app: Application) -> HandlerDecorator:
@@ -54,28 +69,42 @@ class HandlerDecorator:
 
     def log_request(self, user_id: int, text: str):
         """
-        Logs all requests that come to the bot.
+        Logs all requests that come to the bot (printing to stdout is
+        enabled by `envs["LOG_STDOUT"]`).
         """
 
         flat_msg = logger.flatten_string(text)
         msg = f"  {self.name} >>| {user_id} : {flat_msg}"
-        print(msg)
         logger.info(msg)
 
     async def send_message(self, chat: Chat, message: str):
         """
-        Sending a message to a user.
+        Sending a message to a user (through the rate-limited sender).
         Not the best architectural solution, done because keyboard
         buttons are stored in the handler object.
         """
-        await chat.send_message(
+        await self.sender.send(
+            chat,
             message,
             parse_mode=ParseMode.HTML,
             disable_web_page_preview=True,
             reply_markup=self.buttons
         )
 
-    async def execute(self, coro: FuncType, user_key: int) -> ReturnType:
+    @staticmethod
+    def get_command_name(context: CallbackContext, func: HandlersType) -> str:
+        """
+        Returns the name of the command for the request log: the command
+        itself for commands (parsed by the router), the handler name for
+        other messages.
+        """
+
+        if context.command:
+            return context.command
+        # partial functions have no name
+        return getattr(func, "__name__", "") or func.func.__name__
+
+    async def execute(self, coro: FuncType, user_key: int, trace: RequestTrace) -> ReturnType:
         """
         Checks if there are tasks already running for this user, and if
         not, sets the execution flag and executes the handler.
@@ -86,14 +115,15 @@ class HandlerDecorator:
 
         if user_key in self.running_tasks:
             coro.close()
+            trace.outcome = "already_run"
             return messages["already_run"]
 
         self.running_tasks.add(user_key)
         try:
             return (await coro)
         except Exception as exc:
-            error_logger.error(error_logger.get_full_exc_info(exc))
-            logger.error(logger.get_exc_info(exc))
+            log_exception(exc)
+            trace.outcome = "error"
             return messages["error"]
         finally:
             self.running_tasks.remove(user_key)
@@ -106,19 +136,45 @@ class HandlerDecorator:
         The Update function can return a string (then the string is
         displayed to the user) or an Update object (then it will be
         recalled with a new Update). Or it may return nothing.
+        Each request is also written to the request log with its timings
+        (see `tracing`) and can be profiled (see `profiler`). The replies
+        generated with a seed are cached for "+" (see `caches`).
         """
 
         @wraps(func)
         async def wrapper(update: Update, context: CallbackContext):
             user_id = update.message.from_user.id
-            self.log_request(user_id, update.message.text)
-            coro = func(update, context)
-            result = await self.execute(coro, user_id)
-            if result:
-                if isinstance(result, str):
-                    await self.send_message(update.effective_chat, result)
-                elif isinstance(result, Update):
-                    # Recall the update process with a new Update
-                    await self.app.process_update(result)
+            text = update.message.text
+            self.log_request(user_id, text)
+            trace = start_trace(self.name, self.get_command_name(context, func), user_id)
+            try:
+                coro = func(update, context)
+                execution = self.execute(coro, user_id, trace)
+                if profiler.commands:
+                    execution = profiler.profile(trace.command, execution)
+                result = await execution
+                if result:
+                    if isinstance(result, str):
+                        if trace.seed is not None and trace.outcome == "ok":
+                            descriptor = (trace.command, tuple(context.args or ()), trace.seed)
+                            reply_cache.remember(message_key(update.message), descriptor, result)
+                        with timed("send"):
+                            await self.send_message(update.effective_chat, result)
+                    elif isinstance(result, Update):
+                        # Recall the update process with a new Update and
+                        # the seed of the repeated reply, if it is known;
+                        # the next updates of the chat are processed in
+                        # the same context, so the seed is reset
+                        trace.outcome = "repeat"
+                        token = replay_seed.set(trace.seed)
+                        try:
+                            await self.app.process_update(result)
+                        finally:
+                            replay_seed.reset(token)
+            except Exception:
+                trace.outcome = "error"
+                raise
+            finally:
+                finish_trace(trace)
 
         return wrapper
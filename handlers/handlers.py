@@ -1,5 +1,6 @@
-import re
-import random
+import html
+import asyncio
+import tracemalloc
 from functools import partial
 from typing import List, Union
 
@@ -7,10 +8,14 @@ from telegram import Update
 from telegram.ext import CallbackContext
 
 from messages import messages
+from tracing import timed, trace_seed, trace_cache_hit, trace_outcome
+from caches import reply_cache, message_key
+from profiler import profiler
+from memory import memory_report, tracemalloc_top
 from lorem_generator import lorem_generator, chinese_generator
 from translator import text_translator, shared_languages
 
-from .utils import parse_args, translate, channel_utils
+from .utils import request_rng, translate, channel_utils
 
 
 __all__ = [
@@ -31,6 +36,8 @@ __all__ = [
     "command_lorem_tt",
     "command_translate",
     "repeat_command",
+    "command_profile",
+    "command_memory",
 ]
 
 
@@ -42,20 +49,13 @@ async def echo(update: Update, context: CallbackContext) -> str:
     return update.message.text
 
 
-exclude_letter_pattern = re.compile(r"\W")
-
-
 async def received_message(update: Update, context: CallbackContext) -> str:
     """
     Bot does not know how to work with messages, so just a stub.
     """
 
-    text = update.message.text
-    if text.startswith("/"):
-        command_end = exclude_letter_pattern.search(text[1:])
-        command_end = (command_end.start() + 1) if command_end else None
-        command = text[:command_end]
-        message = messages["message"]["unknown"].format(command)
+    if context.command:
+        message = messages["message"]["unknown"].format("/" + context.command)
     else:
         message = messages["message"]["default"]
     return message
@@ -75,6 +75,13 @@ async def command_start_admin(update: Update, context: CallbackContext) -> str:
     return messages["start"]["admin"]
 
 
+user_helpers = frozenset(["/generate", "/chinese", "/random", "/help"])
+admin_helpers = frozenset([
+    "/generate", "/chinese", "/gen", "/generate_absurd", "/lorem",
+    "/lorem_full", "/lorem_tt", "/translate"
+])
+
+
 async def command_help_user(update: Update, context: CallbackContext) -> str:
     """
     Displays either general help or help for a known command. For help
@@ -83,14 +90,11 @@ async def command_help_user(update: Update, context: CallbackContext) -> str:
     /help [/command]
     """
 
-    input_text = update.message.text
-    params = parse_args(input_text)
-
-    allowed_helpers = ["/generate", "/chinese", "/random", "/help"]
+    params = context.args
 
     if not params:
         message = messages["help"]["user"]
-    elif params[0] in allowed_helpers:
+    elif params[0] in user_helpers:
         message = messages["help"][params[0][1:]]
     else:
         message = messages["help"]["unknown"].format(params[0])
@@ -106,17 +110,11 @@ async def command_help_admin(update: Update, context: CallbackContext) -> str:
     /help [/command]
     """
 
-    input_text = update.message.text
-    params = parse_args(input_text)
-
-    allowed_helpers = [
-        "/generate", "/chinese", "/gen", "/generate_absurd", "/lorem",
-        "/lorem_full", "/lorem_tt", "/translate"
-    ]
+    params = context.args
 
     if not params:
         message = messages["help"]["admin"]
-    elif params[0] in allowed_helpers:
+    elif params[0] in admin_helpers:
         message = messages["help"][params[0][1:]]
     elif params[0] == "/help":
         message = messages["help"]["help"]
@@ -135,8 +133,10 @@ async def command_generate(update: Update, context: CallbackContext) -> str:
     /generate
     """
 
-    word_count = random.randint(5, 16)
-    text = lorem_generator("ru", word_count, chars_len=2)
+    rng = request_rng()
+    word_count = rng.randint(5, 16)
+    with timed("generation"):
+        text = lorem_generator("ru", word_count, chars_len=2, rng=rng)
     message, _ = await translate(text, "lin", "bg", "ru")
     return message
 
@@ -150,8 +150,10 @@ async def command_chinese(update: Update, context: CallbackContext) -> str:
     /chinese
     """
 
-    count = random.randint(8, 24)
-    ch_text = chinese_generator.get_chinese(count)
+    rng = request_rng()
+    count = rng.randint(8, 24)
+    with timed("generation"):
+        ch_text = chinese_generator.get_chinese(count, rng)
     message, _ = await translate(ch_text, "lin", "zh-Hans_CN", "ru")
     return message
 
@@ -185,9 +187,11 @@ async def command_generate_wat(update: Update, context: CallbackContext) -> str:
     /gen
     """
 
-    word_count = random.randint(10, 18)
-    text = lorem_generator("ru", word_count, chars_len=2)
-    text = lorem_generator.clear_text(text)
+    rng = request_rng()
+    word_count = rng.randint(10, 18)
+    with timed("generation"):
+        text = lorem_generator("ru", word_count, chars_len=2, rng=rng)
+        text = lorem_generator.clear_text(text)
     text, succ = await translate(text, "wat", "uk", "en")
     if succ:
         text, _ = await translate(text, "lin", "en", "ru")
@@ -203,18 +207,20 @@ async def command_generate_absurd(update: Update, context: CallbackContext) -> s
     /generate_absurd
     """
 
+    rng = request_rng()
     lorem_params = [
-        random.choice(lorem_generator.languages),
-        random.randint(32, 128),
-        random.randint(1, 3)
+        rng.choice(lorem_generator.languages),
+        rng.randint(32, 128),
+        rng.randint(1, 3)
     ]
     language = lorem_params[0]
-    text = lorem_generator(*lorem_params)
+    with timed("generation"):
+        text = lorem_generator(*lorem_params, rng=rng)
 
     # a few translations through different languages
-    count = random.randint(1, 3)
+    count = rng.randint(1, 3)
     for _ in range(count):
-        to_language = random.choice([
+        to_language = rng.choice([
             lang
             for lang in shared_languages
             if lang != language
@@ -237,7 +243,7 @@ async def command_lorem(update: Update, context: CallbackContext, *, _clear=True
     If the _clear argument is used, punctuation marks are removed (the
     default behavior).
     Has 3 optional positional integer arguments - `language`,
-    `word count` (5-256) and `characters count` (1-3). Usage:
+    `word count` (5-256) and `characters count` (1-8). Usage:
     /lorem [lang] [words [chars]]
     /lorem
     /lorem en
@@ -256,7 +262,7 @@ async def command_lorem(update: Update, context: CallbackContext, *, _clear=True
         """
         Returns a lorem-like pseudo-text that looks like a real language.
         Has 3 optional positional integer arguments - `language`,
-        `word count` (5-256) and `characters count` (1-3). Usage:
+        `word count` (5-256) and `characters count` (1-8). Usage:
         /lorem [lang] [words [chars]]
         /lorem
         /lorem en
@@ -294,21 +300,20 @@ async def command_lorem(update: Update, context: CallbackContext, *, _clear=True
             return messages["lorem"]["lang_error"].format(returned_params[0])
         if not 5 <= returned_params[1] <= 256:
             return messages["lorem"]["word_count"].format(returned_params[1])
-        if not 1 <= returned_params[2] <= 3:
+        if not 1 <= returned_params[2] <= lorem_generator.max_chars_len:
             return messages["lorem"]["char_count"].format(returned_params[2])
 
         return returned_params
 
-    input_text = update.message.text
-    args = parse_args(input_text)
-    input_params = get_params(*args)
+    input_params = get_params(*context.args)
     if isinstance(input_params, str):
         # incorrect parameters
         message = input_params
     else:
-        message = lorem_generator.generate_lorem(*input_params)
-        if _clear:
-            message = lorem_generator.clear_text(message)
+        with timed("generation"):
+            message = lorem_generator.generate_lorem(*input_params, rng=request_rng())
+            if _clear:
+                message = lorem_generator.clear_text(message)
 
     return message
 
@@ -324,8 +329,9 @@ async def command_lorem_tt(update: Update, context: CallbackContext) -> str:
     /lorem_tt
     """
 
-    text = lorem_generator("tt")
-    text = lorem_generator.clear_text(text)
+    with timed("generation"):
+        text = lorem_generator("tt", rng=request_rng())
+        text = lorem_generator.clear_text(text)
     return text
 
 
@@ -385,8 +391,7 @@ async def command_translate(update: Update, context: CallbackContext) -> str:
 
     message = check_text()
     if not message:
-        args = parse_args(update.message.text)
-        params = get_params(*args)
+        params = get_params(*context.args)
         if isinstance(params, str):
             message = params
         else:
@@ -399,7 +404,10 @@ async def command_translate(update: Update, context: CallbackContext) -> str:
 async def repeat_command(update: Update, context: CallbackContext) -> Union[str, Update]:
     """
     Just repeats the command from the replay.
-    The command must be a message starting with "/".
+    The command must be a message starting with "/". If the reply to it
+    is still cached, it is returned again, if only its seed is known,
+    the command is repeated with the same seed (and gives the same
+    text).
     Usage (in admin version):
     + [reply: /lorem en 56]
     """
@@ -413,8 +421,87 @@ async def repeat_command(update: Update, context: CallbackContext) -> Union[str,
     if not update.message.reply_to_message.text.startswith("/"):
         return messages["plus"]["no_command"]
 
+    descriptor, reply = reply_cache.lookup(message_key(update.message.reply_to_message))
+    if descriptor is not None:
+        # the decorator repeats the command with the seed of the trace
+        trace_seed(descriptor[2])
+        if reply is not None:
+            trace_cache_hit()
+            # not cached again for the "+" itself
+            trace_outcome("repeat")
+            return reply
+
     # Moving the reply to the message and clearing cache
     update.message = update.message.reply_to_message
     update.message.reply_to_message = None
     update._effective_message = None
     return update
+
+
+async def command_profile(update: Update, context: CallbackContext) -> str:
+    """
+    Turns on profiling of the requests (see `profiler`), only for the
+    admin bot. Usage:
+    /profile - shows what is being profiled
+    /profile off
+    /profile sample [seconds]
+    /profile [command] [count]
+    """
+
+    max_seconds = 600
+    params = context.args
+    if not params:
+        status = profiler.status()
+        return messages["profile"]["status"].format(html.escape(status)) if status else messages["profile"]["off"]
+
+    if params[0] == "off":
+        profiler.stop()
+        return messages["profile"]["stopped"]
+
+    is_sampling = params[0] == "sample"
+    count = params[1] if len(params) > 1 else ("30" if is_sampling else "1")
+    if not count.isdigit():
+        return messages["profile"]["count_error"].format(html.escape(count))
+
+    if is_sampling:
+        seconds = min(int(count), max_seconds)
+        if not profiler.start_sampling(seconds):
+            return messages["profile"]["already_sampling"]
+        return messages["profile"]["sampling"].format(seconds)
+
+    command = params[0].lstrip("/")
+    profiler.profile_command(command, int(count))
+    return messages["profile"]["command"].format(count, html.escape(command))
+
+
+async def command_memory(update: Update, context: CallbackContext) -> str:
+    """
+    Shows how much memory the corpora, the caches and the process take
+    (see `memory`), only for the admin bot. Usage:
+    /memory
+    /memory top [count] - the largest allocations by tracemalloc (turns
+      it on the first time)
+    /memory off - turns tracemalloc off
+    """
+
+    # the report walks the caches and the snapshot walks all the traced
+    # allocations, both take seconds on the real corpora, so they are
+    # made in a thread and the other requests are answered meanwhile
+    loop = asyncio.get_running_loop()
+    params = context.args
+    if not params:
+        report = await loop.run_in_executor(None, memory_report)
+        return messages["memory"]["report"].format(html.escape(report))
+
+    if params[0] == "off":
+        tracemalloc.stop()
+        return messages["memory"]["stopped"]
+
+    count = params[1] if len(params) > 1 else "10"
+    if not count.isdigit():
+        return messages["memory"]["count_error"].format(html.escape(count))
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        return messages["memory"]["tracing"]
+    top = await loop.run_in_executor(None, tracemalloc_top, min(int(count), 50))
+    return messages["memory"]["top"].format(html.escape("\n".join(top)))
@@ -1,13 +1,20 @@
 import re
+import time
 import random
-from typing import List, Tuple
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
 
-from telegram import Chat
+from telegram import Bot, Chat
 from telegram.error import BadRequest
 
 from envs import envs
 from messages import messages
 from logger import logger, error_logger
+from state_store import state_store
+from sender import TokenBucket
+from tracing import trace_translation, trace_seed, trace_cache_hit, trace_outcome
+from caches import replay_seed, translation_cache
+from lorem_generator import new_seed
 from translator import (
     text_translator,
     TranslationTimeoutException,
@@ -17,6 +24,7 @@ from translator import (
 
 __all__ = [
     "parse_args",
+    "request_rng",
     "translate",
     "channel_utils",
 ]
@@ -35,49 +43,254 @@ def parse_args(text: str) -> List[str]:
     return params[1:]
 
 
+def request_rng() -> random.Random:
+    """
+    Returns a random generator for the handled request. All the random
+    choices of the request are made by it, and its seed is written to
+    the request trace, so the generated text can be repeated (the
+    repeated command gets the seed of the original one).
+    """
+
+    seed = replay_seed.get()
+    if seed is None:
+        seed = new_seed()
+    trace_seed(seed)
+    return random.Random(seed)
+
+
 async def translate(text: str, *params) -> Tuple[str, bool]:
     """
     Makes a translation and catches errors. Returns 2 arguments - the
     text and the success of the translation.
+    The translation is added to the request trace. The successful
+    translations are cached, a failed one marks the request, so its
+    reply (with the error text) is not cached for "+".
     """
 
+    key = (text, *params)
+    cached = translation_cache.get(key)
+    if cached is not None:
+        trace_cache_hit()
+        return cached, True
+
+    started = time.perf_counter()
     try:
         result = await text_translator(text, *params)
-        return result, True
+        success = True
     except TranslationTimeoutException:
-        return messages["translate"]["timeout_error"], False
+        result, success = messages["translate"]["timeout_error"], False
     except TranslationRequestException:
-        return messages["translate"]["request_error"], False
+        result, success = messages["translate"]["request_error"], False
+    trace_translation(*params, time.perf_counter() - started, success)
+    if success:
+        translation_cache.put(key, result)
+    else:
+        trace_outcome("translate_error")
+    return result, success
+
+
+class PostIndex:
+    """
+    What is known about the ids of the channel posts: which ones can be
+    forwarded and which ones can not (deleted or technical posts).
+    The random id is chosen uniformly from all the ids that are not
+    known to be invalid, so the known posts are returned without
+    errors, and the unknown ones are checked as before and become known.
+    """
+
+    def __init__(self):
+        # a list and positions in it to choose and remove in O(1)
+        self.valid: List[int] = []
+        self.positions: Dict[int, int] = {}
+        self.invalid: Set[int] = set()
+
+    def add_valid(self, post_id: int):
+        if post_id in self.positions:
+            return
+        self.invalid.discard(post_id)
+        self.positions[post_id] = len(self.valid)
+        self.valid.append(post_id)
+
+    def add_invalid(self, post_id: int):
+        position = self.positions.pop(post_id, None)
+        if position is not None:
+            last_id = self.valid.pop()
+            if last_id != post_id:
+                self.valid[position] = last_id
+                self.positions[last_id] = position
+        self.invalid.add(post_id)
+
+    def choose(self, first_id: int, last_id: int, attempts: int = 100) -> Optional[int]:
+        """
+        Returns a random id from `first_id..last_id` that is not known to
+        be invalid, or None if there are none.
+        """
+
+        unknown_count = (last_id - first_id + 1) - len(self.valid) - len(self.invalid)
+        if unknown_count > 0 and random.randrange(len(self.valid) + unknown_count) >= len(self.valid):
+            # the unknown ids are rare at the end, so the number of
+            # attempts is limited, then a known one is taken
+            for _ in range(attempts):
+                post_id = random.randint(first_id, last_id)
+                if post_id not in self.positions and post_id not in self.invalid:
+                    return post_id
+        return random.choice(self.valid) if self.valid else None
 
 
 class ChannelUtils:
     """
     The class responsible for all work with the channel.
+    If `envs["PROBE"]` is set, the unknown posts are first checked in
+    parallel by forwarding them to the probe chat (a chat of the bot
+    owner, not of the users), so that one round trip is spent on several
+    deleted posts instead of one.
     """
 
     channel_name = envs["CHANNEL_NAME"]
-    last_index = envs["LAST_INDEX"]  # temporary solution
+    first_index = 2
+    probe_chat = envs.get("PROBE", {}).get("chat_id")
+    probe_fanout = envs.get("PROBE", {}).get("fanout", 5)
+    # Telegram allows about 20 messages per minute to one group
+    probe_limiter = TokenBucket(
+        envs.get("PROBE", {}).get("rate", 1 / 3),
+        envs.get("PROBE", {}).get("burst", 10),
+    )
+
+    _last_index: int = 0
+    _post_index: Optional[PostIndex] = None
+
+    def load(self):
+        """
+        Reads the last post id and the index of the posts from the state
+        store if they are not read yet (on the first use), so the import
+        of the module does not touch the disk. `envs["LAST_INDEX"]` is
+        used only until the store knows a newer post.
+        """
+
+        if self._post_index is not None:
+            return
+        post_index = PostIndex()
+        valid, invalid = state_store.load_posts()
+        for post_id in valid:
+            post_index.add_valid(post_id)
+        post_index.invalid.update(invalid)
+        self._last_index = max(envs["LAST_INDEX"], state_store.get_meta("last_index", 0))
+        self._post_index = post_index
+
+    @property
+    def last_index(self) -> int:
+        self.load()
+        return self._last_index
+
+    @property
+    def post_index(self) -> PostIndex:
+        self.load()
+        return self._post_index
+
+    def add_post(self, post_id: int, valid: bool):
+        """
+        Saves the result of forwarding the post to the index and to the
+        state store.
+        """
+
+        if valid:
+            self.post_index.add_valid(post_id)
+        else:
+            self.post_index.add_invalid(post_id)
+        state_store.set_post(post_id, valid)
+
+    def choose_unknown(self, count: int, exclude: int) -> List[int]:
+        """
+        Returns up to `count` different ids of the posts that are not
+        known yet.
+        """
+
+        post_ids: Set[int] = set()
+        for _ in range(count * 4):
+            if len(post_ids) >= count:
+                break
+            post_id = self.post_index.choose(self.first_index, self.last_index)
+            if post_id is not None and post_id != exclude and post_id not in self.post_index.positions:
+                post_ids.add(post_id)
+        return list(post_ids)
+
+    def check_error(self, post_id: int, exc: BadRequest):
+        # Either the post with this id is deleted
+        # or it is technical
+        # or the bot is not a channel admin (in this case the
+        # error message will return after several tries)
+        logger.info(f"post {post_id} is not forwarded: {logger.get_exc_info(exc)}")
+        if "message" in exc.message.lower():
+            # only a problem of the post, not of the channel
+            self.add_post(post_id, False)
+
+    async def forward_post(self, chat: Chat, post_id: int) -> bool:
+        try:
+            await chat.forward_from(self.channel_name, post_id)
+        except BadRequest as exc:
+            self.check_error(post_id, exc)
+            return False
+        if post_id not in self.post_index.positions:
+            self.add_post(post_id, True)
+        return True
+
+    async def probe_posts(self, bot: Bot, post_ids: List[int]) -> Optional[int]:
+        """
+        Forwards the posts to the probe chat concurrently, returns the id
+        of the first forwarded one (the rest of the requests are
+        cancelled) or None if none of them can be forwarded.
+        """
+
+        tasks = {
+            asyncio.create_task(bot.forward_message(self.probe_chat, self.channel_name, post_id)): post_id
+            for post_id in post_ids
+        }
+        pending = set(tasks)
+        found = None
+        try:
+            while pending and found is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    post_id = tasks[task]
+                    exc = task.exception()
+                    if exc is None:
+                        self.add_post(post_id, True)
+                        found = found or post_id
+                    elif isinstance(exc, BadRequest):
+                        self.check_error(post_id, exc)
+                    else:
+                        logger.info(f"post {post_id} is not probed: {logger.get_exc_info(exc)}")
+        finally:
+            for task in pending:
+                task.cancel()
+        return found
 
     async def reply_random_post(self, chat: Chat) -> str:
         """
         Forwards the first post that can be forwarded to the specified
         chat. Can not be forwarded deleted messages or technical
         messages (changed name, avatar).
+        The posts are chosen by `PostIndex`, the result of each attempt
+        is added to it. The unknown posts are probed in parallel if it
+        is enabled and the rate limit allows.
         """
 
         miss_count = 20
         for _ in range(miss_count):
-            try:
-                post_id = random.randint(2, self.last_index)
-                await chat.forward_from(self.channel_name, post_id)
+            post_id = self.post_index.choose(self.first_index, self.last_index)
+            if post_id is None:
+                break
+
+            if self.probe_chat is not None and post_id not in self.post_index.positions:
+                post_ids = [post_id] + self.choose_unknown(self.probe_fanout - 1, post_id)
+                count = self.probe_limiter.take(len(post_ids))
+                if count:
+                    post_id = await self.probe_posts(chat.get_bot(), post_ids[:count])
+                    if post_id is None:
+                        continue
+
+            if await self.forward_post(chat, post_id):
                 return ""
-            except BadRequest as exc:
-                # Either the post with this id is deleted
-                # or it is technical
-                # or the bot is not a channel admin (in this case the
-                # error message will return after several tries)
-                print(exc)
-                pass
 
         error_logger.error(ConnectionError("The post is not given out"))
         return messages["random"]["error"]
@@ -86,10 +299,14 @@ class ChannelUtils:
         """
         Since the bot cannot know the id of the last post in the channel
         when it is started, we need a special handler that just updates
-        the id when a new post is released.
+        the id when a new post is released. The new post is known to be
+        forwardable. Both are saved in the state store.
         """
 
-        self.last_index = new_id
+        if new_id > self.last_index:
+            self._last_index = new_id
+            state_store.set_meta("last_index", new_id)
+        self.add_post(new_id, True)
         logger.info(f"updated channel.updated (> {new_id})")
 
 channel_utils = ChannelUtils()
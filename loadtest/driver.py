@@ -0,0 +1,212 @@
+"""
+End-to-end load test of a bot: the real handlers work against a fake
+Telegram Bot API server and a fake translation server, the driver sends
+synthetic updates for every registered command (with the Poisson
+arrival rate) and reports RPS and latency percentiles per command.
+
+By default the bot is started in the same process. With `--external`
+only the fake servers are started, then the bot must be started
+separately with `TELEGRAM_API_URL` and `TRANSLATOR_URLS` from the
+printed settings (for example, in the supervisor mode).
+
+Usage (from the project root, `.envs` and `text_data/` are required):
+python -m loadtest.driver --bot test --rps 20 --duration 30
+python -m loadtest.driver --bot user --webhook --translator-latency 1 --translator-error-rate 0.1
+"""
+
+import time
+import random
+import asyncio
+import argparse
+from typing import Dict, List, Tuple
+
+from envs import envs
+
+from .fake_telegram import FakeTelegram
+from .fake_translator import FakeTranslator
+from .worker_pool import percentile
+
+
+# (text, reply text, is channel post)
+Request = Tuple[str, str, bool]
+
+# the arguments of the commands, to test not only the defaults
+COMMAND_ARGS: Dict[str, List[str]] = {
+    "generate": ["", "en", "ja 10"],
+    "chinese": ["", "5"],
+    "gen": ["", "de"],
+    "lorem": ["", "ru 50", "en 20 3"],
+    "lorem_full": ["", "ru 50"],
+    "lorem_tt": [""],
+    "generate_absurd": ["", "3"],
+    "help": [""],
+    "start": [""],
+    "random": [""],
+}
+REPLY_TEXT = "Lorem ipsum dolor sit amet, consectetur adipiscing elit."
+
+
+def get_requests(bot_name: str) -> Dict[str, List[Request]]:
+    """
+    Returns the variants of the requests for each handler of the bot.
+    """
+
+    from bot import Command, get_user_handlers, get_admin_handlers, get_test_handlers
+    from handlers import repeat_command, received_message, new_channel_post
+
+    handlers = {
+        "user": get_user_handlers,
+        "admin": get_admin_handlers,
+        "test": get_test_handlers,
+    }[bot_name]()
+
+    requests: Dict[str, List[Request]] = {}
+    for handler in handlers:
+        if isinstance(handler, Command):
+            name = "/" + handler.name
+            if handler.name == "translate":
+                variants = [(name, REPLY_TEXT, False), (name + " wat en", REPLY_TEXT, False)]
+            else:
+                variants = [
+                    ((name + " " + args).strip(), "", False)
+                    for args in COMMAND_ARGS.get(handler.name, [""])
+                ]
+            requests[name] = variants
+        elif handler.func is repeat_command:
+            requests["+"] = [("+", "/lorem", False), ("+", "/generate en", False)]
+        elif handler.func is received_message:
+            requests["text"] = [("some text", "", False)]
+        elif handler.func is new_channel_post:
+            requests["channel_post"] = [("a new post", "", True)]
+    return requests
+
+
+class Driver:
+    def __init__(self, args: argparse.Namespace, token: str):
+        self.args = args
+        self.token = token
+        self.random = random.Random(args.seed)
+        self.telegram = FakeTelegram(args.forward_error_rate, args.seed)
+        self.translator = FakeTranslator(
+            args.translator_latency,
+            args.translator_jitter,
+            args.translator_error_rate,
+            args.translator_hang_rate,
+            seed=args.seed,
+        )
+        self.latencies: Dict[str, List[float]] = {}
+        self.lost: Dict[str, int] = {}
+
+    async def send(self, command: str, request: Request):
+        text, reply_text, is_channel = request
+        update = self.telegram.make_update(text, reply_text, is_channel)
+        latency = await self.telegram.inject(self.token, update, self.args.timeout)
+        if latency is None:
+            self.lost[command] = self.lost.get(command, 0) + 1
+        else:
+            self.latencies.setdefault(command, []).append(latency)
+
+    async def run_load(self, requests: Dict[str, List[Request]]) -> float:
+        """
+        Sends the requests for `--duration` seconds, returns the time
+        until the last answer.
+        """
+
+        commands = list(requests)
+        tasks = []
+        started = time.perf_counter()
+        while time.perf_counter() - started < self.args.duration:
+            command = self.random.choice(commands)
+            request = self.random.choice(requests[command])
+            tasks.append(asyncio.create_task(self.send(command, request)))
+            await asyncio.sleep(self.random.expovariate(self.args.rps))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float):
+        total = sum(map(len, self.latencies.values()))
+        lost = sum(self.lost.values())
+        print(f"\n{total} answered, {lost} lost in {elapsed:.1f} s, {total / elapsed:.1f} RPS")
+        print(f"fake translator requests: {self.translator.requests}, API calls: {self.telegram.calls}\n")
+        print(f"{'command':>16} {'count':>6} {'lost':>5} {'RPS':>6} {'p50, ms':>9} {'p95, ms':>9} {'p99, ms':>9}")
+        for command in sorted(set(self.latencies) | set(self.lost)):
+            values = self.latencies.get(command, [])
+            row = f"{command:>16} {len(values):>6} {self.lost.get(command, 0):>5} {len(values) / elapsed:>6.1f}"
+            if values:
+                p50, p95, p99 = (percentile(values, p) * 1000 for p in (50, 95, 99))
+                row += f" {p50:>9.1f} {p95:>9.1f} {p99:>9.1f}"
+            print(row)
+
+
+async def run(args: argparse.Namespace):
+    host = "127.0.0.1"
+    token = envs[f"TOKEN_{args.bot.upper()}"]
+    driver = Driver(args, token)
+    await driver.telegram.start(host, args.telegram_port)
+    await driver.translator.start(host, args.translator_port)
+
+    # must be set before the bot modules are imported
+    envs["TELEGRAM_API_URL"] = f"http://{host}:{args.telegram_port}/bot"
+    envs["TRANSLATOR_URLS"] = driver.translator.urls(host, args.translator_port)
+    if args.webhook:
+        envs["WEBHOOK"] = {
+            "url": f"http://{host}:{args.webhook_port}",
+            "host": host,
+            "ports": {args.bot: args.webhook_port},
+        }
+    else:
+        envs.pop("WEBHOOK", None)
+
+    webhook_server = None
+    if args.external:
+        print("Start the bot with the settings:")
+        for key in ("TELEGRAM_API_URL", "TRANSLATOR_URLS", "WEBHOOK"):
+            if key in envs:
+                print(f'"{key}": {envs[key]!r}')
+        prompt = "and press Enter when it has started "
+        await asyncio.get_running_loop().run_in_executor(None, input, prompt)
+    else:
+        import bot
+        from main import preload
+        from webhook import WebhookServer
+
+        preload()
+
+        if args.webhook:
+            webhook_server = WebhookServer(host, args.webhook_port)
+            await webhook_server.start()
+        await getattr(bot, f"{args.bot}_bot_init")(token, webhook_server)
+
+    try:
+        elapsed = await driver.run_load(get_requests(args.bot))
+        driver.report(elapsed)
+    finally:
+        if webhook_server is not None:
+            await webhook_server.stop()
+        await driver.translator.stop()
+        await driver.telegram.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--bot", choices=["user", "admin", "test"], default="test")
+    parser.add_argument("--webhook", action="store_true", help="use the webhook instead of long polling")
+    parser.add_argument("--external", action="store_true", help="do not start the bot in this process")
+    parser.add_argument("--rps", type=float, default=20, help="mean incoming rate")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of sending")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for an answer")
+    parser.add_argument("--translator-latency", type=float, default=0.3)
+    parser.add_argument("--translator-jitter", type=float, default=0.1)
+    parser.add_argument("--translator-error-rate", type=float, default=0.0)
+    parser.add_argument("--translator-hang-rate", type=float, default=0.0, help="share of requests without an answer")
+    parser.add_argument("--forward-error-rate", type=float, default=0.1, help="share of deleted channel posts")
+    parser.add_argument("--telegram-port", type=int, default=8081)
+    parser.add_argument("--translator-port", type=int, default=8082)
+    parser.add_argument("--webhook-port", type=int, default=8443)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+A fake Telegram Bot API server for load testing.
+It implements only the methods the bots use, delivers injected updates
+either through `getUpdates` (long polling) or to the webhook set by the
+bot, and reports when the bot answers to the chat of the update.
+"""
+
+import time
+import random
+import asyncio
+import itertools
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+
+__all__ = [
+    "FakeTelegram",
+]
+
+
+class FakeTelegram:
+    """
+    The server handles `/bot<token>/<method>` for any token. The updates
+    are injected by `inject`, which waits for the first answer (message
+    or forwarded post) to the chat of the update.
+    """
+
+    def __init__(self, forward_error_rate: float = 0.0, seed: int = 0):
+        self.random = random.Random(seed)
+        self.forward_error_rate = forward_error_rate
+
+        self.webhooks: Dict[str, str] = {}
+        self.update_queues: Dict[str, asyncio.Queue] = {}
+        self.waiters: Dict[Tuple[str, int], asyncio.Future] = {}
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1000)
+        self.chat_ids = itertools.count(10 ** 6)
+        self.calls: Dict[str, int] = {}
+
+        self.web_app = web.Application()
+        self.web_app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(self.web_app)
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081):
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.session = aiohttp.ClientSession()
+
+    async def stop(self):
+        if self.session is not None:
+            await self.session.close()
+        await self.runner.cleanup()
+
+    # === the API ===================================================
+
+    @staticmethod
+    def result(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def error(description: str) -> web.Response:
+        data = {"ok": False, "error_code": 400, "description": description}
+        return web.json_response(data, status=400)
+
+    def message(self, chat_id: int, text: str = "") -> dict:
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        }
+
+    def answer(self, token: str, chat_id: int):
+        waiter = self.waiters.pop((token, chat_id), None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(time.perf_counter())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.match_info["token"]
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        params.update(request.query)
+
+        if method == "getMe":
+            bot_id, _, name = token.partition(":")
+            user = {"id": int(bot_id), "is_bot": True, "first_name": name, "username": f"{name}_bot"}
+            return self.result(user)
+
+        if method == "setWebhook":
+            self.webhooks[token] = params["url"]
+            return self.result(True)
+
+        if method == "deleteWebhook":
+            self.webhooks.pop(token, None)
+            return self.result(True)
+
+        if method == "getUpdates":
+            return self.result(await self.get_updates(token, float(params.get("timeout", 0))))
+
+        if method in ("sendMessage", "forwardMessage", "copyMessage"):
+            chat_id = int(params["chat_id"])
+            if method != "sendMessage" and self.random.random() < self.forward_error_rate:
+                return self.error("Bad Request: message to forward not found")
+            self.answer(token, chat_id)
+            return self.result(self.message(chat_id, params.get("text", "")))
+
+        return self.result(True)
+
+    async def get_updates(self, token: str, timeout: float) -> list:
+        queue = self.update_queues.setdefault(token, asyncio.Queue())
+        try:
+            updates = [await asyncio.wait_for(queue.get(), timeout or 0.01)]
+        except asyncio.TimeoutError:
+            return []
+        while not queue.empty() and len(updates) < 100:
+            updates.append(queue.get_nowait())
+        return updates
+
+    # === the updates ===============================================
+
+    def make_update(self, text: str, reply_text: str = "", is_channel: bool = False) -> dict:
+        """
+        Creates an update with a message from a new private chat (or a
+        channel post).
+        """
+
+        chat_id = next(self.chat_ids)
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": -chat_id if is_channel else chat_id, "type": "private"},
+            "text": text,
+        }
+        if is_channel:
+            message["chat"]["type"] = "channel"
+            message["chat"]["title"] = "channel"
+            return {"update_id": next(self.update_ids), "channel_post": message}
+
+        message["from"] = {"id": chat_id, "is_bot": False, "first_name": "user"}
+        if text.startswith("/"):
+            length = len(text.split(maxsplit=1)[0])
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": length}]
+        if reply_text:
+            message["reply_to_message"] = {
+                **self.message(chat_id, reply_text),
+                "from": message["from"],
+            }
+        return {"update_id": next(self.update_ids), "message": message}
+
+    async def deliver(self, token: str, update: dict):
+        url = self.webhooks.get(token)
+        if url is None:
+            await self.update_queues.setdefault(token, asyncio.Queue()).put(update)
+            return
+        async with self.session.post(url, json=update) as response:
+            response.raise_for_status()
+
+    async def inject(self, token: str, update: dict, timeout: float = 30.0) -> Optional[float]:
+        """
+        Delivers the update to the bot and waits for its answer. Returns
+        the latency in seconds or None if the bot did not answer.
+        """
+
+        message = update.get("message")
+        waiter = None
+        if message is not None:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters[(token, message["chat"]["id"])] = waiter
+
+        started = time.perf_counter()
+        await self.deliver(token, update)
+        if waiter is None:
+            return time.perf_counter() - started
+
+        try:
+            answered = await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self.waiters.pop((token, message["chat"]["id"]), None)
+            return None
+        return answered - started
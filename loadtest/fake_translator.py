@@ -0,0 +1,98 @@
+"""
+A fake translation server for load testing: answers like LingvaNex and
+IBM Watson with a configurable latency and error rates.
+"""
+
+import random
+import asyncio
+
+from aiohttp import web
+
+
+__all__ = [
+    "FakeTranslator",
+]
+
+
+class FakeTranslator:
+    """
+    Routes:
+    POST /lingvanex - as LingvaNex
+    POST /watson/text - as IBM Watson translation
+    POST /watson/detect - as IBM Watson language detection
+    The "translation" is the reversed text.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.2,
+            jitter: float = 0.1,
+            error_rate: float = 0.0,
+            hang_rate: float = 0.0,
+            hang_time: float = 15.0,
+            seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_time = hang_time
+        self.random = random.Random(seed)
+        self.requests = 0
+
+        self.web_app = web.Application()
+        self.web_app.router.add_post("/lingvanex", self.lingvanex)
+        self.web_app.router.add_post("/watson/text", self.watson_text)
+        self.web_app.router.add_post("/watson/detect", self.watson_detect)
+        self.runner = web.AppRunner(self.web_app)
+
+    def urls(self, host: str, port: int) -> dict:
+        """
+        The value for `envs["TRANSLATOR_URLS"]`.
+        """
+
+        base = f"http://{host}:{port}"
+        return {
+            "lin": {"url": f"{base}/lingvanex"},
+            "wat": {"url": f"{base}/watson/text", "url_detect": f"{base}/watson/detect"},
+        }
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8082):
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def delay(self) -> bool:
+        """
+        Waits as a real translator. Returns False if the request should
+        fail.
+        """
+
+        self.requests += 1
+        if self.random.random() < self.hang_rate:
+            await asyncio.sleep(self.hang_time)
+        else:
+            await asyncio.sleep(max(0.0, self.random.gauss(self.latency, self.jitter)))
+        return self.random.random() >= self.error_rate
+
+    async def lingvanex(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        if not await self.delay():
+            return web.Response(status=500)
+        return web.json_response({"err": None, "result": data["text"][::-1]})
+
+    async def watson_text(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        if not await self.delay():
+            return web.Response(status=500)
+        payload = {"translations": [{"translation": data["text"][::-1]}]}
+        return web.json_response({"status": "success", "message": "ok", "payload": payload})
+
+    async def watson_detect(self, request: web.Request) -> web.Response:
+        await request.post()
+        if not await self.delay():
+            return web.Response(status=500)
+        languages = [{"language": {"language": "ru", "name": "Russian"}, "confidence": 0.99}]
+        return web.json_response({"status": "success", "message": "ok", "payload": {"languages": languages}})
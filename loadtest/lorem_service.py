@@ -0,0 +1,113 @@
+"""
+Load test of the lorem HTTP service (`lorem_service`): the clients send
+requests over keep-alive connections as fast as the service answers
+(closed loop), the script reports RPS and latency percentiles.
+
+By default the service is started in a separate process (so it has its
+own core), with `--url` an already running service is tested.
+
+Usage (from the project root, offline on the example corpora):
+python -m loadtest.lorem_service --data text_data_example --connections 32 --duration 10
+python -m loadtest.lorem_service --url http://127.0.0.1:8090 --path "/lorem?lang=ru&words=64"
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+from typing import List, Optional
+
+import aiohttp
+
+
+async def wait_started(session: aiohttp.ClientSession, url: str, timeout: float = 60.0):
+    """
+    Waits until the service answers (the corpora are loaded at the
+    start).
+    """
+
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            async with session.get(f"{url}/languages") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientConnectionError:
+            pass
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"The service at {url} did not start in {timeout} seconds")
+        await asyncio.sleep(0.2)
+
+
+async def client(session: aiohttp.ClientSession, url: str, deadline: float, latencies: List[float], errors: List[int]):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        async with session.get(url) as response:
+            await response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(args: argparse.Namespace, url: str):
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await wait_started(session, url)
+
+        # warm up the connections and the caches of the indexes
+        warm_up: List[float] = []
+        await asyncio.gather(*(
+            client(session, url + args.path, time.perf_counter() + 1, warm_up, [])
+            for _ in range(args.connections)
+        ))
+
+        latencies: List[float] = []
+        errors: List[int] = []
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            client(session, url + args.path, started + args.duration, latencies, errors)
+            for _ in range(args.connections)
+        ))
+        elapsed = time.perf_counter() - started
+
+    print(f"{args.path}: {len(latencies)} answered, {len(errors)} errors in {elapsed:.1f} s")
+    print(f"{len(latencies) / elapsed:.0f} RPS with {args.connections} connections")
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100)
+        p50, p95, p99 = (cuts[p - 1] * 1000 for p in (50, 95, 99))
+        print(f"latency p50 {p50:.2f} ms, p95 {p95:.2f} ms, p99 {p99:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="a running service, otherwise it is started")
+    parser.add_argument("--path", default="/lorem?lang=en&words=64")
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--data", default="text_data", help="the corpora of the started service")
+    parser.add_argument("--index", help="the index directory of the started service")
+    args = parser.parse_args()
+
+    url = args.url
+    service: Optional[subprocess.Popen] = None
+    if url is None:
+        url = f"http://127.0.0.1:{args.port}"
+        command = [sys.executable, "-m", "lorem_service", "--port", str(args.port), "--data", args.data]
+        if args.index:
+            command += ["--index", args.index]
+        service = subprocess.Popen(command)
+
+    try:
+        asyncio.run(run(args, url.rstrip("/")))
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Load test of `UpdateDispatcher`: how the latency of the requests depends
+on the number of workers, and whether the workers and the order of the
+chats actually limit the running commands.
+The updates go through a real `Application` with `CommandRouter` (the
+Bot API is a local fake Telegram server), the commands only pretend to
+work: `/lorem` takes a little CPU time, `/translate` waits for a fake
+translator with a random delay. For every number of workers the peak
+number of the commands running at once and the number of the updates
+handled out of the order of their chat are reported.
+
+Usage (from the project root):
+python -m loadtest.worker_pool --workers 1 2 4 8 16 --requests 1000
+"""
+
+import time
+import random
+import asyncio
+import argparse
+from typing import Awaitable, Dict, List
+
+from telegram import Update
+from telegram.ext import Application, CallbackContext
+
+from router import CommandRouter
+from dispatcher import UpdateDispatcher
+
+from .fake_telegram import FakeTelegram
+
+
+class FakeCommands:
+    """
+    The commands of the bot, they record the latencies, the number of
+    the commands running at once and the order of the chats.
+    """
+
+    def __init__(self, lorem_time: float, translator_latency: float):
+        self.lorem_time = lorem_time
+        self.translator_latency = translator_latency
+        self.latencies: Dict[str, List[float]] = {}
+        self.created: Dict[int, float] = {}
+        self.running = 0
+        self.peak_running = 0
+        # the sequence number of the last handled update by chat
+        self.last_handled: Dict[int, int] = {}
+        self.out_of_order = 0
+
+    async def lorem(self, update: Update, context: CallbackContext):
+        # generation blocks the event loop like the real one
+        await self.run(update, "/lorem", self.work())
+
+    async def translate(self, update: Update, context: CallbackContext):
+        # a fake translator, the delay is spread from 0.5x to 1.5x
+        await self.run(update, "/translate", asyncio.sleep(self.translator_latency * (0.5 + random.random())))
+
+    async def work(self):
+        end = time.perf_counter() + self.lorem_time
+        while time.perf_counter() < end:
+            pass
+
+    async def run(self, update: Update, command: str, work: Awaitable):
+        self.running += 1
+        self.peak_running = max(self.peak_running, self.running)
+        try:
+            await work
+        finally:
+            self.running -= 1
+
+        chat_id = update.effective_chat.id
+        number = update.message.message_id
+        if number < self.last_handled.get(chat_id, -1):
+            self.out_of_order += 1
+        self.last_handled[chat_id] = number
+        latency = time.perf_counter() - self.created.pop(update.update_id)
+        self.latencies.setdefault(command, []).append(latency)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+async def run(workers: int, args: argparse.Namespace) -> FakeCommands:
+    telegram = FakeTelegram()
+    await telegram.start(port=args.telegram_port)
+    app = Application.builder().token("1:worker_pool").updater(None).base_url(
+        f"http://127.0.0.1:{args.telegram_port}/bot"
+    ).build()
+    commands = FakeCommands(args.lorem_time, args.translator_latency)
+    router = CommandRouter()
+    router.add_command("lorem", commands.lorem)
+    router.add_command("translate", commands.translate)
+    app.add_handler(router)
+    await app.initialize()
+    dispatcher = UpdateDispatcher(app, workers)
+
+    try:
+        for number in range(args.requests):
+            text = "/translate" if random.random() < args.translate_share else "/lorem"
+            data = telegram.make_update(text)
+            chat_id = random.randrange(1, args.chats + 1)
+            data["message"]["chat"]["id"] = data["message"]["from"]["id"] = chat_id
+            data["message"]["message_id"] = number
+            update = Update.de_json(data, app.bot)
+            commands.created[update.update_id] = time.perf_counter()
+            dispatcher.submit(update)
+            await asyncio.sleep(random.expovariate(args.rps))
+
+        await dispatcher.stop()
+    finally:
+        await app.shutdown()
+        await telegram.stop()
+    return commands
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--rps", type=float, default=50, help="mean incoming rate")
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--translate-share", type=float, default=0.3)
+    parser.add_argument("--translator-latency", type=float, default=0.5)
+    parser.add_argument("--lorem-time", type=float, default=0.002)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--telegram-port", type=int, default=8181)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'command':>12} {'count':>6} {'p50, ms':>9} {'p99, ms':>9} {'peak':>5} {'unordered':>9}")
+    for workers in args.workers:
+        random.seed(args.seed)
+        commands = asyncio.run(run(workers, args))
+        for command, values in sorted(commands.latencies.items()):
+            p50 = percentile(values, 50) * 1000
+            p99 = percentile(values, 99) * 1000
+            print(
+                f"{workers:>8} {command:>12} {len(values):>6} {p50:>9.1f} {p99:>9.1f}"
+                f" {commands.peak_running:>5} {commands.out_of_order:>9}"
+            )
+
+
+if __name__ == "__main__":
+    main()
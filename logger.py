@@ -1,25 +1,42 @@
+import os
+import sys
+import time
+import queue
+import atexit
 import logging
-from typing import List, Dict, Union
+import threading
+import itertools
+from collections import deque
+from multiprocessing.queues import Queue as ProcessQueue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Deque, List, Dict, Tuple, Union, Optional
 from types import TracebackType
 
+from envs import envs
+
 
 __all__ = [
     "get_logger",
+    "forward_logs",
+    "listen_logs",
+    "ErrorLimiter",
+    "log_exception",
     "logger",
     "error_logger",
 ]
 
 
-def get_traceback(trb: TracebackType) -> List[str]:
+def get_traceback(trb: Optional[TracebackType]) -> List[str]:
     """
-    Collects the file and string of the current frame and recursively
-    adds the next to it.
+    Collects the file and string of each frame of the traceback (in a
+    loop, so a deep traceback does not hit the recursion limit).
     """
 
-    frame = f"{trb.tb_frame.f_code.co_filename} :{trb.tb_frame.f_lineno}"
-    if trb.tb_next is None:
-        return [frame]
-    return [frame] + get_traceback(trb.tb_next)
+    frames = []
+    while trb is not None:
+        frames.append(f"{trb.tb_frame.f_code.co_filename} :{trb.tb_lineno}")
+        trb = trb.tb_next
+    return frames
 
 
 class Logger(logging.Logger):
@@ -50,7 +67,7 @@ class Logger(logging.Logger):
         Parses the error traceback and formats it for multiline output.
         """
 
-        traceback_crumb = get_traceback(exc.__traceback__)
+        traceback_crumb = get_traceback(exc.__traceback__) or ["(no traceback)"]
         max_len = len(max(traceback_crumb, key=len))
         formatted_crumbs = (line.ljust(max_len, " ") for line in traceback_crumb)
         crumbs = " >\n".join(formatted_crumbs) + " !"
@@ -59,30 +76,319 @@ class Logger(logging.Logger):
 
 
 DEFAULT_FORMAT = "{levelname:<8} > {asctime:<23} >>| {msg}"
+STDOUT_FORMAT = "{msg}"
 
 existing_loggers: Dict[str, Logger] = {}
 
+# handlers that actually write the records of each logger; they are
+# called only by the listener thread
+record_handlers: Dict[str, List[logging.Handler]] = {}
+
+# all the loggers of the process put their records here, the listener
+# writes them in a separate thread
+log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+log_listener: Optional["BatchQueueListener"] = None
+
+
+class BufferedRotatingFileHandler(RotatingFileHandler):
+    """
+    A file handler that does not flush every record to the disk, but
+    keeps them in the buffer (the buffer is flushed when it is full or by
+    the listener when there are no new records for a while).
+    The file is rotated both by size and by time.
+    """
+
+    def __init__(
+            self,
+            filename: str,
+            max_bytes: int = 10 * 1024 * 1024,
+            backup_count: int = 5,
+            rotate_interval: float = 24 * 60 * 60,
+            buffer_size: int = 64 * 1024,
+    ):
+        self.buffer_size = buffer_size
+        self.rotate_interval = rotate_interval
+        super().__init__(filename, "a", max_bytes, backup_count, encoding="utf8")
+        self.size = os.path.getsize(self.baseFilename)
+        self.rollover_at = time.time() + rotate_interval
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, encoding=self.encoding, buffering=self.buffer_size)
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        # the size is counted by itself, `tell()` would flush the buffer
+        if self.maxBytes and self.size >= self.maxBytes:
+            return True
+        return time.time() >= self.rollover_at
+
+    def doRollover(self):
+        super().doRollover()
+        self.size = 0
+        self.rollover_at = time.time() + self.rotate_interval
+
+    def emit(self, record: logging.LogRecord):
+        # as `StreamHandler.emit`, but without flush
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            msg = self.format(record) + self.terminator
+            self.stream.write(msg)
+            self.size += len(msg.encode("utf8"))
+        except Exception:
+            self.handleError(record)
+
+
+class LoggerRouter(logging.Handler):
+    """
+    Passes the records received from the queue to the handlers of the
+    logger with the same name.
+    """
+
+    def emit(self, record: logging.LogRecord):
+        for handler in record_handlers.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+class BatchQueueListener(QueueListener):
+    """
+    Listener that flushes the buffers of all the handlers when the queue
+    has been empty for `flush_interval` seconds, so the records are
+    written in batches, but not too late.
+    """
+
+    flush_interval = 1.0
+
+    def __init__(self, queue_):
+        super().__init__(queue_, LoggerRouter())
+
+    @staticmethod
+    def flush():
+        for handlers in record_handlers.values():
+            for handler in handlers:
+                handler.flush()
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval)
+            except queue.Empty:
+                self.flush()
+
+    def stop(self):
+        super().stop()
+        self.flush()
+
+
+def start_listener():
+    """
+    Starts the listener of the process log queue (once).
+    """
+
+    global log_listener
+    if log_listener is None:
+        log_listener = BatchQueueListener(log_queue)
+        log_listener.start()
+        atexit.register(log_listener.stop)
+
 
 def get_logger(
         name: str = "logger",
         file: str = "logs/log.txt",
         fmt: str = DEFAULT_FORMAT,
         level: Union[int, str] = logging.WARNING,
+        to_stdout: bool = False,
 ) -> Logger:
     """
     Custom logger initialization.
+    The logger itself only puts the records in the queue, and they are
+    written to the file (and to stdout, if needed) in a separate thread,
+    so logging never blocks the event loop.
     """
 
     if name not in existing_loggers:
-        logger_ = Logger(name, level)
-        handler = logging.FileHandler(file, mode='a')
         formatter = logging.Formatter(fmt, style='{')
-        handler.setFormatter(formatter)
-        logger_.addHandler(handler)
+        file_handler = BufferedRotatingFileHandler(file)
+        file_handler.setFormatter(formatter)
+        handlers: List[logging.Handler] = [file_handler]
+        if to_stdout:
+            stdout_handler = logging.StreamHandler(sys.stdout)
+            stdout_handler.setFormatter(logging.Formatter(STDOUT_FORMAT, style='{'))
+            handlers.append(stdout_handler)
+        record_handlers[name] = handlers
+
+        logger_ = Logger(name, level)
+        logger_.addHandler(QueueHandler(log_queue))
         existing_loggers[name] = logger_
+        start_listener()
 
     return existing_loggers[name]
 
 
-logger = get_logger(level="INFO")
+def forward_logs(queue_: ProcessQueue):
+    """
+    Redirects all the loggers of the current process to the queue. The
+    records are written to the files by the process that listens to the
+    queue (see `listen_logs`).
+    The file handlers inherited from the parent process are not touched,
+    they must not write anything here.
+    """
+
+    global log_queue
+    log_queue = queue_
+    for logger_ in existing_loggers.values():
+        for handler in logger_.handlers:
+            if isinstance(handler, QueueHandler):
+                handler.queue = queue_
+
+
+def listen_logs(queue_: ProcessQueue) -> QueueListener:
+    """
+    Starts writing the records from the queue (sent by `forward_logs` in
+    other processes) by the handlers of the current process.
+    """
+
+    listener = BatchQueueListener(queue_)
+    listener.start()
+    return listener
+
+
+logger = get_logger(level="INFO", to_stdout=envs.get("LOG_STDOUT", False))
 error_logger = get_logger("error", "logs/error.txt", DEFAULT_FORMAT + "\n")
+
+
+# (exception type, frames of the traceback)
+Fingerprint = Tuple[str, Tuple[Tuple[str, int], ...]]
+
+
+class ErrorLimiter:
+    """
+    Limits the logging of the same error (the same type raised by the
+    same code, see `fingerprint`): at most `limit` tracebacks in any
+    `window` seconds, the other repeats are only counted, and every
+    `summary_interval` seconds their numbers are logged in one line per
+    error. So an outage (for example, of a translator) gives a few
+    tracebacks and a summary instead of thousands of the same ones.
+    The summaries are written by a thread started on the first
+    suppressed error in each process.
+    """
+
+    max_fingerprints = 1000
+
+    def __init__(self, limit: int = 5, window: float = 60.0, summary_interval: float = 60.0):
+        self.limit = limit
+        self.window = window
+        self.summary_interval = summary_interval
+        self.lock = threading.Lock()
+        # the times of the logged tracebacks in the window
+        self.logged: Dict[Fingerprint, Deque[float]] = {}
+        # the numbers of the suppressed repeats and the text of the last
+        self.suppressed: Dict[Fingerprint, Tuple[int, str]] = {}
+        self.pid: Optional[int] = None
+
+    @staticmethod
+    def fingerprint(exc: BaseException) -> Fingerprint:
+        frames = []
+        trb = exc.__traceback__
+        while trb is not None:
+            frames.append((trb.tb_frame.f_code.co_filename, trb.tb_lineno))
+            trb = trb.tb_next
+        exc_type = type(exc)
+        return f"{exc_type.__module__}.{exc_type.__qualname__}", tuple(frames)
+
+    def allow(self, exc: BaseException) -> bool:
+        """
+        Whether the error should be logged in full, otherwise it is
+        counted as suppressed.
+        """
+
+        key = self.fingerprint(exc)
+        now = time.monotonic()
+        with self.lock:
+            times = self.logged.get(key)
+            if times is None:
+                if len(self.logged) >= self.max_fingerprints:
+                    self.prune(now)
+                times = self.logged[key] = deque()
+            while times and times[0] <= now - self.window:
+                times.popleft()
+            if len(times) < self.limit:
+                times.append(now)
+                return True
+
+            count, _ = self.suppressed.get(key, (0, ""))
+            self.suppressed[key] = (count + 1, Logger.get_exc_info(exc))
+        self.start_reporter()
+        return False
+
+    def prune(self, now: float):
+        """
+        Forgets the errors that were not logged in the window, and if it
+        is not enough (many different errors at once), the oldest ones
+        down to 90% of `max_fingerprints`. The suppressed repeats of the
+        forgotten errors are still reported in the summary.
+        """
+
+        for key in list(self.logged):
+            times = self.logged[key]
+            if (not times or times[-1] <= now - self.window) and key not in self.suppressed:
+                del self.logged[key]
+
+        # the dictionary keeps the order of the first logging
+        excess = len(self.logged) - self.max_fingerprints * 9 // 10
+        for key in list(itertools.islice(self.logged, max(excess, 0))):
+            del self.logged[key]
+
+    def pop_summaries(self) -> List[str]:
+        with self.lock:
+            suppressed, self.suppressed = self.suppressed, {}
+        return [
+            f"{count} repeats of {exc_type} suppressed since the last summary: {text}"
+            for (exc_type, _), (count, text) in suppressed.items()
+        ]
+
+    def report(self):
+        for summary in self.pop_summaries():
+            error_logger.error(summary)
+            logger.error(summary)
+
+    def start_reporter(self):
+        # the threads are not inherited by the forked processes
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+
+        def report_loop():
+            while True:
+                time.sleep(self.summary_interval)
+                self.report()
+
+        threading.Thread(target=report_loop, name="error-reporter", daemon=True).start()
+        atexit.register(self.report)
+
+
+error_limits = envs.get("ERROR_LOG", {})
+error_limiter = ErrorLimiter(
+    error_limits.get("limit", 5),
+    error_limits.get("window", 60.0),
+    error_limits.get("summary_interval", 60.0),
+)
+
+
+def log_exception(exc: BaseException, short: bool = True):
+    """
+    Writes the traceback of the error to `logs/error.txt` and, if
+    `short`, one line to the main log; the frequent repeats are
+    suppressed (see `ErrorLimiter`).
+    """
+
+    if not error_limiter.allow(exc):
+        return
+    error_logger.error(error_logger.get_full_exc_info(exc))
+    if short:
+        logger.error(logger.get_exc_info(exc))
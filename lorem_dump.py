@@ -0,0 +1,239 @@
+"""
+Bulk generation of pseudotext (for datasets, fuzzing and test fixtures),
+without the bot and `.envs`, only the corpora are needed:
+python -m lorem_dump words --lang en --size 1G -o en.txt
+python -m lorem_dump sentences --lang ru --count 3 --texts 100000 --workers 4
+python -m lorem_dump chinese --count 48 | head -c 10M > chinese.txt
+
+The texts are written one per line (to stdout by default) by blocks, so
+the memory does not grow with the output. Without `--size` or `--texts`
+the generation does not stop until the output is closed.
+
+The output depends only on the parameters and `--seed`: the block `i`
+is generated with its own random generator seeded by `(seed, i)`, so
+the blocks can be generated in any order, and with `--workers` they are
+split between the processes and written in order. The speed (MB/s) is
+reported to stderr.
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import itertools
+import multiprocessing
+from collections import deque
+from random import Random
+from typing import IO, Iterator, List, Optional
+
+from lorem_generator import LoremGenerator, ChineseGenerator, new_seed
+
+
+__all__ = [
+    "Dumper",
+    "parse_size",
+]
+
+
+def parse_size(size: str) -> int:
+    """
+    The number of bytes by the string like `1000`, `64k`, `500M`, `2G`.
+    """
+
+    match = re.fullmatch(r"(\d+)([kmg]?)b?", size.strip().lower())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"The size must be like 64k, 500M or 2G, not {size!r}")
+    number, unit = match.groups()
+    return int(number) * 1024 ** " kmg".index(unit or " ")
+
+
+class Dumper:
+    """
+    Generates the texts of one kind by the blocks of `block_texts` texts.
+    """
+
+    kinds = ("words", "sentences", "chinese")
+
+    def __init__(
+            self,
+            lorem: LoremGenerator,
+            chinese: ChineseGenerator,
+            kind: str,
+            language: str,
+            count: int,
+            chars_len: int,
+            seed: int,
+            block_texts: int = 256,
+    ):
+        if kind not in self.kinds:
+            raise ValueError(f"Unknown kind {kind}, known: {', '.join(self.kinds)}")
+        if kind != "chinese" and language not in lorem.languages:
+            raise ValueError(f"Unknown language {language}, known: {', '.join(lorem.languages)}")
+
+        self.lorem = lorem
+        self.chinese = chinese
+        self.kind = kind
+        self.language = language
+        self.count = count
+        self.chars_len = chars_len
+        self.seed = seed
+        self.block_texts = block_texts
+
+    def generate_text(self, rng: Random) -> str:
+        if self.kind == "words":
+            return self.lorem.generate_lorem(self.language, self.count, self.chars_len, rng)
+        if self.kind == "sentences":
+            return self.lorem.generate_sentences(self.language, self.count, self.chars_len, rng)
+        # the texts are separated by the line breaks
+        return self.chinese.get_chinese(self.count, rng).replace("\n", "")
+
+    def generate_block(self, block: int, texts: Optional[int] = None) -> bytes:
+        """
+        The texts of the block (the first `texts` of them if set), each
+        ends with a line break.
+        """
+
+        # a string seed is hashed by `Random` itself, the same in any process
+        rng = Random(f"{self.seed}:{block}")
+        count = self.block_texts if texts is None else texts
+        return "".join(self.generate_text(rng) + "\n" for _ in range(count)).encode("utf8")
+
+
+# the dumper of the worker process
+_dumper: Optional[Dumper] = None
+
+
+def init_worker(dumper: Dumper):
+    global _dumper
+    _dumper = dumper
+
+
+def generate_block(block: int, texts: Optional[int] = None) -> bytes:
+    return _dumper.generate_block(block, texts)
+
+
+def iter_blocks(dumper: Dumper, total_texts: Optional[int], workers: int) -> Iterator[bytes]:
+    """
+    The blocks in order, endlessly if the number of texts is not set.
+    With several workers, the next blocks are generated in the other
+    processes, at most two per worker ahead (so the memory does not
+    grow if the output is slower).
+    """
+
+    if total_texts is None:
+        blocks = ((block, None) for block in itertools.count())
+    else:
+        full_blocks, rest = divmod(total_texts, dumper.block_texts)
+        blocks = ((block, None) for block in range(full_blocks))
+        if rest:
+            blocks = itertools.chain(blocks, [(full_blocks, rest)])
+
+    if workers == 1:
+        for block, texts in blocks:
+            yield dumper.generate_block(block, texts)
+        return
+
+    # the corpora are already loaded, the forked workers share them
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(dumper,)) as pool:
+        pending = deque()
+        for block, texts in blocks:
+            pending.append(pool.apply_async(generate_block, (block, texts)))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def dump(
+        dumper: Dumper,
+        output: IO[bytes],
+        size: Optional[int] = None,
+        total_texts: Optional[int] = None,
+        workers: int = 1,
+        progress: bool = False,
+) -> int:
+    """
+    Writes the texts to the output until `size` bytes (the last text is
+    written whole) or `total_texts` texts are written. Returns the number
+    of written bytes.
+    """
+
+    started = last_report = time.perf_counter()
+    written = 0
+    for data in iter_blocks(dumper, total_texts, workers):
+        if size is not None and written + len(data) >= size:
+            data = data[:data.index(b"\n", max(size - written - 1, 0)) + 1]
+        output.write(data)
+        written += len(data)
+
+        now = time.perf_counter()
+        if progress and now - last_report >= 1:
+            last_report = now
+            report(written, now - started, end="\r")
+        if size is not None and written >= size:
+            break
+
+    output.flush()
+    report(written, time.perf_counter() - started)
+    return written
+
+
+def report(written: int, elapsed: float, end: str = "\n"):
+    megabytes = written / 1024 ** 2
+    speed = megabytes / elapsed if elapsed else 0.0
+    print(f"{megabytes:.1f} MB in {elapsed:.1f} s, {speed:.2f} MB/s", end=end, file=sys.stderr, flush=True)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m lorem_dump", description=__doc__.split("\n\n")[0])
+    parser.add_argument("kind", choices=Dumper.kinds)
+    parser.add_argument("--lang", default=LoremGenerator.default_language)
+    parser.add_argument("--count", type=int, help="words, sentences or characters in a text (64, 1 and 48 by default)")
+    parser.add_argument("--chars", type=int, default=LoremGenerator.default_chars_len, help="the buffer length")
+    limit = parser.add_mutually_exclusive_group()
+    limit.add_argument("--size", type=parse_size, help="stop after this many bytes, like 500M or 2G")
+    limit.add_argument("--texts", type=int, help="stop after this many texts")
+    parser.add_argument("--seed", type=int, help="the same seed gives the same output, random by default")
+    parser.add_argument("--workers", type=int, default=1, help="the number of the generating processes")
+    parser.add_argument("-o", "--output", default="-", help="the output file, stdout by default")
+    parser.add_argument("--data", default=LoremGenerator.data_directory, help="the corpora directory")
+    parser.add_argument("--index", help="the index directory, `<data>/.index` by default")
+    parser.add_argument("--chinese", help="the Chinese text, `<data>/chinese.txt` by default")
+    args = parser.parse_args(argv)
+
+    if args.count is None:
+        args.count = {"words": LoremGenerator.default_word_count, "sentences": 1, "chinese": 48}[args.kind]
+    if args.count < 1 or args.workers < 1:
+        parser.error("--count and --workers must be positive")
+    if not 1 <= args.chars <= LoremGenerator.max_chars_len:
+        parser.error(f"--chars must be 1-{LoremGenerator.max_chars_len}")
+    seed = new_seed() if args.seed is None else args.seed
+    print(f"seed {seed}", file=sys.stderr)
+
+    lorem = LoremGenerator(args.data, args.index)
+    chinese = ChineseGenerator(args.chinese or f"{args.data}/chinese.txt")
+    if args.kind == "chinese":
+        chinese.load()
+    else:
+        lorem.load()
+    try:
+        dumper = Dumper(lorem, chinese, args.kind, args.lang, args.count, args.chars, seed)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        dump(dumper, output, args.size, args.texts, args.workers, progress=sys.stderr.isatty())
+    except BrokenPipeError:
+        # the reader has enough (`| head`), the rest of the output is dropped
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
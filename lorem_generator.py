@@ -6,19 +6,32 @@ The algorithm is as follows:
   1) collect the entire text array
   2) move the cursor to a random place
   3) memorize the next two letters and write them into the resulting text
-  4) move the cursor to a random place
-  5) move the cursor forward to the first occurrence of these letters
-     in the text
-  6) if the resulting text is still insufficient, return to step 3)
+  4) move the cursor to a random occurrence of these letters in the
+     text (they are found by the suffix array, see `corpus_index`, or
+     by the FM-index, see `fm_index`)
+  5) if the resulting text is still insufficient, return to step 3)
 """
 
+import os
 import re
-from random import randint
+import time
+import threading
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from random import Random
 from pathlib import Path
-from typing import Dict, Union, List, Callable
+from dataclasses import dataclass
+from typing import Dict, Union, List, Callable, Optional, Tuple
+
+from metrics import Histogram
+from corpus_index import CorpusIndex
+from fm_index import FMIndex
 
 
 __all__ = [
+    "new_seed",
+    "Corpora",
     "lorem_generator",
     "chinese_generator",
 ]
@@ -75,6 +88,49 @@ def reduce_lines(path, to=None):
 # =====================================================================
 
 
+generation_duration = Histogram(
+    "lorem_generation_duration_seconds",
+    "Duration of the lorem generation",
+    ["language", "chars_len"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+def new_seed() -> int:
+    """
+    A seed for the random generator of one request. The generation with
+    the same seed and parameters gives the same text, so the seed is
+    enough to repeat any output.
+    """
+    return int.from_bytes(os.urandom(6), "big")
+
+
+def get_rng(rng: Optional[Random]) -> Random:
+    # the global `random` is shared by all the threads and cannot be
+    # repeated, every generation has its own generator
+    return rng if rng is not None else Random(new_seed())
+
+
+# (name, size, modification time) of the files of a language
+Signature = Tuple[Tuple[str, int, int], ...]
+
+
+@dataclass(frozen=True)
+class Corpora:
+    """
+    The loaded corpora, never changed: a changed language gets new
+    corpora, which replace the old ones in the generator at once, so a
+    generation sees either the old or the new corpus, never a mix.
+    """
+
+    languages: List[str]
+    # the texts of the languages without FM-indexes
+    text_data: Dict[str, str]
+    indexes: Dict[str, Union[CorpusIndex, FMIndex]]
+    # the state of the files the languages are loaded from
+    signatures: Dict[str, Signature]
+
+
 class LoremGenerator:
     """
     A class that generates a lorem.
@@ -85,6 +141,7 @@ class LoremGenerator:
     default_language = "ru"
     default_word_count = 64
     default_chars_len = 2
+    max_chars_len = CorpusIndex.max_chars
 
     punctuation = r"!,.?"
     end_sentence = punctuation.replace(",", "")
@@ -99,12 +156,20 @@ class LoremGenerator:
         "ge": "აბგდევზთიკლმნოპჟრსტუფქღყშჩცძწჭხჯჰ",
     }
 
-    text_data: Dict[str, str]
-    languages: List[str]
+    _corpora: Optional[Corpora] = None
 
-    def __init__(self):
-        self.text_data = self.collect_data(self.data_directory)
-        self.languages = list(self.text_data)
+    def __init__(self, data_directory: Optional[str] = None, index_directory: Optional[str] = None):
+        """
+        The corpora are read on the first use (or by `load`), so the
+        import of the module is cheap. The indexes of the corpora are
+        kept in `index_directory` (`<data_directory>/.index` by default).
+        """
+
+        if data_directory is not None:
+            self.data_directory = data_directory
+        self.index_directory = index_directory or str(Path(self.data_directory) / ".index")
+        # the corpora are replaced by one thread at a time
+        self.swap_lock = threading.Lock()
         self.patterns = {
             "multi_dot": re.compile(fr"([{self.punctuation}])+"),
             "multi_space": re.compile(r"\s+"),
@@ -114,10 +179,166 @@ class LoremGenerator:
             "all_punctuation": re.compile(f"[{self.punctuation}]"),
         }
 
-    def collect_data(self, data_directory: str) -> Dict[str, str]:
+    def load(self):
         """
-        Looks for subfolders of languages and reads all the text from
-        them.
+        Reads the corpora if they are not read yet.
+        A language with an FM-index (built by `python -m fm_index`) is
+        loaded from it, its text is not read. The other languages are
+        read and get a suffix array (built and cached on the first
+        load).
+        """
+
+        if self._corpora is None:
+            with self.swap_lock:
+                if self._corpora is not None:
+                    return
+                text_data = dict()
+                indexes: Dict[str, Union[CorpusIndex, FMIndex]] = dict()
+                signatures: Dict[str, Signature] = dict()
+                for lang_dir in self.language_dirs(self.data_directory):
+                    language = lang_dir.name
+                    signature = self.language_signature(language)
+                    text, index = self.load_language(lang_dir)
+                    if index is None:
+                        continue
+                    if text is not None:
+                        text_data[language] = text
+                    indexes[language] = index
+                    signatures[language] = signature
+
+                self._corpora = Corpora(list(indexes), text_data, indexes, signatures)
+
+    def load_language(self, lang_dir: Path) -> Tuple[Optional[str], Union[CorpusIndex, FMIndex, None]]:
+        """
+        The text (None for an FM-index) and the index of the language,
+        (None, None) if the language has no files.
+        """
+
+        index = self.load_fm_index(lang_dir)
+        if index is not None:
+            return None, index
+        text = self.read_language_data(lang_dir)
+        if text is None:
+            return None, None
+        return text, CorpusIndex.load_or_build(text, Path(self.index_directory) / f"{lang_dir.name}.sa")
+
+    def load_language_in_process(self, lang_dir: Path) -> Tuple[Optional[str], Union[CorpusIndex, FMIndex, None]]:
+        """
+        The same as `load_language`, but the text is read and cleaned and
+        its suffix array is built in a separate process (see
+        `read_and_index`): both hold the GIL for seconds on large texts,
+        which would stop the event loop of the process.
+        """
+
+        index = self.load_fm_index(lang_dir)
+        if index is not None:
+            return None, index
+        # a fork of a process with threads may copy a held lock
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            text, suffix_array = executor.submit(
+                read_and_index,
+                str(Path(self.data_directory).absolute()),
+                str(Path(self.index_directory).absolute()),
+                lang_dir.name,
+            ).result()
+        if text is None:
+            return None, None
+        return text, CorpusIndex(text, suffix_array)
+
+    def language_signature(self, language: str) -> Signature:
+        """
+        The state of the files the language is loaded from (the texts and
+        the FM-index), changes when any of them is changed, added or
+        removed.
+        """
+
+        paths = [self.fm_index_path(language)]
+        lang_dir = Path(self.data_directory).absolute() / language
+        if lang_dir.is_dir():
+            paths += self.language_files(lang_dir)
+
+        signature = []
+        for path in sorted(paths):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            signature.append((path.name, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def reload_language(self, language: str) -> bool:
+        """
+        Reads the language again (or removes it if it has no files any
+        more) and replaces the corpora with the new ones. The generation
+        continues with the old corpora meanwhile, the language is read in
+        a separate process. Returns whether the language is loaded.
+        """
+
+        self.load()
+        with self.swap_lock:
+            signature = self.language_signature(language)
+            lang_dir = Path(self.data_directory).absolute() / language
+            text, index = self.load_language_in_process(lang_dir) if lang_dir.is_dir() else (None, None)
+
+            old = self._corpora
+            text_data = {lang: data for lang, data in old.text_data.items() if lang != language}
+            indexes = dict(old.indexes)
+            signatures = dict(old.signatures)
+            if index is None:
+                indexes.pop(language, None)
+                signatures.pop(language, None)
+            else:
+                if text is not None:
+                    text_data[language] = text
+                indexes[language] = index
+                signatures[language] = signature
+            self._corpora = Corpora(list(indexes), text_data, indexes, signatures)
+        return index is not None
+
+    @property
+    def corpora(self) -> Corpora:
+        self.load()
+        return self._corpora
+
+    @property
+    def text_data(self) -> Dict[str, str]:
+        """
+        The texts of the languages without FM-indexes.
+        """
+        return self.corpora.text_data
+
+    @property
+    def languages(self) -> List[str]:
+        return self.corpora.languages
+
+    @property
+    def indexes(self) -> Dict[str, Union[CorpusIndex, FMIndex]]:
+        return self.corpora.indexes
+
+    def fm_index_path(self, language: str) -> Path:
+        return Path(self.index_directory) / f"{language}.fm"
+
+    def load_fm_index(self, lang_dir: Path) -> Optional[FMIndex]:
+        """
+        Loads the FM-index of the language if there is one. The index
+        must be built from the current files of the language (if they are
+        kept).
+        """
+
+        path = self.fm_index_path(lang_dir.name)
+        if not path.is_file():
+            return None
+        index = FMIndex.load(path)
+        files = self.language_files(lang_dir)
+        if files and FMIndex.source_signature(files) != index.sources:
+            msg = f"The FM-index {path} is outdated, rebuild it: python -m fm_index {self.data_directory}"
+            raise ValueError(msg)
+        return index
+
+    def language_dirs(self, data_directory: str) -> List[Path]:
+        """
+        Looks for subfolders of languages.
         """
 
         data_path = Path(data_directory).absolute()
@@ -128,19 +349,34 @@ class LoremGenerator:
         languages = [
             folder
             for folder in data_path.iterdir()
-            if folder.is_dir()
+            if folder.is_dir() and not folder.name.startswith(".")
         ]
         if not languages:
             raise ValueError("There are no language subfolders in the directory.")
+        return languages
+
+    def collect_data(self, data_directory: str) -> Dict[str, str]:
+        """
+        Looks for subfolders of languages and reads all the text from
+        them.
+        """
 
         text_data = dict()
-        for lang_dir in languages:
+        for lang_dir in self.language_dirs(data_directory):
             text = self.read_language_data(lang_dir)
             if text is not None:
                 text_data[lang_dir.name] = text
 
         return text_data
 
+    @staticmethod
+    def language_files(lang_dir: Path) -> List[Path]:
+        return [
+            file
+            for file in lang_dir.iterdir()
+            if str(file).endswith(".txt")
+        ]
+
     def read_language_data(self, lang_dir: Path) -> Union[str, None]:
         """
         Reads all files in `.txt.` format from a subfolder, joins them
@@ -148,11 +384,7 @@ class LoremGenerator:
         breaks and extra spaces, translates into lowercase, tries to
         remove extra characters).
         """
-        files = [
-            file
-            for file in lang_dir.iterdir()
-            if str(file).endswith(".txt")
-        ]
+        files = self.language_files(lang_dir)
         if not files:
             return None
 
@@ -173,36 +405,54 @@ class LoremGenerator:
             self,
             language: str,
             chars_len: int,
-            is_need_to_stop_condition: Callable[[str], bool]
+            is_need_to_stop_condition: Callable[[str], bool],
+            rng: Optional[Random] = None,
+            stop_chars: Optional[str] = None,
     ) -> str:
         """
         Generates Lorem.
         To do this, it selects several characters into the buffer, and
-        then searches for them in the text (in a random place), replaces
-        the buffer with the characters next to them, and repeats again.
+        then takes a random occurrence of them in the text (by the suffix
+        array or the FM-index of the corpus, see their `walk`), replaces
+        the buffer with the characters next to it, and repeats again.
         The resulting text is the join of all the buffers used.
 
-        The last argument is the function that determines when the
-        generation stops.
+        The third argument is the function that determines when the
+        generation stops (once true, it stays true for the longer text),
+        the next one is the random generator (a new one by default). If
+        the condition can change only when one of `stop_chars` is added,
+        it is checked only after such text.
         """
 
-        text = self.text_data[language]
-        text_len = len(text)
-        looped_text = text + text[:chars_len]
-
-        resulting_text = ""
-        buffer = ""
-        while not is_need_to_stop_condition(resulting_text):
-            start_ind = randint(0, text_len)
-            first_index = looped_text.find(buffer, start_ind, text_len)
-            if first_index == -1:
-                first_index = looped_text.find(buffer)
-            next_symbols_ind = first_index + chars_len
+        if not 1 <= chars_len <= self.max_chars_len:
+            raise ValueError(f"The buffer length must be 1-{self.max_chars_len}, not {chars_len}")
 
-            buffer = looped_text[next_symbols_ind: next_symbols_ind + chars_len]
-            resulting_text += buffer
+        # the corpora may be replaced meanwhile, the generation uses the
+        # index it has taken
+        index = self.indexes.get(language)
+        if index is None:
+            raise ValueError(f"Unknown language {language}")
+        has_stop_char = re.compile(f"[{re.escape(stop_chars)}]").search if stop_chars else None
 
-        return resulting_text
+        # the text is generated by chunks of buffers, the condition is
+        # checked for the whole chunk, and in the chunk that satisfies it
+        # the first such buffer is found by bisection
+        resulting_text = ""
+        for chunk in index.walk(chars_len, get_rng(rng)):
+            text = resulting_text + chunk
+            if (
+                    (has_stop_char is None or has_stop_char(chunk))
+                    and is_need_to_stop_condition(text)
+            ):
+                low, high = 0, len(chunk) // chars_len
+                while high - low > 1:
+                    middle = (low + high) // 2
+                    if is_need_to_stop_condition(resulting_text + chunk[:middle * chars_len]):
+                        high = middle
+                    else:
+                        low = middle
+                return resulting_text + chunk[:high * chars_len]
+            resulting_text = text
 
     def postprocess_lorem(self, text: str) -> str:
         """
@@ -243,7 +493,8 @@ class LoremGenerator:
             self,
             language: str = default_language,
             words: int = default_word_count,
-            chars_len: int = default_chars_len
+            chars_len: int = default_chars_len,
+            rng: Optional[Random] = None,
     ) -> str:
         """
         The main method of the class, generates the Lorem and fixes it
@@ -253,24 +504,29 @@ class LoremGenerator:
         if language not in self.languages:
             raise ValueError(f"Unknown language {language}")
 
+        started = time.perf_counter()
         is_sufficient_text = lambda text: text.count(" ") >= words
-        resulting_text = self.generate_raw_lorem(language, chars_len, is_sufficient_text)
+        resulting_text = self.generate_raw_lorem(language, chars_len, is_sufficient_text, rng, " ")
         resulting_text = self.postprocess_lorem(resulting_text)
+        duration = time.perf_counter() - started
+        generation_duration.labels(language, chars_len).observe(duration)
         return resulting_text
 
     def __call__(
             self,
             language: str = default_language,
             words: int = default_word_count,
-            chars_len: int = default_chars_len
+            chars_len: int = default_chars_len,
+            rng: Optional[Random] = None,
     ) -> str:
-        return self.generate_lorem(language, words, chars_len)
+        return self.generate_lorem(language, words, chars_len, rng)
 
     def generate_sentences(
             self,
             language: str = default_language,
             sentences_count: int = 1,
-            chars_len: int = default_chars_len
+            chars_len: int = default_chars_len,
+            rng: Optional[Random] = None,
     ) -> str:
         """
         Generates several Lorem sentences.
@@ -279,6 +535,8 @@ class LoremGenerator:
         if language not in self.languages:
             raise ValueError(f"Unknown language {language}")
 
+        started = time.perf_counter()
+
         # as `self._sentences_pattern`, but without a space at the end
         sentences_end_pat = re.compile(fr"([{self.end_sentence}])")
 
@@ -286,12 +544,14 @@ class LoremGenerator:
             text = text.lstrip(self.end_sentence + " ")
             return len(sentences_end_pat.findall(text)) >= sentences_count
 
-        resulting_text = self.generate_raw_lorem(language, chars_len, is_sufficient)
+        resulting_text = self.generate_raw_lorem(language, chars_len, is_sufficient, rng, self.end_sentence)
         resulting_text = resulting_text.lstrip(self.end_sentence + " ")
         split_text = sentences_end_pat.split(resulting_text)
         resulting_text = "".join(split_text[:sentences_count * 2])
 
         resulting_text = self.postprocess_lorem(resulting_text)
+        duration = time.perf_counter() - started
+        generation_duration.labels(language, chars_len).observe(duration)
         return resulting_text
 
     def clear_text(self, text: str) -> str:
@@ -310,32 +570,63 @@ class ChineseGenerator:
 
     chinese_path = "./text_data/chinese.txt"
 
-    chinese: str
-    len: int
+    _chinese: Optional[str] = None
 
-    def __init__(self):
-        with open(self.chinese_path, "r", encoding="utf8") as chinese_file:
-            self.chinese = chinese_file.read()
-        self.len = len(self.chinese)
+    def __init__(self, chinese_path: Optional[str] = None):
+        """
+        The text is read on the first use (or by `load`).
+        """
+
+        if chinese_path is not None:
+            self.chinese_path = chinese_path
+
+    def load(self):
+        if self._chinese is None:
+            with open(self.chinese_path, "r", encoding="utf8") as chinese_file:
+                self._chinese = chinese_file.read()
+
+    @property
+    def chinese(self) -> str:
+        self.load()
+        return self._chinese
+
+    @property
+    def len(self) -> int:
+        return len(self.chinese)
 
-    def get_chinese(self, count: int) -> str:
+    def get_chinese(self, count: int, rng: Optional[Random] = None) -> str:
         """
         Returns several consecutive Chinese characters from a random
         place in the text.
         """
 
-        if count > self.len:
-            raise ValueError(f"Requires more text ({count}) than there is ({self.len})")
+        chinese = self.chinese
+        length = len(chinese)
+        if count > length:
+            raise ValueError(f"Requires more text ({count}) than there is ({length})")
 
-        cursor = randint(0, self.len)
-        if cursor + count < self.len:
-            return self.chinese[cursor:cursor+count]
+        cursor = get_rng(rng).randint(0, length)
+        if cursor + count < length:
+            return chinese[cursor:cursor+count]
 
-        first_part = self.chinese[cursor:]
-        second_part = self.chinese[:count - (self.len-cursor) + 1]
+        first_part = chinese[cursor:]
+        second_part = chinese[:count - (length-cursor) + 1]
         return first_part + second_part
 
 
+def read_and_index(data_directory: str, index_directory: str, language: str) -> Tuple[Optional[str], Optional[array]]:
+    """
+    The text of the language and its suffix array (loaded from the cache
+    or built and cached), for `load_language_in_process`.
+    """
+
+    generator = LoremGenerator(data_directory, index_directory)
+    text = generator.read_language_data(Path(data_directory) / language)
+    if text is None:
+        return None, None
+    return text, CorpusIndex.load_or_build(text, Path(index_directory) / f"{language}.sa").suffix_array
+
+
 lorem_generator = LoremGenerator()
 chinese_generator = ChineseGenerator()
 
@@ -0,0 +1,293 @@
+"""
+An HTTP service of the generators, for the services that need pseudotext
+without the bot. It does not need `.envs`, only the corpora:
+python -m lorem_service [--host 127.0.0.1] [--port 8090] [--data text_data]
+
+The routes (GET with the query parameters or POST with a JSON object):
+  /lorem?lang=en&words=64&chars=2
+  /sentences?lang=en&count=3&chars=2
+  /chinese?count=48
+  /languages
+  /metrics
+The generation routes also take `seed` (the same seed and parameters
+give the same text) and `n` (the number of texts). The answer is JSON
+`{"seed": ..., "text": ...}` (`"texts": [...]` if `n` is given), or
+with `format=text` plain text, one text per line, streamed as the texts
+are generated (the seed is in the `X-Seed` header).
+
+The corpora are loaded once at the start (and with `--reload N` the
+changed languages are reloaded, see `corpus_watcher`). The texts are
+generated one by one in the callbacks of the event loop (see
+`JobScheduler`), and a request asks for its next text only when the
+previous one is ready, so a request of many texts takes turns with the
+others instead of holding the loop.
+"""
+
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from functools import partial
+from random import Random
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from metrics import Histogram, registry
+from lorem_generator import LoremGenerator, ChineseGenerator, new_seed
+
+
+__all__ = [
+    "JobScheduler",
+    "LoremService",
+]
+
+
+jobs_per_pass = Histogram(
+    "lorem_service_jobs_per_pass",
+    "Generation jobs done in one callback of the event loop",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+request_duration = Histogram(
+    "lorem_service_request_duration_seconds",
+    "Duration of the requests to the service",
+    ["route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+dumps = partial(json.dumps, ensure_ascii=False)
+
+
+class BadRequest(Exception):
+    pass
+
+
+class JobScheduler:
+    """
+    Runs the submitted jobs in the order they came, in callbacks of the
+    event loop. Each job is run separately, so it is not faster than
+    calling the generator directly; the point is the pacing. A pass runs
+    at most `max_jobs` jobs and stops after `max_pass_time` seconds, the
+    rest are run in the next iterations, so the loop handles the sockets
+    between the passes.
+    """
+
+    max_pass_time = 0.005
+
+    def __init__(self, max_jobs: int = 64):
+        self.max_jobs = max_jobs
+        self.jobs: Deque[Tuple[Callable[[], Any], asyncio.Future]] = deque()
+        self.is_scheduled = False
+
+    def submit(self, job: Callable[[], Any]) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.jobs.append((job, future))
+        if not self.is_scheduled:
+            self.is_scheduled = True
+            loop.call_soon(self.run)
+        return future
+
+    def run(self):
+        started = time.perf_counter()
+        done = 0
+        while self.jobs and done < self.max_jobs:
+            job, future = self.jobs.popleft()
+            if future.cancelled():
+                continue
+            try:
+                future.set_result(job())
+            except Exception as exc:
+                future.set_exception(exc)
+            done += 1
+            if time.perf_counter() - started >= self.max_pass_time:
+                break
+        jobs_per_pass.labels().observe(done)
+
+        if self.jobs:
+            asyncio.get_running_loop().call_soon(self.run)
+        else:
+            self.is_scheduled = False
+
+
+class LoremService:
+    # a text of the largest size takes a few milliseconds
+    max_texts = 100
+    max_words = 1000
+    max_sentences = 50
+    max_chinese = 10000
+
+    def __init__(self, lorem: LoremGenerator, chinese: ChineseGenerator, max_jobs: int = 64):
+        self.lorem = lorem
+        self.chinese = chinese
+        self.scheduler = JobScheduler(max_jobs)
+
+        self.web_app = web.Application()
+        for path, handler in (
+                ("/lorem", self.handle_lorem),
+                ("/sentences", self.handle_sentences),
+                ("/chinese", self.handle_chinese),
+        ):
+            self.web_app.router.add_route("GET", path, handler)
+            self.web_app.router.add_route("POST", path, handler)
+        self.web_app.router.add_get("/languages", self.handle_languages)
+        self.web_app.router.add_get("/metrics", self.handle_metrics)
+
+    # === the parameters ============================================
+
+    @staticmethod
+    async def get_params(request: web.Request) -> Dict[str, Any]:
+        params: Dict[str, Any] = dict(request.query)
+        if request.method == "POST" and request.can_read_body:
+            try:
+                body = await request.json()
+            except ValueError:
+                raise BadRequest("The body must be a JSON object")
+            if not isinstance(body, dict):
+                raise BadRequest("The body must be a JSON object")
+            params.update(body)
+        return params
+
+    @staticmethod
+    def get_int(params: Dict[str, Any], name: str, default: Optional[int], low: int, high: int) -> int:
+        value = params.get(name, default)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise BadRequest(f"`{name}` must be an integer, not {value!r}")
+        if not low <= value <= high:
+            raise BadRequest(f"`{name}` must be {low}-{high}, not {value}")
+        return value
+
+    def get_language(self, params: Dict[str, Any]) -> str:
+        language = params.get("lang", self.lorem.default_language)
+        if language not in self.lorem.languages:
+            raise BadRequest(f"Unknown language {language!r}, known: {', '.join(self.lorem.languages)}")
+        return language
+
+    def get_chars_len(self, params: Dict[str, Any]) -> int:
+        return self.get_int(params, "chars", self.lorem.default_chars_len, 1, self.lorem.max_chars_len)
+
+    # === the answers ===============================================
+
+    async def generate(self, request: web.Request, params: Dict[str, Any], job: Callable[[Random], str]):
+        """
+        Generates `n` texts by the job (with one random generator, in
+        order) and returns them in the requested format.
+        """
+
+        seed = self.get_int(params, "seed", new_seed(), 0, 2 ** 63)
+        count = self.get_int(params, "n", 1, 1, self.max_texts)
+        generated = self.generate_texts(partial(job, Random(seed)), count)
+
+        if params.get("format") == "text":
+            response = web.StreamResponse(headers={"X-Seed": str(seed)})
+            response.content_type = "text/plain"
+            response.charset = "utf-8"
+            await response.prepare(request)
+            async for text in generated:
+                await response.write((text + "\n").encode("utf8"))
+            await response.write_eof()
+            return response
+
+        texts = [text async for text in generated]
+        if "n" in params:
+            return web.json_response({"seed": seed, "texts": texts}, dumps=dumps)
+        return web.json_response({"seed": seed, "text": texts[0]}, dumps=dumps)
+
+    async def generate_texts(self, job: Callable[[], str], count: int) -> AsyncIterator[str]:
+        # the next text is submitted when the previous one is ready, so
+        # the jobs of the other requests are run in between
+        for _ in range(count):
+            yield await self.scheduler.submit(job)
+
+    async def answer(self, request: web.Request, route: str, get_job: Callable[[Dict[str, Any]], Callable[[Random], str]]):
+        started = time.perf_counter()
+        try:
+            params = await self.get_params(request)
+            return await self.generate(request, params, get_job(params))
+        except BadRequest as exc:
+            return web.json_response({"error": str(exc)}, status=400)
+        finally:
+            request_duration.labels(route).observe(time.perf_counter() - started)
+
+    # === the routes ================================================
+
+    async def handle_lorem(self, request: web.Request):
+        def get_job(params: Dict[str, Any]) -> Callable[[Random], str]:
+            language = self.get_language(params)
+            words = self.get_int(params, "words", self.lorem.default_word_count, 1, self.max_words)
+            chars_len = self.get_chars_len(params)
+            return lambda rng: self.lorem.generate_lorem(language, words, chars_len, rng)
+
+        return await self.answer(request, "lorem", get_job)
+
+    async def handle_sentences(self, request: web.Request):
+        def get_job(params: Dict[str, Any]) -> Callable[[Random], str]:
+            language = self.get_language(params)
+            sentences = self.get_int(params, "count", 1, 1, self.max_sentences)
+            chars_len = self.get_chars_len(params)
+            return lambda rng: self.lorem.generate_sentences(language, sentences, chars_len, rng)
+
+        return await self.answer(request, "sentences", get_job)
+
+    async def handle_chinese(self, request: web.Request):
+        def get_job(params: Dict[str, Any]) -> Callable[[Random], str]:
+            count = self.get_int(params, "count", 48, 1, min(self.max_chinese, self.chinese.len))
+            return lambda rng: self.chinese.get_chinese(count, rng)
+
+        return await self.answer(request, "chinese", get_job)
+
+    async def handle_languages(self, request: web.Request):
+        return web.json_response({"languages": self.lorem.languages})
+
+    @staticmethod
+    async def handle_metrics(request: web.Request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8090) -> web.AppRunner:
+        # the access log is off, it costs more than the generation
+        runner = web.AppRunner(self.web_app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m lorem_service", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--data", default=LoremGenerator.data_directory, help="the corpora directory")
+    parser.add_argument("--index", help="the index directory, `<data>/.index` by default")
+    parser.add_argument("--chinese", help="the Chinese text, `<data>/chinese.txt` by default")
+    parser.add_argument("--max-jobs", type=int, default=64, help="the jobs run in one pass of the event loop")
+    parser.add_argument("--reload", type=float, help="check the corpora every N seconds and reload the changed ones")
+    args = parser.parse_args(argv)
+
+    lorem = LoremGenerator(args.data, args.index)
+    chinese = ChineseGenerator(args.chinese or f"{args.data}/chinese.txt")
+    lorem.load()
+    chinese.load()
+    service = LoremService(lorem, chinese, args.max_jobs)
+    if args.reload:
+        from corpus_watcher import CorpusWatcher
+        CorpusWatcher(lorem, args.reload).start()
+
+    async def serve():
+        runner = await service.start(args.host, args.port)
+        print(f"Serving {', '.join(lorem.languages)} on http://{args.host}:{args.port}", flush=True)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
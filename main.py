@@ -1,31 +1,152 @@
 __version__ = "1.3.5"
 
+import sys
 import asyncio
-from typing import List, Coroutine
+from typing import Dict, Callable, Coroutine, Optional
 
 from envs import envs
 from bot import user_bot_init, admin_bot_init, test_bot_init
+from webhook import WebhookServer
+from lorem_generator import lorem_generator, chinese_generator
+from handlers.utils import channel_utils
 
 
-async def start_bots(start_funcs: List[Coroutine]):
-    await asyncio.gather(*start_funcs)
-    while True:
-        await asyncio.sleep(1)
+BotStartFunc = Callable[[Optional[WebhookServer]], Coroutine]
 
 
-if envs.get("DEBUG", False):
-    # test bot for development
-    TOKEN_TEST = envs["TOKEN_TEST"]
-    bot_list = [
-        test_bot_init(TOKEN_TEST),
-    ]
-else:
-    TOKEN_USER = envs["TOKEN_USER"]
-    TOKEN_ADMIN = envs["TOKEN_ADMIN"]
-    bot_list = [
-        user_bot_init(TOKEN_USER),
-        admin_bot_init(TOKEN_ADMIN),
-    ]
+def get_bots() -> Dict[str, BotStartFunc]:
+    """
+    Returns the start functions of the bots to run, by bot name.
+    """
 
+    if envs.get("DEBUG", False):
+        # test bot for development
+        token_test = envs["TOKEN_TEST"]
+        return {
+            "test": lambda server: test_bot_init(token_test, server),
+        }
 
-asyncio.run(start_bots(bot_list))
+    token_user = envs["TOKEN_USER"]
+    token_admin = envs["TOKEN_ADMIN"]
+    return {
+        "user": lambda server: user_bot_init(token_user, server),
+        "admin": lambda server: admin_bot_init(token_admin, server),
+    }
+
+
+def webhook_port(bot_name: str) -> int:
+    """
+    Returns the local port of the webhook server of the bot:
+    `envs["WEBHOOK"]["ports"][bot_name]`, or `port` plus the number of the
+    bot. Each bot has its own port, because in the supervisor mode the
+    processes of one port must all serve the same bot.
+    """
+
+    settings = envs["WEBHOOK"]
+    if bot_name in settings.get("ports", {}):
+        return settings["ports"][bot_name]
+    return settings.get("port", 8443) + list(get_bots()).index(bot_name)
+
+
+async def start_bots(
+        bots: Dict[str, BotStartFunc],
+        reuse_port: bool = False,
+        watch_corpora: bool = True,
+):
+    servers: Dict[str, Optional[WebhookServer]] = dict.fromkeys(bots)
+    if "WEBHOOK" in envs:
+        for bot_name in bots:
+            server = servers[bot_name] = WebhookServer(
+                envs["WEBHOOK"].get("host", "127.0.0.1"),
+                webhook_port(bot_name),
+                reuse_port,
+            )
+            await server.start()
+
+    await asyncio.gather(*(func(servers[bot_name]) for bot_name, func in bots.items()))
+    if watch_corpora:
+        start_corpus_watcher()
+    # the bots work in the background tasks, so we just wait forever
+    await asyncio.Event().wait()
+
+
+def preload():
+    """
+    The corpora and the state of the channel are loaded lazily, on the
+    first request. For the bot it is done at startup, so that the first
+    request is not slow (and in the supervisor mode, before the workers
+    are forked, so that they share the memory).
+    """
+
+    lorem_generator.load()
+    chinese_generator.load()
+    channel_utils.load()
+
+
+def start_corpus_watcher(on_reload: Optional[Callable[[str], None]] = None):
+    """
+    Reloads the changed corpora without a restart, if
+    `envs["CORPUS_RELOAD_INTERVAL"]` is set. In the supervisor mode only
+    the supervisor watches the corpora, and after a reload it forks the
+    workers again (see `run_supervisor`).
+    """
+
+    if "CORPUS_RELOAD_INTERVAL" not in envs:
+        return
+
+    from logger import logger, log_exception
+    from corpus_watcher import CorpusWatcher
+
+    CorpusWatcher(
+        lorem_generator,
+        envs["CORPUS_RELOAD_INTERVAL"],
+        logger.info,
+        lambda exc: log_exception(exc, short=False),
+        on_reload,
+    ).start()
+
+
+def run_bot(bot_name: str):
+    """
+    Runs one bot (used by the supervisor in the worker processes).
+    """
+    asyncio.run(start_bots({bot_name: get_bots()[bot_name]}, reuse_port=True, watch_corpora=False))
+
+
+def run_supervisor():
+    """
+    Runs each bot in separate processes, the number of processes per bot
+    is taken from `envs["SUPERVISOR"]` (1 by default).
+    Without webhooks only one process per bot is possible, because
+    Telegram does not allow several long polling connections.
+    """
+
+    from supervisor import Supervisor
+
+    counts = envs.get("SUPERVISOR", {})
+    workers = {}
+    for bot_name in get_bots():
+        count = counts.get(bot_name, 1)
+        if "WEBHOOK" not in envs:
+            count = min(count, 1)
+        workers[bot_name] = count
+    metrics_address = None
+    if "METRICS" in envs:
+        metrics_address = (
+            envs["METRICS"].get("host", "127.0.0.1"),
+            envs["METRICS"].get("port", 9100),
+        )
+    preload()
+    supervisor = Supervisor(run_bot, workers, metrics_address)
+    # the workers are forked again with the new corpora, so they keep
+    # sharing them and none of them reloads the corpora itself
+    start_corpus_watcher(lambda language: supervisor.reload())
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    if "--supervisor" in sys.argv[1:]:
+        run_supervisor()
+    else:
+        preload()
+        asyncio.run(start_bots(get_bots()))
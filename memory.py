@@ -0,0 +1,198 @@
+"""
+Accounting of the memory of the process: how much the corpora of each
+language (the texts, the looped tails of the suffix array indexes, the
+indexes themselves and their caches), the Chinese text, the caches of
+the replies and the translations and the state of the translators take,
+and the RSS of the process. Shown by the admin command `/memory`.
+The sizes are counted by `sys.getsizeof` of the objects and of
+everything they contain, each object once (the arrays of the indexes
+are not walked, their size is their buffer). The walk over the caches
+takes seconds, so the bot makes the report in a thread.
+With `tracemalloc` turned on (`/memory top`, or `PYTHONTRACEMALLOC=1` at
+startup to see the corpora too) the lines with the largest allocations
+are shown.
+"""
+
+import os
+import sys
+import resource
+import tracemalloc
+from collections import deque
+from typing import Dict, List, Optional, Set
+
+from fm_index import FMIndex
+from corpus_index import CorpusIndex
+from lorem_generator import LoremGenerator, ChineseGenerator, lorem_generator, chinese_generator
+
+
+__all__ = [
+    "object_size",
+    "corpus_sizes",
+    "structure_sizes",
+    "process_rss",
+    "memory_report",
+    "tracemalloc_top",
+]
+
+
+def object_size(obj: object, seen: Optional[Set[int]] = None) -> int:
+    """
+    The size of the object and of all the objects in its containers
+    (dictionaries, lists, tuples, sets, deques), the objects in `seen`
+    are not counted again. The containers are walked in a loop, not
+    recursively.
+    """
+
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+    return size
+
+
+def corpus_sizes(generator: LoremGenerator, seen: Optional[Set[int]] = None) -> Dict[str, Dict[str, int]]:
+    """
+    The sizes of the structures of each language:
+    - text: the read text (only without an FM-index)
+    - looped: the looped end of the text in the suffix array index (the
+      index shares the text itself with the generator)
+    - index: the suffix array or the compressed FM-index
+    - cache: the found ranges and the decompressed blocks of the index
+    """
+
+    if seen is None:
+        seen = set()
+    corpora = generator.corpora
+    sizes = {}
+    for language in corpora.languages:
+        index = corpora.indexes[language]
+        text = corpora.text_data.get(language)
+        language_sizes = {"text": 0 if text is None else object_size(text, seen)}
+        if isinstance(index, CorpusIndex):
+            language_sizes["looped"] = object_size(index.tail, seen)
+            language_sizes["index"] = object_size(index.suffix_array, seen)
+            language_sizes["cache"] = object_size(index.ranges, seen)
+        elif isinstance(index, FMIndex):
+            language_sizes["looped"] = 0
+            language_sizes["index"] = index.nbytes
+            language_sizes["cache"] = object_size(index.ranges, seen) + object_size(index.cache, seen)
+        sizes[language] = language_sizes
+    return sizes
+
+
+def structure_sizes(chinese: ChineseGenerator, seen: Optional[Set[int]] = None) -> Dict[str, int]:
+    """
+    The sizes of the other long-lived structures of the bot.
+    """
+
+    # the caches and the translators need `.envs`, the corpora do not
+    from caches import reply_cache, translation_cache
+    from translator import text_translator
+    from logger import error_limiter
+
+    if seen is None:
+        seen = set()
+    return {
+        "chinese": object_size(chinese.chinese, seen),
+        "reply descriptors": object_size(reply_cache.descriptors.items, seen),
+        "replies": object_size(reply_cache.replies.items, seen),
+        "translations": object_size(translation_cache.items, seen),
+        "translator latencies": sum(
+            object_size(window.durations, seen)
+            for window in text_translator.latencies.values()
+        ),
+        "error limiter": object_size(error_limiter.logged, seen) + object_size(error_limiter.suppressed, seen),
+    }
+
+
+def process_rss() -> Optional[int]:
+    """
+    The current resident memory of the process (only on Linux).
+    """
+
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss() -> int:
+    # in kilobytes on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def format_size(size: int) -> str:
+    if size >= 1024 ** 2:
+        return f"{size / 1024 ** 2:.1f}M"
+    return f"{size / 1024:.1f}K"
+
+
+def memory_report(
+        generator: LoremGenerator = lorem_generator,
+        chinese: ChineseGenerator = chinese_generator,
+) -> str:
+    """
+    The table of the sizes by the language and the structure, the other
+    structures, their total and the memory of the process.
+    """
+
+    seen: Set[int] = set()
+    languages = corpus_sizes(generator, seen)
+    structures = structure_sizes(chinese, seen)
+
+    columns = ["text", "looped", "index", "cache"]
+    lines = [f"{'lang':<6}" + "".join(f"{column:>9}" for column in columns + ["total"])]
+    total = 0
+    for language, sizes in languages.items():
+        language_total = sum(sizes.values())
+        total += language_total
+        cells = [format_size(sizes[column]) for column in columns] + [format_size(language_total)]
+        lines.append(f"{language:<6}" + "".join(f"{cell:>9}" for cell in cells))
+    lines.append("")
+
+    for name, size in structures.items():
+        total += size
+        lines.append(f"{name:<21}{format_size(size):>9}")
+    lines.append(f"{'total':<21}{format_size(total):>9}")
+    lines.append("")
+
+    rss = process_rss()
+    if rss is not None:
+        lines.append(f"{'rss':<21}{format_size(rss):>9}")
+    lines.append(f"{'peak rss':<21}{format_size(peak_rss()):>9}")
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"{'traced':<21}{format_size(current):>9}")
+        lines.append(f"{'traced peak':<21}{format_size(peak):>9}")
+    return "\n".join(lines)
+
+
+def tracemalloc_top(limit: int = 10) -> List[str]:
+    """
+    The lines of the code with the largest allocations that are alive
+    (only the allocations made after `tracemalloc.start`).
+    """
+
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    lines = []
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        path = os.path.join(*frame.filename.split(os.sep)[-2:])
+        lines.append(f"{format_size(stat.size):>9} {stat.count:>8} {path}:{frame.lineno}")
+    return lines
@@ -1,8 +1,6 @@
-from typing import TypedDict
+from typing import Any, TypedDict
 
 from envs import envs
-from lorem_generator import lorem_generator
-from translator import text_translator, shared_languages
 
 
 __all__ = [
@@ -10,6 +8,37 @@ __all__ = [
 ]
 
 
+class LazyDict(dict):
+    """
+    A dictionary in which a value can be a function without arguments:
+    it is called on the first access to the key, and its result replaces
+    it. So the texts that depend on heavy modules (the corpora, the
+    translators) are built only when they are needed.
+    """
+
+    def __getitem__(self, key: str) -> Any:
+        value = super().__getitem__(key)
+        if callable(value):
+            value = value()
+            self[key] = value
+        return value
+
+
+def lorem_languages() -> str:
+    from lorem_generator import lorem_generator
+    return ", ".join(lorem_generator.languages)
+
+
+def translator_names() -> str:
+    from translator import text_translator
+    return ", ".join(text_translator.translator_names)
+
+
+def shared_languages() -> str:
+    from translator import shared_languages as languages
+    return ", ".join(languages)
+
+
 _Message = TypedDict("_Message", {
     "default": str,
     "unknown": str,
@@ -35,6 +64,7 @@ _Translate = TypedDict("_Translate", {
 _Random = TypedDict("_Random", {
     "error": str
 })
+# the values are what is returned by `LazyDict`, not what is stored
 _Help = TypedDict("_Help", {
     "user": str,
     "admin": str,
@@ -54,6 +84,23 @@ _Plus = TypedDict("_Plus", {
     "no_reply": str,
     "no_command": str,
 })
+_Profile = TypedDict("_Profile", {
+    "status": str,
+    "off": str,
+    "stopped": str,
+    "count_error": str,
+    "sampling": str,
+    "already_sampling": str,
+    "command": str,
+})
+
+_Memory = TypedDict("_Memory", {
+    "report": str,
+    "top": str,
+    "tracing": str,
+    "stopped": str,
+    "count_error": str,
+})
 
 _Messages = TypedDict("_Messages", {
     "already_run": str,
@@ -66,6 +113,8 @@ _Messages = TypedDict("_Messages", {
     "random": _Random,
     "help": _Help,
     "plus": _Plus,
+    "profile": _Profile,
+    "memory": _Memory,
 })
 
 
@@ -116,7 +165,7 @@ messages: _Messages = {
             " генерировать лорем, вы можете посмотреть командой &lt;<code>/help /lorem</code>&gt;."
         ),
         "word_count": "🐞 Количество слов должно быть 5-256, у вас &lt;<code>{}</code>&gt;.",
-        "char_count": "🐞 Количество символов должно быть 1-3, у вас &lt;<code>{}</code>&gt;.",
+        "char_count": "🐞 Количество символов должно быть 1-8, у вас &lt;<code>{}</code>&gt;.",
     },
 
     "translate": {
@@ -143,7 +192,7 @@ messages: _Messages = {
         ),
     },
 
-    "help": {
+    "help": LazyDict({
         "user": (
             "❓ Я - бот для генерации псевдотекстов 🤖. Я знаю команды:\n"
             "\n"
@@ -262,7 +311,7 @@ messages: _Messages = {
             "- &lt;<code>/generate_absurd</code>&gt; - генерирует абсурдотекст"
         ),
 
-        "lorem": (
+        "lorem": lambda: (
             "📃 /lorem генерирует <b>псевдотекст</b>.\n"
             "\n"
             "🧠 <b>Алгоритм</b> такой, что рандомно выбираются дополняющие друг друга символы из"
@@ -275,9 +324,10 @@ messages: _Messages = {
             "🪛 Вызов имеет три параметра:\n"
             "<code>/lorem [язык] [слов [буфер]]</code>\n"
             "- <b>язык текста</b>: по умолчанию используется русский, доступны языки"
-            f" &lt;{', '.join(lorem_generator.languages)}&gt;; параметр можно не указывать\n"
+            f" &lt;{lorem_languages()}&gt;; параметр можно не указывать\n"
             "- <b>количество сгенерированных слов</b>: по умолчанию 64, варианты 32-256\n"
-            "- <b>длина буфера</b>: по умолчанию 2, варианты 1-3\n"
+            "- <b>длина буфера</b>: по умолчанию 2, варианты 1-8 (чем длиннее, тем больше похоже на"
+            " настоящие слова)\n"
             "\n"
             "📗 Примеры:\n"
             "- &lt;<code>/lorem</code>&gt; - стандартная генерация 64 слов на русском\n"
@@ -303,7 +353,7 @@ messages: _Messages = {
             "📗 Примеры:\n"
             "- &lt;<code>/lorem_tt</code>&gt; - генерация псевдотекста\n"
         ),
-        "translate": (
+        "translate": lambda: (
             "🔄 /translate переводит текст с помощью переводчика с одного языка на другой\n"
             "\n"
             "🧠 Для работы надо <b>ответить на сообщение</b> (своё или бота) и вызвать в ответе"
@@ -313,7 +363,7 @@ messages: _Messages = {
             "🪛 Поддерживает три параметра:\n"
             "<code>/translate [translator] [from [to]]</code>\n"
             "- <b>translator</b>: переводчик, с помощью которого происходит перевод; доступны"
-            f" значения &lt;<i>{', '.join(text_translator.translator_names)}</i>&gt;, по умолчанию"
+            f" значения &lt;<i>{translator_names()}</i>&gt;, по умолчанию"
             " <i>wat</i>\n"
             "- <b>from</b>: язык, с которого происходит перевод; по умолчанию просто отдаёт на"
             " распознание переводчиком\n"
@@ -322,7 +372,7 @@ messages: _Messages = {
             "❗ Доступные языки у переводчиков разные, в названии обычно используются"
             " <b>2 латинские буквы</b>, но точные нужно смотреть в самом переводчике.\n"
             "Стандартные, которые есть почти во всех переводчиках:"
-            f" &lt;<i>{', '.join(shared_languages)}</i>&gt;\n"
+            f" &lt;<i>{shared_languages()}</i>&gt;\n"
             "\n"
             "📗 Примеры:\n"
             "- &lt;<code>/translate</code>&gt; - переводит текст с помощью Wanson"
@@ -339,12 +389,37 @@ messages: _Messages = {
 
         "help": "🐞❓ Произошла рекурсия, не делайте так!",
         "unknown": "🔎 Ищем-ищем... Не нашли справки для &lt;<code>{}</code>&gt;.",
-    },
+    }),
 
     "plus": {
         "no_reply": "🐞 В этом сообщении должен быть реплай команды.",
         "no_command": "🐞 В реплае не команда!",
-    }
+    },
+
+    "profile": {
+        "status": "⏱ Сейчас профилируются: {}",
+        "off": (
+            "⏱ Профилирование выключено. Включить:\n"
+            "- &lt;<code>/profile sample 30</code>&gt; - семплировать стеки 30 секунд\n"
+            "- &lt;<code>/profile lorem 10</code>&gt; - cProfile для 10 следующих /lorem"
+        ),
+        "stopped": "⏱ Профилирование выключено, результаты в <code>logs/</code>.",
+        "count_error": "🐞 Непонятное число &lt;<code>{}</code>&gt;.",
+        "sampling": "⏱ Семплирую стеки {} секунд, результат будет в <code>logs/</code>.",
+        "already_sampling": "🐞 Семплирование уже идёт.",
+        "command": "⏱ Профилирую {} следующих запросов /{}, результаты будут в <code>logs/</code>.",
+    },
+    "memory": {
+        "report": "🧠 Память процесса:\n<pre>{}</pre>",
+        "top": "🧠 Больше всего памяти выделено в строках:\n<pre>{}</pre>",
+        "tracing": (
+            "🧠 Включён tracemalloc, повторите &lt;<code>/memory top</code>&gt; позже. Выделенное до"
+            " включения не видно (чтобы видеть и корпуса, запускайте с <code>PYTHONTRACEMALLOC=1</code>)."
+            " Выключить - &lt;<code>/memory off</code>&gt;"
+        ),
+        "stopped": "🧠 tracemalloc выключен.",
+        "count_error": "🐞 Непонятное число &lt;<code>{}</code>&gt;.",
+    },
 }
 
 
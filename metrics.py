@@ -0,0 +1,330 @@
+"""
+A small in-process metrics registry in the Prometheus style.
+Metrics are updated on the hot path by plain arithmetic on objects found
+by a dictionary lookup, the text format is built only when `/metrics`
+is requested.
+In the supervisor mode the workers do not serve the metrics themselves,
+but periodically send snapshots to the supervisor, which serves all of
+them with the `worker` label.
+"""
+
+import time
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.queues import Queue as ProcessQueue
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+__all__ = [
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "registry",
+    "start_metrics_server",
+    "start_loop_lag_monitor",
+    "push_metrics",
+]
+
+
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+# (name, type, documentation, samples)
+Snapshot = List[Tuple[str, str, str, List[Sample]]]
+
+
+class Registry:
+    """
+    Storage of all the metrics of the process.
+    """
+
+    def __init__(self):
+        self.metrics: List["Metric"] = []
+        # snapshots received from other processes, by worker name
+        self.remote: Dict[str, Snapshot] = {}
+
+    def register(self, metric: "Metric"):
+        self.metrics.append(metric)
+
+    def unregister(self, metric: "Metric"):
+        self.metrics.remove(metric)
+
+    def snapshot(self) -> Snapshot:
+        return [
+            (metric.name, metric.type, metric.documentation, list(metric.samples()))
+            for metric in self.metrics
+        ]
+
+    @staticmethod
+    def format_labels(labels: Dict[str, str]) -> str:
+        if not labels:
+            return ""
+        pairs = ",".join(
+            key + '="' + value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') + '"'
+            for key, value in labels.items()
+        )
+        return "{" + pairs + "}"
+
+    def render(self) -> str:
+        """
+        Returns all the metrics (own and remote) in the Prometheus text
+        format.
+        """
+
+        families: Dict[str, Tuple[str, str, List[str]]] = {}
+        sources = [("", self.snapshot())] + list(self.remote.items())
+        for worker, snapshot in sources:
+            for name, type_, documentation, samples in snapshot:
+                _, _, lines = families.setdefault(name, (type_, documentation, []))
+                for sample_name, labels, value in samples:
+                    if worker:
+                        labels = {"worker": worker, **labels}
+                    lines.append(f"{sample_name}{self.format_labels(labels)} {value}")
+
+        result = []
+        for name, (type_, documentation, lines) in families.items():
+            result.append(f"# HELP {name} {documentation}")
+            result.append(f"# TYPE {name} {type_}")
+            result.extend(lines)
+        return "\n".join(result) + "\n"
+
+
+registry = Registry()
+
+
+class Metric(ABC):
+    """
+    A base class for metrics. A metric with labels keeps a child for each
+    combination of the label values.
+    """
+
+    type = "untyped"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            registry_: Registry = registry,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Labels, object] = {}
+        registry_.register(self)
+
+    @abstractmethod
+    def new_child(self) -> object:
+        pass
+
+    def labels(self, *values) -> object:
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.new_child()
+        return child
+
+    @abstractmethod
+    def child_samples(self, child) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        pass
+
+    def samples(self) -> Iterator[Sample]:
+        for values, child in list(self.children.items()):
+            labels = dict(zip(self.labelnames, map(str, values)))
+            for suffix, extra_labels, value in self.child_samples(child):
+                yield self.name + suffix, {**labels, **extra_labels}, value
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def new_child(self) -> CounterChild:
+        return CounterChild()
+
+    def labels(self, *values) -> CounterChild:
+        return super().labels(*values)  # type: ignore[return-value]
+
+    def child_samples(self, child: CounterChild):
+        yield "", {}, child.value
+
+
+class GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """
+        The value will be computed by the function when the metrics are
+        collected.
+        """
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def new_child(self) -> GaugeChild:
+        return GaugeChild()
+
+    def labels(self, *values) -> GaugeChild:
+        return super().labels(*values)  # type: ignore[return-value]
+
+    def child_samples(self, child: GaugeChild):
+        yield "", {}, child.get()
+
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # not cumulative, the last one is for +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS,
+            registry_: Registry = registry,
+    ):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry_)
+
+    def new_child(self) -> HistogramChild:
+        return HistogramChild(self.bounds)
+
+    def labels(self, *values) -> HistogramChild:
+        return super().labels(*values)  # type: ignore[return-value]
+
+    def child_samples(self, child: HistogramChild):
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), child.counts):
+            cumulative += count
+            yield "_bucket", {"le": "+Inf" if bound == float("inf") else str(bound)}, cumulative
+        yield "_sum", {}, child.sum
+        yield "_count", {}, child.count
+
+
+# === the metrics server ==============================================
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+metrics_server: Optional[ThreadingHTTPServer] = None
+# set in the worker processes of the supervisor, then metrics are pushed
+push_queue: Optional[ProcessQueue] = None
+
+
+def start_metrics_server(host: str = "127.0.0.1", port: int = 9100):
+    """
+    Starts the `/metrics` endpoint in a separate thread (once per
+    process). Does nothing if the metrics are pushed to the supervisor.
+    """
+
+    global metrics_server
+    if metrics_server is not None or push_queue is not None:
+        return
+    metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=metrics_server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+
+
+def push_metrics(queue_: ProcessQueue, worker: str, interval: float = 5.0):
+    """
+    Starts sending the snapshots of the registry to the supervisor every
+    `interval` seconds.
+    """
+
+    global push_queue
+    push_queue = queue_
+
+    def push():
+        while True:
+            time.sleep(interval)
+            queue_.put((worker, registry.snapshot()))
+
+    threading.Thread(target=push, name="metrics-push", daemon=True).start()
+
+
+loop_lag = Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop wakes up a sleeping task",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+lag_monitors: Dict[int, asyncio.Task] = {}
+
+
+async def monitor_loop_lag(interval: float):
+    loop = asyncio.get_running_loop()
+    histogram = loop_lag.labels()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        histogram.observe(max(0.0, loop.time() - started - interval))
+
+
+def start_loop_lag_monitor(interval: float = 0.5):
+    """
+    Starts measuring the lag of the current event loop (once per loop).
+    """
+
+    loop = asyncio.get_running_loop()
+    if id(loop) not in lag_monitors:
+        lag_monitors[id(loop)] = asyncio.create_task(monitor_loop_lag(interval))
@@ -0,0 +1,169 @@
+"""
+Profiling of the handled requests in production.
+There are two modes, both can be turned on by the admin command
+`/profile` or by `envs["PROFILE"]` at startup:
+- cProfile of the next N requests of a command, each request is saved
+  as `logs/profile_<command>_<time>.pstats`
+- sampling of the stacks of the event loop thread for some seconds, the
+  result is saved as collapsed stacks (`logs/stacks_<time>.txt`, the
+  format of flamegraph.pl and speedscope)
+When nothing is turned on, the handlers only check that the dictionary
+of profiled commands is empty, and no thread is running.
+"""
+
+import os
+import sys
+import time
+import cProfile
+import threading
+from collections import Counter
+from typing import Coroutine, Dict, List, Optional, TypeVar
+
+from logger import logger
+
+
+__all__ = [
+    "profiler",
+]
+
+
+T = TypeVar("T")
+
+LOGS_DIRECTORY = "logs"
+
+
+class StackSampler(threading.Thread):
+    """
+    Takes the stack of the thread every `interval` seconds during
+    `duration` seconds (or until it is stopped) and saves the counts of
+    the collapsed stacks.
+    """
+
+    def __init__(self, thread_id: int, duration: float, interval: float):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.duration = duration
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.stop_event = threading.Event()
+        self.path = ""
+
+    @staticmethod
+    def collapse(frame) -> str:
+        names: List[str] = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def run(self):
+        end = time.monotonic() + self.duration
+        while not self.stop_event.wait(self.interval) and time.monotonic() < end:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[self.collapse(frame)] += 1
+            del frame
+
+        self.path = os.path.join(LOGS_DIRECTORY, f"stacks_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+        with open(self.path, "w", encoding="utf8") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        logger.info(f"Stack sampling is finished, {sum(self.stacks.values())} samples in {self.path}")
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class Profiler:
+    """
+    The state of profiling of the process.
+    """
+
+    def __init__(self):
+        # the number of requests left to profile, by command name
+        self.commands: Dict[str, int] = {}
+        self.current: Optional[cProfile.Profile] = None
+        self.sampler: Optional[StackSampler] = None
+
+    def profile_command(self, command: str, count: int):
+        """
+        Turns on cProfile for the next `count` requests of the command
+        (or turns it off if `count` is 0).
+        """
+
+        if count > 0:
+            self.commands[command] = count
+        else:
+            self.commands.pop(command, None)
+
+    async def profile(self, command: str, coro: Coroutine[object, object, T]) -> T:
+        """
+        Executes the coroutine of the request, under cProfile if the
+        command is being profiled.
+        cProfile is per thread, so only one request is profiled at a time,
+        and the functions of other tasks executed while the request is
+        waiting are included in its profile too (set 1 worker in
+        `envs["WORKERS"]` for a clean profile).
+        """
+
+        remaining = self.commands.get(command, 0)
+        if remaining <= 0 or self.current is not None:
+            return await coro
+        if remaining == 1:
+            del self.commands[command]
+        else:
+            self.commands[command] = remaining - 1
+
+        profile = self.current = cProfile.Profile()
+        profile.enable()
+        try:
+            return await coro
+        finally:
+            profile.disable()
+            self.current = None
+            name = f"profile_{command}_{time.strftime('%Y%m%d_%H%M%S')}_{time.time_ns() % 10 ** 6}.pstats"
+            path = os.path.join(LOGS_DIRECTORY, name)
+            profile.dump_stats(path)
+            logger.info(f"The request </{command}> is profiled to {path}")
+
+    def start_sampling(self, duration: float, interval: float = 0.005) -> bool:
+        """
+        Starts sampling the stacks of the current thread (the thread of
+        the event loop). Returns False if sampling is already running.
+        """
+
+        if self.sampler is not None and self.sampler.is_alive():
+            return False
+        self.sampler = StackSampler(threading.get_ident(), duration, interval)
+        self.sampler.start()
+        return True
+
+    def stop(self):
+        """
+        Turns off all profiling (the collected samples are saved).
+        """
+
+        self.commands.clear()
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    def start_from_envs(self, settings: dict):
+        """
+        Applies `envs["PROFILE"]`, for example
+        `{"sample": 60, "commands": {"lorem": 10}}`.
+        """
+
+        if "sample" in settings:
+            self.start_sampling(settings["sample"], settings.get("interval", 0.005))
+        for command, count in settings.get("commands", {}).items():
+            self.profile_command(command, count)
+
+    def status(self) -> str:
+        parts = [f"/{command}: {count}" for command, count in self.commands.items()]
+        if self.sampler is not None and self.sampler.is_alive():
+            parts.append("sampling")
+        return ", ".join(parts)
+
+
+profiler = Profiler()
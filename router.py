@@ -0,0 +1,116 @@
+"""
+The dispatch of the updates of one bot by a single PTB handler.
+Instead of asking every `CommandHandler`/`MessageHandler` in turn (each
+one parses the command again and evaluates its filters), the router
+parses the text once, finds the command in a dictionary and checks only
+the filter of that command. The messages that are not known commands go
+to the message handlers, which are few.
+The callbacks get the parsed command and arguments as `context.command`
+and `context.args`.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from telegram import MessageEntity, Update
+from telegram.ext import Application, BaseHandler, CallbackContext
+from telegram.ext.filters import BaseFilter, TEXT
+
+
+__all__ = [
+    "Route",
+    "CommandRouter",
+]
+
+
+Callback = Callable[[Update, CallbackContext], Any]
+
+
+@dataclass
+class Route:
+    callback: Callback
+    # None if there is nothing to check
+    filters: Optional[BaseFilter] = None
+
+    def check(self, update: Update) -> bool:
+        return self.filters is None or bool(self.filters.check_update(update))
+
+
+# (route, command, arguments)
+RouteMatch = Tuple[Route, str, List[str]]
+
+
+class CommandRouter(BaseHandler):
+    """
+    The handler is blocking: `Application.process_update` returns only
+    when the command is handled, so the workers and the order of the
+    chats of `UpdateDispatcher` limit the running commands.
+    """
+
+    def __init__(self):
+        super().__init__(self.handle, block=True)
+        self.commands: Dict[str, Route] = {}
+        self.messages: List[Route] = []
+
+    def add_command(self, name: str, callback: Callback, filters: Optional[BaseFilter] = None):
+        # the updates without text never reach the router
+        if filters is TEXT:
+            filters = None
+        self.commands[name.lower()] = Route(callback, filters)
+
+    def add_message(self, callback: Callback, filters: Optional[BaseFilter] = None):
+        self.messages.append(Route(callback, filters))
+
+    @staticmethod
+    def parse_command(update: Update) -> Tuple[str, List[str]]:
+        """
+        Returns the command (without "/" and the bot name, lowercase) and
+        its arguments, or an empty command if the message is not a
+        command to this bot.
+        """
+
+        message = update.effective_message
+        text = message.text
+        entities = message.entities
+        if not (
+                entities
+                and entities[0].offset == 0
+                and entities[0].type == MessageEntity.BOT_COMMAND
+        ):
+            return "", []
+
+        command, _, bot_name = text[1:entities[0].length].partition("@")
+        if bot_name and bot_name.lower() != message.get_bot().username.lower():
+            return "", []
+        return command.lower(), text.split()[1:]
+
+    def check_update(self, update: object) -> Optional[RouteMatch]:
+        if not isinstance(update, Update):
+            return None
+        message = update.effective_message
+        if message is None or not message.text:
+            return None
+
+        command, args = self.parse_command(update)
+        route = self.commands.get(command) if command else None
+        if route is not None and route.check(update):
+            return route, command, args
+
+        for route in self.messages:
+            if route.check(update):
+                return route, command, args
+        return None
+
+    async def handle_update(
+            self,
+            update: Update,
+            application: Application,
+            check_result: RouteMatch,
+            context: CallbackContext,
+    ):
+        route, context.command, context.args = check_result
+        return await route.callback(update, context)
+
+    async def handle(self, update: Update, context: CallbackContext):
+        # not used, `handle_update` calls the callback of the route
+        pass
@@ -0,0 +1,339 @@
+"""
+The outbound message scheduler.
+Telegram limits a bot to about 30 messages per second in total and about
+one message per second to one chat (with short bursts), otherwise it
+answers with `RetryAfter`. The sender paces the messages by token buckets
+instead of failing: per chat and per bot, the short replies go first
+when the bot is at its global limit, and `RetryAfter` pauses the chat
+and repeats the message.
+"""
+
+import re
+import time
+import heapq
+import asyncio
+import itertools
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from telegram import Chat
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+
+from metrics import Counter, Histogram
+
+
+__all__ = [
+    "TokenBucket",
+    "Sender",
+    "split_text",
+    "split_html",
+]
+
+
+MAX_MESSAGE_LENGTH = 4096
+# the replies up to this length have the priority
+SHORT_MESSAGE_LENGTH = 512
+# a tag (the closing ones have the slash, group 1, and all have the
+# name, group 2) or an entity, the parts are not split inside them
+html_token_pattern = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^>]*>|&#?\w+;")
+
+queue_delay = Histogram(
+    "telegram_send_queue_delay_seconds",
+    "Time the message waited for the rate limits before sending",
+    ["bot", "priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+retry_after_total = Counter(
+    "telegram_retry_after_total",
+    "RetryAfter errors received from Telegram",
+    ["bot"],
+)
+
+
+class TokenBucket:
+    """
+    A rate limiter: `rate` tokens per second, at most `burst` at once.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, count: int) -> int:
+        """
+        Takes up to `count` tokens without waiting, returns how many are
+        taken.
+        """
+
+        self.refill()
+        taken = min(count, int(self.tokens))
+        self.tokens -= taken
+        return taken
+
+    async def wait(self):
+        """
+        Takes one token, waiting for it if necessary.
+        """
+
+        while not self.take(1):
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def is_full(self) -> bool:
+        self.refill()
+        return self.tokens >= self.burst
+
+
+def split_text(text: str, limit: int = MAX_MESSAGE_LENGTH) -> Iterator[str]:
+    """
+    Splits the text into parts of at most `limit` characters, preferably
+    by lines, then by spaces. The positions are searched in the original
+    text, each part is copied only once.
+    It is meant for plain text, see `split_html` for HTML.
+    """
+
+    start = 0
+    while len(text) - start > limit:
+        end = text.rfind("\n", start + 1, start + limit + 1)
+        if end == -1:
+            end = text.rfind(" ", start + 1, start + limit + 1)
+        if end == -1:
+            end = next_start = start + limit
+        else:
+            # the separator itself is dropped
+            next_start = end + 1
+        yield text[start:end]
+        start = next_start
+    yield text[start:]
+
+
+class HtmlTokens:
+    """
+    The tags and the entities of an HTML text, by their positions.
+    """
+
+    def __init__(self, text: str):
+        self.tokens = list(html_token_pattern.finditer(text))
+        self.starts = [token.start() for token in self.tokens]
+
+    def containing(self, position: int) -> Optional[re.Match]:
+        """
+        The token that the position is strictly inside of, if any.
+        """
+
+        index = bisect_right(self.starts, position) - 1
+        if index >= 0 and position < self.tokens[index].end() and position != self.starts[index]:
+            return self.tokens[index]
+        return None
+
+    def open_tags(self, open_tags: List[Tuple[str, str]], start: int, end: int) -> List[Tuple[str, str]]:
+        """
+        The (name, opening tag) of the tags open at `end`, given the tags
+        open at `start`.
+        """
+
+        open_tags = list(open_tags)
+        for index in range(bisect_left(self.starts, start), len(self.tokens)):
+            token = self.tokens[index]
+            if token.start() >= end:
+                break
+            is_closing, name = token.groups()
+            if name is None:
+                continue
+            if not is_closing:
+                open_tags.append((name, token.group(0)))
+                continue
+            for position in range(len(open_tags) - 1, -1, -1):
+                if open_tags[position][0] == name:
+                    del open_tags[position]
+                    break
+        return open_tags
+
+    def find_end(self, text: str, start: int, limit: int) -> Tuple[int, int]:
+        """
+        The end of the part starting at `start` of at most `limit`
+        characters and the start of the next part, as in `split_text`,
+        but outside of the tags and the entities.
+        """
+
+        if len(text) - start <= limit:
+            return len(text), len(text)
+        for separator in ("\n", " "):
+            end = text.rfind(separator, start + 1, start + limit + 1)
+            while end != -1:
+                token = self.containing(end)
+                if token is None:
+                    # the separator itself is dropped
+                    return end, end + 1
+                end = text.rfind(separator, start + 1, token.start())
+
+        end = start + limit
+        token = self.containing(end)
+        if token is not None:
+            # a token longer than the limit is not split either
+            end = token.start() if token.start() > start else token.end()
+        return end, end
+
+
+def split_html(text: str, limit: int = MAX_MESSAGE_LENGTH) -> Iterator[str]:
+    """
+    Splits the HTML text (for `ParseMode.HTML`) like `split_text`, but
+    never inside a tag or an entity. The tags open at the end of a part
+    are closed there and opened again at the start of the next one, so
+    Telegram can parse every part on its own.
+    """
+
+    if len(text) <= limit:
+        yield text
+        return
+    tokens = HtmlTokens(text)
+    open_tags: List[Tuple[str, str]] = []
+    start = 0
+    while True:
+        prefix = "".join(tag for _, tag in open_tags)
+        budget = limit - len(prefix)
+        while True:
+            end, next_start = tokens.find_end(text, start, max(budget, 1))
+            end_tags = tokens.open_tags(open_tags, start, end)
+            suffix = "".join(f"</{name}>" for name, _ in reversed(end_tags))
+            excess = len(prefix) + (end - start) + len(suffix) - limit
+            if excess <= 0 or budget <= 1:
+                break
+            budget -= excess
+        yield prefix + text[start:end] + suffix
+        if end >= len(text):
+            return
+        # the dropped separator is not a tag
+        open_tags = end_tags
+        start = next_start
+
+
+class ChatLimit:
+    """
+    The state of one chat: the messages to it are sent in order and
+    paced by its own bucket.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.lock = asyncio.Lock()
+        self.bucket = TokenBucket(rate, burst)
+        self.blocked_until = 0.0
+
+
+class Sender:
+    """
+    Sends the messages of one bot. A message waits for a token of its
+    chat, then for a global token; when the global tokens are over, the
+    waiting messages get them in the order of (priority, arrival).
+    """
+
+    def __init__(
+            self,
+            name: str,
+            global_rate: float = 30.0,
+            global_burst: int = 30,
+            chat_rate: float = 1.0,
+            chat_burst: int = 3,
+    ):
+        self.name = name
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chats: Dict[int, ChatLimit] = {}
+        self.max_chats = 1000
+
+        # (priority, arrival number, future) of the messages waiting for
+        # a global token
+        self.waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self.counter = itertools.count()
+        self.wakeup: Optional[asyncio.Event] = None
+        self.scheduler: Optional[asyncio.Task] = None
+
+    async def acquire_global(self, priority: int):
+        if not self.waiting and self.global_bucket.take(1):
+            return
+        if self.scheduler is None or self.scheduler.done():
+            self.wakeup = asyncio.Event()
+            self.scheduler = asyncio.create_task(self.schedule())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.counter), future))
+        self.wakeup.set()
+        await future
+
+    async def schedule(self):
+        """
+        Gives out the global tokens to the waiting messages.
+        """
+
+        while True:
+            while not self.waiting:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            await self.global_bucket.wait()
+            while self.waiting:
+                _, _, future = heapq.heappop(self.waiting)
+                if not future.done():  # not cancelled
+                    future.set_result(None)
+                    break
+            else:
+                # nobody took the token
+                self.global_bucket.tokens += 1
+
+    async def send_part(self, chat: Chat, limit: ChatLimit, text: str, priority: int, **kwargs):
+        loop = asyncio.get_running_loop()
+        label = "short" if priority == 0 else "long"
+        while True:
+            started = time.perf_counter()
+            if limit.blocked_until > loop.time():
+                await asyncio.sleep(limit.blocked_until - loop.time())
+            await limit.bucket.wait()
+            await self.acquire_global(priority)
+            queue_delay.labels(self.name, label).observe(time.perf_counter() - started)
+            try:
+                await chat.send_message(text, **kwargs)
+                return
+            except RetryAfter as exc:
+                retry_after_total.labels(self.name).inc()
+                limit.blocked_until = loop.time() + float(exc.retry_after)
+            except BadRequest as exc:
+                # the part is sent as plain text rather than lost
+                if "can't parse entities" not in str(exc).lower() or kwargs.get("parse_mode") is None:
+                    raise
+                kwargs = {**kwargs, "parse_mode": None}
+
+    async def send(self, chat: Chat, text: str, **kwargs):
+        """
+        Sends the text to the chat (split into several messages if it is
+        too long, by `split_html` for HTML), the arguments are passed to
+        `chat.send_message`.
+        """
+
+        limit = self.chats.get(chat.id)
+        if limit is None:
+            if len(self.chats) >= self.max_chats:
+                self.forget_idle_chats()
+            limit = self.chats[chat.id] = ChatLimit(self.chat_rate, self.chat_burst)
+
+        priority = 0 if len(text) <= SHORT_MESSAGE_LENGTH else 1
+        async with limit.lock:
+            split = split_html if kwargs.get("parse_mode") == ParseMode.HTML else split_text
+            for part in split(text):
+                await self.send_part(chat, limit, part, priority, **kwargs)
+
+    def forget_idle_chats(self):
+        """
+        Removes the states of the chats that would behave the same as new
+        ones.
+        """
+
+        now = asyncio.get_running_loop().time()
+        for chat_id, limit in list(self.chats.items()):
+            if not limit.lock.locked() and limit.bucket.is_full() and limit.blocked_until <= now:
+                del self.chats[chat_id]
@@ -0,0 +1,166 @@
+"""
+A small durable store of the bot state in SQLite: the key-value metadata
+(for example, the id of the last channel post) and the set of known
+channel posts.
+The changes are accumulated in memory and written in one transaction by
+a background thread, so the handlers never wait for the disk. The whole
+state is read by a couple of queries at startup.
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from envs import envs
+from logger import log_exception
+
+
+__all__ = [
+    "StateStore",
+    "state_store",
+]
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS posts (id INTEGER PRIMARY KEY, valid INTEGER NOT NULL);
+"""
+
+
+class StateStore:
+    """
+    The writes are buffered (the last value of each key wins) and
+    flushed every `flush_interval` seconds and at exit.
+    The writer thread is started on the first write in each process and
+    every flush opens its own connection, so the store can be created
+    before the supervisor forks the workers (all of them write to the
+    same file).
+    The file and its directory are created on the first use (or by
+    `open`), so the import of the module does not touch the disk.
+    """
+
+    is_open = False
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending_meta: Dict[str, int] = {}
+        self.pending_posts: Dict[int, bool] = {}
+        self.pid: Optional[int] = None
+
+    def open(self):
+        """
+        Creates the directory and the tables if they are not created yet.
+        """
+
+        if self.is_open:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=10)
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+        self.is_open = True
+
+    def connect(self) -> sqlite3.Connection:
+        self.open()
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    # === reading =====================================================
+
+    def get_meta(self, key: str, default: int) -> int:
+        connection = self.connect()
+        try:
+            row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        finally:
+            connection.close()
+        return default if row is None else row[0]
+
+    def load_posts(self) -> Tuple[List[int], List[int]]:
+        """
+        Returns the ids of the valid and the invalid posts.
+        """
+
+        connection = self.connect()
+        try:
+            rows = connection.execute("SELECT id, valid FROM posts").fetchall()
+        finally:
+            connection.close()
+        valid = [post_id for post_id, is_valid in rows if is_valid]
+        invalid = [post_id for post_id, is_valid in rows if not is_valid]
+        return valid, invalid
+
+    # === writing =====================================================
+
+    def start_writer(self):
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        threading.Thread(target=self.write_loop, name="state-store", daemon=True).start()
+        atexit.register(self.flush)
+
+    def set_meta(self, key: str, value: int):
+        with self.lock:
+            self.pending_meta[key] = value
+        self.start_writer()
+
+    def set_post(self, post_id: int, valid: bool):
+        with self.lock:
+            self.pending_posts[post_id] = valid
+        self.start_writer()
+
+    def write_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as exc:
+                log_exception(exc, short=False)
+
+    def flush(self):
+        """
+        Writes all the accumulated changes in one transaction.
+        """
+
+        with self.lock:
+            meta, self.pending_meta = self.pending_meta, {}
+            posts, self.pending_posts = self.pending_posts, {}
+        if not meta and not posts:
+            return
+
+        try:
+            self.write(meta, posts)
+        except sqlite3.Error:
+            # will be written next time, unless changed since then
+            with self.lock:
+                self.pending_meta = {**meta, **self.pending_meta}
+                self.pending_posts = {**posts, **self.pending_posts}
+            raise
+
+    def write(self, meta: Dict[str, int], posts: Dict[int, bool]):
+        connection = self.connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    meta.items(),
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO posts (id, valid) VALUES (?, ?)",
+                    ((post_id, int(valid)) for post_id, valid in posts.items()),
+                )
+        finally:
+            connection.close()
+
+
+state_store = StateStore(envs.get("STATE_FILE", "data/state.sqlite3"))
@@ -0,0 +1,234 @@
+import gc
+import time
+import queue
+import signal
+import multiprocessing
+from dataclasses import dataclass
+from multiprocessing.context import ForkProcess
+from typing import Callable, Dict, List, Optional, Tuple
+
+from logger import logger, forward_logs, listen_logs
+from metrics import Counter, Gauge, registry, push_metrics, start_metrics_server
+
+
+__all__ = [
+    "Supervisor",
+]
+
+
+WorkerTarget = Callable[[str], None]
+
+worker_restarts = Counter(
+    "supervisor_worker_restarts_total",
+    "Restarts of the worker processes",
+    ["name"],
+)
+worker_up = Gauge(
+    "supervisor_worker_up",
+    "Whether the worker process is alive",
+    ["name"],
+)
+
+
+@dataclass
+class Worker:
+    """
+    The state of one worker process.
+    """
+
+    bot_name: str
+    index: int
+    process: Optional[ForkProcess] = None
+    restarts: int = 0
+    started_at: float = 0.0
+    restart_delay: float = 1.0
+    restart_at: float = 0.0
+
+    @property
+    def name(self) -> str:
+        return f"{self.bot_name}-{self.index}"
+
+
+class Supervisor:
+    """
+    Runs the bots in separate processes and restarts the crashed ones.
+    Each bot gets `workers[bot_name]` processes (more than one makes sense
+    only in the webhook mode, the processes then share the port). The
+    processes are forked after the corpora are loaded, so the read-only
+    data is shared by all the workers.
+    The logs of all the workers are sent to the supervisor and written by
+    it to the usual files. The metrics of the workers are also sent to
+    the supervisor and served by it (if `metrics_address` is set).
+    """
+
+    # the worker that lived longer than this is considered stable, and
+    # its restart delay is reset
+    stable_time = 60.0
+    max_restart_delay = 60.0
+    check_interval = 1.0
+
+    workers: List[Worker]
+
+    def __init__(
+            self,
+            target: WorkerTarget,
+            workers: Dict[str, int],
+            metrics_address: Optional[Tuple[str, int]] = None,
+    ):
+        self.target = target
+        self.metrics_address = metrics_address
+        self.workers = [
+            Worker(bot_name, index)
+            for bot_name, count in workers.items()
+            for index in range(count)
+        ]
+        self.context = multiprocessing.get_context("fork")
+        self.log_queue = self.context.Queue()
+        self.metrics_queue = self.context.Queue()
+        self.is_running = False
+        self.is_reloading = False
+
+    def run_worker(self, worker_name: str, bot_name: str):
+        """
+        The entry point of the worker process.
+        """
+
+        forward_logs(self.log_queue)
+        # the worker reports only its own metrics
+        registry.unregister(worker_restarts)
+        registry.unregister(worker_up)
+        push_metrics(self.metrics_queue, worker_name)
+        # the supervisor stops the workers by SIGTERM, the default handler
+        # is enough for them
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        self.target(bot_name)
+
+    def start_worker(self, worker: Worker):
+        worker.process = self.context.Process(
+            target=self.run_worker,
+            args=(worker.name, worker.bot_name),
+            name=worker.name,
+            daemon=True,
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker_up.labels(worker.name).set(1)
+        logger(f"Worker <{worker.name}> has started (pid {worker.process.pid})")
+
+    def check_worker(self, worker: Worker):
+        """
+        Restarts the worker if it is dead. Workers that crash right after
+        the start are restarted with an increasing delay.
+        """
+
+        if worker.process is not None and worker.process.is_alive():
+            return
+
+        now = time.monotonic()
+        if worker.process is not None:
+            exitcode = worker.process.exitcode
+            worker.process.close()
+            worker.process = None
+            worker_up.labels(worker.name).set(0)
+
+            if now - worker.started_at > self.stable_time:
+                worker.restart_delay = 1.0
+            else:
+                worker.restart_delay = min(worker.restart_delay * 2, self.max_restart_delay)
+            worker.restart_at = now + worker.restart_delay
+            logger.error(
+                f"Worker <{worker.name}> has died (exit code {exitcode}),"
+                f" restart in {worker.restart_delay:.0f} s"
+            )
+
+        if now >= worker.restart_at:
+            worker.restarts += 1
+            worker_restarts.labels(worker.name).inc()
+            self.start_worker(worker)
+
+    def collect_metrics(self):
+        """
+        Takes the latest metric snapshots sent by the workers.
+        """
+
+        while True:
+            try:
+                worker_name, snapshot = self.metrics_queue.get_nowait()
+            except queue.Empty:
+                return
+            registry.remote[worker_name] = snapshot
+
+    def restart_workers(self):
+        """
+        Restarts the workers one by one (on SIGHUP, `systemctl reload`, or
+        after the corpora are reloaded), so the other workers of a bot
+        keep answering meanwhile. The workers are forked from the
+        supervisor, so they start with empty caches and new connections,
+        but with the code and the corpora of the supervisor: a new
+        version of the code needs a full restart.
+        """
+
+        self.is_reloading = False
+        # the new corpora are shared by the workers as at the start
+        gc.collect()
+        gc.freeze()
+        logger(f"Supervisor is restarting {len(self.workers)} workers")
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.terminate()
+                worker.process.join()
+                worker.process.close()
+                worker.process = None
+            worker.restart_delay = 1.0
+            worker.restarts += 1
+            worker_restarts.labels(worker.name).inc()
+            self.start_worker(worker)
+
+    def stop(self, *_):
+        self.is_running = False
+
+    def reload(self, *_):
+        self.is_reloading = True
+
+    def run(self):
+        """
+        Starts all the workers and watches them until SIGTERM/SIGINT,
+        SIGHUP restarts them.
+        """
+
+        # the objects created before the fork are not collected by the
+        # gc, so their memory pages stay shared with the workers
+        gc.collect()
+        gc.freeze()
+
+        listener = listen_logs(self.log_queue)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.reload)
+
+        self.is_running = True
+        for worker in self.workers:
+            self.start_worker(worker)
+        logger(f"Supervisor has started {len(self.workers)} workers")
+        if self.metrics_address is not None:
+            start_metrics_server(*self.metrics_address)
+
+        try:
+            while self.is_running:
+                time.sleep(self.check_interval)
+                self.collect_metrics()
+                if self.is_reloading and self.is_running:
+                    self.restart_workers()
+                for worker in self.workers:
+                    if self.is_running:
+                        self.check_worker(worker)
+        finally:
+            for worker in self.workers:
+                if worker.process is not None:
+                    worker.process.terminate()
+            for worker in self.workers:
+                if worker.process is not None:
+                    worker.process.join()
+            logger("Supervisor has stopped")
+            listener.stop()
@@ -0,0 +1,178 @@
+"""
+Tracing of the handled requests.
+For each update a `RequestTrace` is created, the code that handles the
+request adds timings of its stages to the current trace, and at the end
+the trace is written as one line to `logs/requests.jsonl`.
+"""
+
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Iterator, List, Optional, Union
+
+from envs import envs
+from logger import get_logger
+from metrics import Counter, Histogram
+
+
+__all__ = [
+    "RequestTrace",
+    "current_trace",
+    "start_trace",
+    "finish_trace",
+    "timed",
+    "trace_translation",
+    "trace_seed",
+    "trace_cache_hit",
+    "trace_outcome",
+]
+
+
+request_logger = get_logger("requests", "logs/requests.jsonl", "{msg}", "INFO")
+
+USER_SALT = str(envs.get("LOG_SALT", "")).encode()
+
+requests_total = Counter(
+    "bot_requests_total",
+    "Handled requests",
+    ["bot", "command", "outcome"],
+)
+request_duration = Histogram(
+    "bot_request_duration_seconds",
+    "Time from receiving the request to sending the answer",
+    ["bot", "command"],
+)
+
+
+def hash_user_id(user_id: int) -> str:
+    """
+    The user id is not stored as is, only its (salted) hash.
+    """
+    return hashlib.blake2b(str(user_id).encode(), digest_size=8, key=USER_SALT).hexdigest()
+
+
+@dataclass
+class RequestTrace:
+    """
+    Timings (in milliseconds) and the result of one handled request.
+    """
+
+    bot: str
+    command: str
+    user: str
+    timestamp: float = field(default_factory=time.time)
+    generation_ms: float = 0.0
+    translations: List[Dict[str, Union[str, float, bool]]] = field(default_factory=list)
+    send_ms: float = 0.0
+    total_ms: float = 0.0
+    cache_hits: int = 0
+    # the seed of the generation, repeats the generated text exactly
+    seed: Optional[int] = None
+    outcome: str = "ok"
+    _started: float = field(default_factory=time.perf_counter, repr=False)
+
+    def add_time(self, stage: str, seconds: float):
+        attr = f"{stage}_ms"
+        setattr(self, attr, getattr(self, attr) + seconds * 1000)
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        del data["_started"]
+        for key in ("generation_ms", "send_ms", "total_ms"):
+            data[key] = round(data[key], 3)
+        return json.dumps(data, ensure_ascii=False)
+
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+def start_trace(bot: str, command: str, user_id: int) -> RequestTrace:
+    """
+    Creates a trace and makes it current for the handled request.
+    """
+
+    trace = RequestTrace(bot.strip(), command, hash_user_id(user_id))
+    current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace: RequestTrace, outcome: Optional[str] = None):
+    """
+    Completes the trace, writes it to the log (the writing itself is
+    done by the logger thread) and updates the request metrics.
+    """
+
+    if outcome is not None:
+        trace.outcome = outcome
+    duration = time.perf_counter() - trace._started
+    trace.total_ms = duration * 1000
+    request_logger.info(trace.to_json())
+
+    requests_total.labels(trace.bot, trace.command, trace.outcome).inc()
+    request_duration.labels(trace.bot, trace.command).observe(duration)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Adds the execution time of the block to the `stage` of the current
+    trace (if there is one).
+    """
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_time(stage, time.perf_counter() - started)
+
+
+def trace_translation(translator: str, from_lang: str, to_lang: str, seconds: float, success: bool):
+    """
+    Adds a translation hop to the current trace.
+    """
+
+    trace = current_trace.get()
+    if trace is not None:
+        trace.translations.append({
+            "translator": translator,
+            "from": from_lang,
+            "to": to_lang,
+            "ms": round(seconds * 1000, 3),
+            "ok": success,
+        })
+
+
+def trace_seed(seed: int):
+    """
+    Adds the seed of the generation to the current trace.
+    """
+
+    trace = current_trace.get()
+    if trace is not None:
+        trace.seed = seed
+
+
+def trace_cache_hit():
+    """
+    Counts a cached result (a reply or a translation) in the current
+    trace.
+    """
+
+    trace = current_trace.get()
+    if trace is not None:
+        trace.cache_hits += 1
+
+
+def trace_outcome(outcome: str):
+    """
+    Sets the result of the current request (if it is not failed yet).
+    """
+
+    trace = current_trace.get()
+    if trace is not None and trace.outcome == "ok":
+        trace.outcome = outcome
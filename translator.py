@@ -1,10 +1,14 @@
+import time
+import asyncio
+from collections import deque
 from abc import ABC, abstractmethod
-from typing import Dict, List, Final
+from typing import Deque, Dict, List, Final, Optional
 
 import aiohttp
 from asyncio.exceptions import TimeoutError
 
 from envs import envs
+from metrics import Counter, Histogram
 
 
 __all__ = [
@@ -22,6 +26,18 @@ LINGVANEX_TOKEN: Final[str] = envs["LINGVANEX_TOKEN"]
 
 TIMEOUT = 10
 
+translation_duration = Histogram(
+    "translator_request_duration_seconds",
+    "Duration of the requests to the translators",
+    ["translator", "status"],
+)
+hedged_requests = Counter(
+    "translator_hedged_requests_total",
+    "Translations by the primary translator and whether the request was"
+    " hedged to the secondary one and which one won",
+    ["translator", "outcome"],
+)
+
 
 class TranslationRequestException(Exception):
     """
@@ -47,6 +63,9 @@ class BaseTranslator(ABC):
 
     url: str
     headers: dict
+    # the codes of the languages that differ from the ones of LingvaNex
+    # (which are used by the bot), by the LingvaNex codes
+    language_codes: Dict[str, str] = {}
 
     async def __call__(self, text: str, from_lang: str = "", to_lang: str = "ru") -> str:
         """
@@ -54,10 +73,15 @@ class BaseTranslator(ABC):
         from the response.
         """
 
+        from_lang = self.language_code(from_lang) if from_lang else from_lang
+        to_lang = self.language_code(to_lang)
         response_json = await self.send_request(text, from_lang, to_lang)
         translated_text = self.parse_response(response_json)
         return translated_text
 
+    def language_code(self, code: str) -> str:
+        return self.language_codes.get(code, code)
+
     @staticmethod
     async def execute_post(*args, **kwargs) -> dict:
         """
@@ -155,6 +179,14 @@ class WatsonTranslator(BaseTranslator):
     url = "https://www.ibm.com/demos/live/watson-language-translator/api/translate/text"
     url_detect = "https://www.ibm.com/demos/live/watson-language-translator/api/translate/detect"
     headers = {}
+    language_codes = {
+        "zh-Hans_CN": "zh",
+        "zh-Hant_TW": "zh-TW",
+    }
+
+    def language_code(self, code: str) -> str:
+        # "en_GB" of LingvaNex is "en" in Watson
+        return self.language_codes.get(code, code.split("_")[0])
 
     async def detect_language(self, text: str) -> str:
         """
@@ -194,10 +226,42 @@ class WatsonTranslator(BaseTranslator):
         return response["payload"]["translations"][0]["translation"]
 
 
+class LatencyWindow:
+    """
+    The durations of the last `size` requests to a translator.
+    """
+
+    def __init__(self, size: int = 200, min_count: int = 20):
+        self.durations: Deque[float] = deque(maxlen=size)
+        self.min_count = min_count
+
+    def add(self, seconds: float):
+        self.durations.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        None while there are too few requests.
+        """
+
+        if len(self.durations) < self.min_count:
+            return None
+        durations = sorted(self.durations)
+        return durations[min(int(q * len(durations)), len(durations) - 1)]
+
+
 class TextTranslator:
+    """
+    With `envs["HEDGING"]` (the secondary translator by the primary one,
+    `{"lin": "wat"}`), the request is hedged: if the primary translator
+    does not answer in its usual time (`hedge_quantile` of the last
+    durations), the same request is sent to the secondary one, the first
+    successful answer is returned, and the other request is cancelled.
+    """
+
     defaults_translator = "lin"
     default_from = ""
     default_to = "ru"
+    hedge_quantile = 0.9
     translators: Dict[str, BaseTranslator]
     translator_names: List[str]
 
@@ -209,9 +273,86 @@ class TextTranslator:
         }
         self.translator_names = list(self.translators)
 
-    async def __call__(self, text: str, translator_name: str, from_lang: str, to_lang: str) -> str:
+        # the addresses can be replaced, for example, by a local fake
+        # translator for load testing
+        for name, urls in envs.get("TRANSLATOR_URLS", {}).items():
+            for attr, url in urls.items():
+                setattr(self.translators[name], attr, url)
+
+        self.hedging: Dict[str, str] = envs.get("HEDGING", {})
+        for primary_name, secondary_name in self.hedging.items():
+            if primary_name not in self.translators or secondary_name not in self.translators:
+                raise ValueError(f"Unknown translator in HEDGING: {primary_name} -> {secondary_name}")
+        self.latencies = {name: LatencyWindow() for name in self.translators}
+
+    async def request(
+            self,
+            text: str,
+            translator_name: str,
+            from_lang: str,
+            to_lang: str,
+            is_hedge: bool = False,
+    ) -> str:
+        """
+        One request to the translator (`is_hedge` for the request to the
+        secondary translator).
+        """
+
         translator = self.translators[translator_name]
-        return await translator(text, from_lang, to_lang)
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await translator(text, from_lang, to_lang)
+            status = "ok"
+            return result
+        except TranslationTimeoutException:
+            status = "timeout"
+            raise
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            translation_duration.labels(translator_name, status).observe(duration)
+            # the fast errors say nothing about the usual time; the
+            # cancelled primary requests were slow at least that long,
+            # without them the slow answers would never get into the
+            # window (the cancelled hedges are cancelled too early)
+            if status in ("ok", "timeout") or status == "cancelled" and not is_hedge:
+                self.latencies[translator_name].add(duration)
+
+    async def __call__(self, text: str, translator_name: str, from_lang: str, to_lang: str) -> str:
+        secondary_name = self.hedging.get(translator_name)
+        hedge_delay = None
+        if secondary_name is not None:
+            hedge_delay = self.latencies[translator_name].quantile(self.hedge_quantile)
+        if hedge_delay is None:
+            return await self.request(text, translator_name, from_lang, to_lang)
+
+        primary = asyncio.create_task(self.request(text, translator_name, from_lang, to_lang))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if done:
+                hedged_requests.labels(translator_name, "not_hedged").inc()
+                return primary.result()
+
+            secondary = asyncio.create_task(self.request(text, secondary_name, from_lang, to_lang, True))
+            tasks.add(secondary)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        outcome = "primary_won" if task is primary else "secondary_won"
+                        hedged_requests.labels(translator_name, outcome).inc()
+                        return task.result()
+
+            hedged_requests.labels(translator_name, "failed").inc()
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
 
 
 text_translator = TextTranslator()
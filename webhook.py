@@ -0,0 +1,99 @@
+import json
+from typing import Dict
+
+from aiohttp import web
+from telegram import Update
+
+from logger import logger, log_exception
+from dispatcher import UpdateDispatcher
+
+
+__all__ = [
+    "WebhookServer",
+]
+
+
+class WebhookServer:
+    """
+    A local HTTP server that receives updates from Telegram instead of
+    long polling.
+    Each bot has its own route `/webhook/<bot name>/<token>` (the name
+    lets a reverse proxy send the updates of each bot to the port of its
+    server, the token in the path is also a protection against fake
+    updates). The received update is
+    immediately passed to the `UpdateDispatcher` of the bot, so the
+    server answers Telegram without waiting for the handler and several
+    updates are processed concurrently.
+    """
+
+    host: str
+    port: int
+    bots: Dict[str, UpdateDispatcher]
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8443, reuse_port: bool = False):
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.bots = {}
+
+        self.web_app = web.Application()
+        self.web_app.router.add_post("/webhook/{bot}/{token}", self.receive_update)
+        self.runner = web.AppRunner(self.web_app)
+
+    @staticmethod
+    def get_path(name: str, token: str) -> str:
+        """
+        Returns the route path for the bot with the given name and token.
+        """
+        return f"/webhook/{name}/{token}"
+
+    def add_bot(self, name: str, token: str, dispatcher: UpdateDispatcher) -> str:
+        """
+        Registers the bot dispatcher and returns the path of its route.
+        Bots can be added after the server has started.
+        """
+
+        self.bots[token] = dispatcher
+        return self.get_path(name, token)
+
+    async def receive_update(self, request: web.Request) -> web.Response:
+        """
+        The handler of the bot route. Parses the update and passes it for
+        processing.
+        """
+
+        dispatcher = self.bots.get(request.match_info["token"])
+        if dispatcher is None:
+            return web.Response(status=404)
+
+        try:
+            data = await request.json()
+            update = Update.de_json(data, dispatcher.app.bot)
+        except (json.JSONDecodeError, TypeError, KeyError) as exc:
+            log_exception(exc, short=False)
+            return web.Response(status=400)
+
+        dispatcher.submit(update)
+        return web.Response()
+
+    async def start(self):
+        """
+        Starts listening on `self.host:self.port`. With `reuse_port`
+        several processes can listen on the same port, the connections are
+        distributed between them by the system, so all of them must serve
+        the same bots.
+        """
+
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port, reuse_port=self.reuse_port)
+        await site.start()
+        logger(f"Webhook server has started on {self.host}:{self.port}")
+
+    async def stop(self):
+        """
+        Waits for the updates being processed and stops the server.
+        """
+
+        for dispatcher in self.bots.values():
+            await dispatcher.stop()
+        await self.runner.cleanup()